@@ -0,0 +1,109 @@
+"""
+Advisor of aggregate tables from history of saved queries
+
+    python -m advisor olap_sales
+    python -m advisor olap_sales --days 30 --max-tables 3 --max-mb 512 --output-dir olap_info/olap_sales
+
+Settings of metadata database are read from environment as by application, OLAP database is read through the cube
+"""
+import argparse
+import asyncio
+import datetime
+import logging
+import os
+import sys
+
+from core.database import SessionLocal
+from model.dto import AggregateRecommendation
+from olap_info.olap_sales_cube import add_cube_from_olap_table
+from service.aggregate_advisor import advise_aggregates
+from service.cube import CubeCollection
+from service.db import get_all_olap_cubes, get_saved_query_payloads
+
+
+def create_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="python -m advisor",
+                                     description="Advisor of aggregate tables from history of saved queries")
+    parser.add_argument("cube_name", help="name of the cube in olap_table")
+    parser.add_argument("--days", type=int, help="use queries saved in last days. All queries if not set")
+    parser.add_argument("--max-tables", type=int, default=5, help="maximum number of recommended tables")
+    parser.add_argument("--max-mb", type=float, help="maximum size of all recommended tables in megabytes")
+    parser.add_argument("--rows-per-second", type=int, default=10_000_000,
+                        help="rows warehouse reads per second, it converts rows saved to time")
+    parser.add_argument("--max-patterns", type=int, default=30,
+                        help="candidates are created from pairs of this number of the most frequent query patterns")
+    parser.add_argument("--output-dir",
+                        help="directory of the cube, aggregates.sql and data/*.toml are written to it")
+
+    return parser
+
+
+def print_recommendations(recommendations: list[AggregateRecommendation], payloads_no: int, skipped_no: int) -> None:
+    print(f"Saved queries: {payloads_no}, could not be answered by aggregate table: {skipped_no}")
+    print(f"{'#':<3} {'table':<48} {'queries':>8} {'rows':>12} {'size MB':>10} {'seconds saved':>14}")
+
+    for rank, recommendation in enumerate(recommendations, start=1):
+        print(f"{rank:<3} {recommendation.table_name:<48} {recommendation.queries_no:>8} "
+              f"{recommendation.rows_no:>12} {recommendation.size_bytes / 1024 ** 2:>10.2f} "
+              f"{recommendation.seconds_saved:>14.2f}")
+
+    for recommendation in recommendations:
+        print(f"\n-- {recommendation.table_name}\n{recommendation.ddl}")
+        print(f"# data/{recommendation.table_name.split('.')[-1]}.toml\n{recommendation.toml}")
+
+
+def write_recommendations(recommendations: list[AggregateRecommendation], output_dir: str) -> None:
+    """
+    Writes DDL of all tables to aggregates.sql and .toml file of every table to data/
+    :param recommendations: recommended tables
+    :param output_dir: directory of the cube
+    :return: None
+    """
+    os.makedirs(os.path.join(output_dir, "data"), exist_ok=True)
+
+    with open(os.path.join(output_dir, "aggregates.sql"), "w", encoding="utf-8") as ddl_file:
+        ddl_file.write("\n".join(recommendation.ddl for recommendation in recommendations))
+
+    for recommendation in recommendations:
+        file_path: str = os.path.join(output_dir, "data", f"{recommendation.table_name.split('.')[-1]}.toml")
+
+        with open(file_path, "w", encoding="utf-8") as toml_file:
+            toml_file.write(recommendation.toml)
+
+
+def main() -> int:
+    arguments: argparse.Namespace = create_parser().parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    created_after: datetime.datetime | None = None
+
+    if arguments.days is not None:
+        created_after = datetime.datetime.now() - datetime.timedelta(days=arguments.days)
+
+    with SessionLocal() as db:
+        olap_tables = [cube for cube in get_all_olap_cubes(db) if cube.name == arguments.cube_name]
+        payloads: list[str] = get_saved_query_payloads(db, arguments.cube_name, created_after)
+
+    if len(olap_tables) == 0:
+        print(f"Cube {arguments.cube_name} is not in olap_table", file=sys.stderr)
+        return 1
+
+    cubes: CubeCollection = CubeCollection()
+    add_cube_from_olap_table(olap_tables[0], cubes)
+    asyncio.run(cubes.refresh_table_statistics_async(arguments.cube_name))
+
+    max_bytes: int | None = None if arguments.max_mb is None else int(arguments.max_mb * 1024 ** 2)
+
+    recommendations, skipped_no = advise_aggregates(cubes, arguments.cube_name, payloads, arguments.max_tables,
+                                                    max_bytes, arguments.rows_per_second, arguments.max_patterns)
+
+    print_recommendations(recommendations, len(payloads), skipped_no)
+
+    if arguments.output_dir:
+        write_recommendations(recommendations, arguments.output_dir)
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,38 @@
+"""add keyset pagination to saved_query
+
+Revision ID: 1e17e28d8a06
+Revises: 4ab3a49cd79e
+Create Date: 2026-10-18 12:10:21.402113
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy import text
+
+# revision identifiers, used by Alembic.
+revision: str = '1e17e28d8a06'
+down_revision: Union[str, None] = '4ab3a49cd79e'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    conn = op.get_bind()
+    conn.execute(text("""
+
+        ALTER TABLE comradewolf.saved_query ADD order_by_keys varchar NULL;
+        ALTER TABLE comradewolf.saved_query ADD page_keys varchar NULL;
+
+        """))
+
+
+def downgrade() -> None:
+    conn = op.get_bind()
+    conn.execute(text("""
+
+            ALTER TABLE comradewolf.saved_query DROP COLUMN order_by_keys;
+            ALTER TABLE comradewolf.saved_query DROP COLUMN page_keys;
+
+            """))
@@ -0,0 +1,36 @@
+"""add row_count_strategy to olap_table
+
+Revision ID: 3f8a61c2d4b7
+Revises: 7c5d0e9b3f21
+Create Date: 2026-10-18 15:21:09.530472
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy import text
+
+# revision identifiers, used by Alembic.
+revision: str = '3f8a61c2d4b7'
+down_revision: Union[str, None] = '7c5d0e9b3f21'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    conn = op.get_bind()
+    conn.execute(text("""
+
+        ALTER TABLE comradewolf.olap_table ADD row_count_strategy varchar(25) NULL;
+
+        """))
+
+
+def downgrade() -> None:
+    conn = op.get_bind()
+    conn.execute(text("""
+
+            ALTER TABLE comradewolf.olap_table DROP COLUMN row_count_strategy;
+
+            """))
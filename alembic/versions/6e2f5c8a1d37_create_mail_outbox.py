@@ -0,0 +1,51 @@
+"""create mail_outbox
+
+Revision ID: 6e2f5c8a1d37
+Revises: d9e4a7f01b63
+Create Date: 2026-10-18 19:02:17.530214
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy import text
+
+# revision identifiers, used by Alembic.
+revision: str = '6e2f5c8a1d37'
+down_revision: Union[str, None] = 'd9e4a7f01b63'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    conn = op.get_bind()
+    conn.execute(text("""
+
+        CREATE TABLE comradewolf.mail_outbox (
+            id bigserial NOT NULL,
+            email_to varchar(250) NOT NULL,
+            subject varchar(250) NOT NULL,
+            html_content varchar NOT NULL,
+            status varchar(25) NOT NULL DEFAULT 'pending',
+            attempts int4 NOT NULL DEFAULT 0,
+            next_attempt_at timestamp NOT NULL DEFAULT now(),
+            last_error varchar NULL,
+            created_at timestamp NOT NULL DEFAULT now(),
+            sent_at timestamp NULL,
+            CONSTRAINT mail_outbox_pk PRIMARY KEY (id)
+        );
+
+        CREATE INDEX mail_outbox_status_next_attempt_at_idx
+            ON comradewolf.mail_outbox (status, next_attempt_at);
+
+        """))
+
+
+def downgrade() -> None:
+    conn = op.get_bind()
+    conn.execute(text("""
+
+            DROP TABLE comradewolf.mail_outbox;
+
+            """))
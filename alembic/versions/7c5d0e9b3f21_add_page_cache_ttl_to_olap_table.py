@@ -0,0 +1,36 @@
+"""add page_cache_ttl to olap_table
+
+Revision ID: 7c5d0e9b3f21
+Revises: 1e17e28d8a06
+Create Date: 2026-10-18 14:02:47.118305
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy import text
+
+# revision identifiers, used by Alembic.
+revision: str = '7c5d0e9b3f21'
+down_revision: Union[str, None] = '1e17e28d8a06'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    conn = op.get_bind()
+    conn.execute(text("""
+
+        ALTER TABLE comradewolf.olap_table ADD page_cache_ttl int4 NULL;
+
+        """))
+
+
+def downgrade() -> None:
+    conn = op.get_bind()
+    conn.execute(text("""
+
+            ALTER TABLE comradewolf.olap_table DROP COLUMN page_cache_ttl;
+
+            """))
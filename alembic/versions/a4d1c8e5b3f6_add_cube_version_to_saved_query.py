@@ -0,0 +1,36 @@
+"""add cube_version to saved_query
+
+Revision ID: a4d1c8e5b3f6
+Revises: f2a7c9e4b810
+Create Date: 2026-10-18 23:58:21.402715
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy import text
+
+# revision identifiers, used by Alembic.
+revision: str = 'a4d1c8e5b3f6'
+down_revision: Union[str, None] = 'f2a7c9e4b810'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    conn = op.get_bind()
+    conn.execute(text("""
+
+        ALTER TABLE comradewolf.saved_query ADD cube_version varchar(64) NULL;
+
+        """))
+
+
+def downgrade() -> None:
+    conn = op.get_bind()
+    conn.execute(text("""
+
+            ALTER TABLE comradewolf.saved_query DROP COLUMN cube_version;
+
+            """))
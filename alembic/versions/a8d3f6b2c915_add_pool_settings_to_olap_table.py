@@ -0,0 +1,44 @@
+"""add pool settings to olap_table
+
+Revision ID: a8d3f6b2c915
+Revises: 6e2f5c8a1d37
+Create Date: 2026-10-18 20:11:48.917362
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy import text
+
+# revision identifiers, used by Alembic.
+revision: str = 'a8d3f6b2c915'
+down_revision: Union[str, None] = '6e2f5c8a1d37'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    conn = op.get_bind()
+    conn.execute(text("""
+
+        ALTER TABLE comradewolf.olap_table ADD pool_size int4 NULL;
+        ALTER TABLE comradewolf.olap_table ADD max_overflow int4 NULL;
+        ALTER TABLE comradewolf.olap_table ADD pool_recycle int4 NULL;
+        ALTER TABLE comradewolf.olap_table ADD pool_pre_ping bool NULL;
+        ALTER TABLE comradewolf.olap_table ADD connect_timeout int4 NULL;
+
+        """))
+
+
+def downgrade() -> None:
+    conn = op.get_bind()
+    conn.execute(text("""
+
+            ALTER TABLE comradewolf.olap_table DROP COLUMN connect_timeout;
+            ALTER TABLE comradewolf.olap_table DROP COLUMN pool_pre_ping;
+            ALTER TABLE comradewolf.olap_table DROP COLUMN pool_recycle;
+            ALTER TABLE comradewolf.olap_table DROP COLUMN max_overflow;
+            ALTER TABLE comradewolf.olap_table DROP COLUMN pool_size;
+
+            """))
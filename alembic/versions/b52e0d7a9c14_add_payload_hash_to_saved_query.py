@@ -0,0 +1,47 @@
+"""add payload_hash to saved_query
+
+Revision ID: b52e0d7a9c14
+Revises: 3f8a61c2d4b7
+Create Date: 2026-10-18 16:40:12.835120
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy import text
+
+# revision identifiers, used by Alembic.
+revision: str = 'b52e0d7a9c14'
+down_revision: Union[str, None] = '3f8a61c2d4b7'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    conn = op.get_bind()
+    conn.execute(text("""
+
+        ALTER TABLE comradewolf.saved_query ADD cube_name varchar(50) NULL;
+        ALTER TABLE comradewolf.saved_query ADD payload_hash varchar(64) NULL;
+        ALTER TABLE comradewolf.saved_query ADD is_rows_no_exact bool NOT NULL DEFAULT true;
+        ALTER TABLE comradewolf.saved_query ADD created_at timestamp NULL DEFAULT now();
+
+        CREATE INDEX saved_query_cube_name_payload_hash_idx
+            ON comradewolf.saved_query (cube_name, payload_hash, created_at DESC);
+
+        """))
+
+
+def downgrade() -> None:
+    conn = op.get_bind()
+    conn.execute(text("""
+
+            DROP INDEX comradewolf.saved_query_cube_name_payload_hash_idx;
+
+            ALTER TABLE comradewolf.saved_query DROP COLUMN cube_name;
+            ALTER TABLE comradewolf.saved_query DROP COLUMN payload_hash;
+            ALTER TABLE comradewolf.saved_query DROP COLUMN is_rows_no_exact;
+            ALTER TABLE comradewolf.saved_query DROP COLUMN created_at;
+
+            """))
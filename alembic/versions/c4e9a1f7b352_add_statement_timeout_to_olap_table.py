@@ -0,0 +1,36 @@
+"""add statement_timeout to olap_table
+
+Revision ID: c4e9a1f7b352
+Revises: a8d3f6b2c915
+Create Date: 2026-10-18 21:03:26.148730
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy import text
+
+# revision identifiers, used by Alembic.
+revision: str = 'c4e9a1f7b352'
+down_revision: Union[str, None] = 'a8d3f6b2c915'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    conn = op.get_bind()
+    conn.execute(text("""
+
+        ALTER TABLE comradewolf.olap_table ADD statement_timeout int4 NULL;
+
+        """))
+
+
+def downgrade() -> None:
+    conn = op.get_bind()
+    conn.execute(text("""
+
+            ALTER TABLE comradewolf.olap_table DROP COLUMN statement_timeout;
+
+            """))
@@ -0,0 +1,69 @@
+"""create acl_version
+
+Revision ID: d9e4a7f01b63
+Revises: b52e0d7a9c14
+Create Date: 2026-10-18 17:35:44.207961
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy import text
+
+# revision identifiers, used by Alembic.
+revision: str = 'd9e4a7f01b63'
+down_revision: Union[str, None] = 'b52e0d7a9c14'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    conn = op.get_bind()
+    conn.execute(text("""
+
+        CREATE TABLE comradewolf.acl_version (
+            id int4 NOT NULL DEFAULT 1,
+            "version" int8 NOT NULL DEFAULT 0,
+            CONSTRAINT acl_version_pk PRIMARY KEY (id),
+            CONSTRAINT acl_version_one_row CHECK (id = 1)
+        );
+
+        INSERT INTO comradewolf.acl_version (id, "version") VALUES (1, 0);
+
+        CREATE OR REPLACE FUNCTION comradewolf.increment_acl_version() RETURNS trigger
+        LANGUAGE plpgsql AS $$
+        BEGIN
+            UPDATE comradewolf.acl_version SET "version" = "version" + 1 WHERE id = 1;
+            RETURN NULL;
+        END;
+        $$;
+
+        CREATE TRIGGER user_olap_acl_version
+            AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON comradewolf.user_olap
+            FOR EACH STATEMENT EXECUTE FUNCTION comradewolf.increment_acl_version();
+
+        CREATE TRIGGER olap_table_acl_version
+            AFTER UPDATE OF "name" OR DELETE ON comradewolf.olap_table
+            FOR EACH STATEMENT EXECUTE FUNCTION comradewolf.increment_acl_version();
+
+        CREATE TRIGGER app_user_acl_version
+            AFTER UPDATE OF username OR DELETE ON comradewolf.app_user
+            FOR EACH STATEMENT EXECUTE FUNCTION comradewolf.increment_acl_version();
+
+        """))
+
+
+def downgrade() -> None:
+    conn = op.get_bind()
+    conn.execute(text("""
+
+            DROP TRIGGER app_user_acl_version ON comradewolf.app_user;
+            DROP TRIGGER olap_table_acl_version ON comradewolf.olap_table;
+            DROP TRIGGER user_olap_acl_version ON comradewolf.user_olap;
+
+            DROP FUNCTION comradewolf.increment_acl_version();
+
+            DROP TABLE comradewolf.acl_version;
+
+            """))
@@ -0,0 +1,36 @@
+"""add data_path to olap_table
+
+Revision ID: e5b8c2d7f419
+Revises: c4e9a1f7b352
+Create Date: 2026-10-18 22:41:09.532817
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy import text
+
+# revision identifiers, used by Alembic.
+revision: str = 'e5b8c2d7f419'
+down_revision: Union[str, None] = 'c4e9a1f7b352'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    conn = op.get_bind()
+    conn.execute(text("""
+
+        ALTER TABLE comradewolf.olap_table ADD data_path varchar(512) NULL;
+
+        """))
+
+
+def downgrade() -> None:
+    conn = op.get_bind()
+    conn.execute(text("""
+
+            ALTER TABLE comradewolf.olap_table DROP COLUMN data_path;
+
+            """))
@@ -0,0 +1,46 @@
+"""create materialized_view_refresh
+
+Revision ID: f2a7c9e4b810
+Revises: e5b8c2d7f419
+Create Date: 2026-10-18 23:37:45.118306
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy import text
+
+# revision identifiers, used by Alembic.
+revision: str = 'f2a7c9e4b810'
+down_revision: Union[str, None] = 'e5b8c2d7f419'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    conn = op.get_bind()
+    conn.execute(text("""
+
+        CREATE TABLE comradewolf.materialized_view_refresh (
+            id serial4 NOT NULL,
+            cube_name varchar(50) NOT NULL,
+            table_name varchar(250) NOT NULL,
+            definition_hash varchar(64) NOT NULL,
+            refresh_started_at timestamp NULL,
+            refreshed_at timestamp NULL,
+            last_error varchar NULL,
+            CONSTRAINT materialized_view_refresh_pk PRIMARY KEY (id),
+            CONSTRAINT materialized_view_refresh_cube_name_table_name_uq UNIQUE (cube_name, table_name)
+        );
+
+        """))
+
+
+def downgrade() -> None:
+    conn = op.get_bind()
+    conn.execute(text("""
+
+            DROP TABLE comradewolf.materialized_view_refresh;
+
+            """))
@@ -0,0 +1,227 @@
+import os
+import random
+
+from sqlalchemy import Connection, text
+
+# Years of generated fact table
+FIRST_YEAR: int = 2020
+YEARS_NO: int = 5
+
+
+class SyntheticCube:
+    """
+    Generated cube for benchmarks:
+        - :param dimensions_no: dimension tables dim_<i> with service key and text name
+        - fact table fact_base with service keys of all dimensions, year, month, day and :param values_no: values
+        - :param aggregates_no: aggregate tables fact_agg_<k>, each is grouped by random subset of fact_base fields
+    The same seed creates the same .toml files and the same data, so results of different commits are comparable
+    """
+
+    def __init__(self, name: str, database: str, dimensions_no: int, aggregates_no: int, rows_no: int,
+                 dimension_rows_no: int = 100, values_no: int = 2, seed: int = 42, schema: str = "bench") -> None:
+        """
+        :param name: name of the cube in olap_table
+        :param database: OLAP database name, it is written to .toml files
+        :param dimensions_no: number of dimension tables
+        :param aggregates_no: number of aggregate tables
+        :param rows_no: rows of fact table
+        :param dimension_rows_no: rows of every dimension table
+        :param values_no: number of value fields of fact table
+        :param seed: seed of structure and data
+        :param schema: schema of all tables
+        """
+        self.name: str = name
+        self.database: str = database
+        self.schema: str = schema
+        self.dimensions_no: int = max(dimensions_no, 1)
+        self.aggregates_no: int = max(aggregates_no, 0)
+        self.rows_no: int = rows_no
+        self.dimension_rows_no: int = max(dimension_rows_no, 1)
+        self.values_no: int = max(values_no, 1)
+        self.seed: int = seed
+
+        self.__aggregates: list[tuple[list[int], list[str]]] = self.__create_aggregates()
+
+    def get_parameters(self) -> dict:
+        """
+        Parameters of the cube, they are saved with benchmark results
+        :return: dict
+        """
+        return {
+            "dimensions": self.dimensions_no,
+            "aggregates": self.aggregates_no,
+            "rows": self.rows_no,
+            "dimension_rows": self.dimension_rows_no,
+            "values": self.values_no,
+            "seed": self.seed,
+        }
+
+    def __create_aggregates(self) -> list[tuple[list[int], list[str]]]:
+        """
+        Chooses fields of aggregate tables. Every next aggregate has less dimensions
+        :return: list of dimension numbers and time fields of every aggregate table
+        """
+        rng: random.Random = random.Random(self.seed)
+        aggregates: list[tuple[list[int], list[str]]] = []
+
+        for aggregate_no in range(self.aggregates_no):
+            dimensions_in_aggregate: int = max(self.dimensions_no - 1 - aggregate_no, 0)
+            dimensions: list[int] = sorted(rng.sample(range(self.dimensions_no), dimensions_in_aggregate))
+            time_fields: list[str] = ["year_f", "month_f"] if aggregate_no % 2 == 0 else ["year_f"]
+            aggregates.append((dimensions, time_fields))
+
+        return aggregates
+
+    def write_toml(self, directory: str) -> str:
+        """
+        Writes .toml files of the cube in format of olap_info
+        :param directory: directory of the cube, data/ and dimension/ are created inside
+        :return: directory
+        """
+        os.makedirs(os.path.join(directory, "data"), exist_ok=True)
+        os.makedirs(os.path.join(directory, "dimension"), exist_ok=True)
+
+        base_fields: list[str] = [self.__create_field(f"dim_{i}_id", "service_key", f"dim_{i}_id_alias",
+                                                      "none", "none", "none", "number")
+                                  for i in range(self.dimensions_no)]
+        base_fields += [self.__create_field(field, "dimension", f"{field}_alias", "none", "none", front_name,
+                                            "number") for field, front_name in self.__get_time_fields()]
+        base_fields += [self.__create_field(f"value_{j}", "value", f"value_{j}_alias", "none", "none",
+                                            f"Показатель {j}", "number") for j in range(self.values_no)]
+
+        self.__write_table(os.path.join(directory, "data", "fact_base.toml"), "fact_base", base_fields, True)
+
+        for aggregate_no, (dimensions, time_fields) in enumerate(self.__aggregates):
+            fields: list[str] = [self.__create_field(f"dim_{i}_id", "service_key", f"dim_{i}_id_alias", "none",
+                                                     "none", "none", "number") for i in dimensions]
+            fields += [self.__create_field(field, "dimension", f"{field}_alias", "none", "none", front_name,
+                                           "number") for field, front_name in self.__get_time_fields()
+                       if field in time_fields]
+            fields += [self.__create_field(f"sum_value_{j}", "value", f"value_{j}_alias", "sum", "sum",
+                                           f"Показатель {j}", "number") for j in range(self.values_no)]
+
+            self.__write_table(os.path.join(directory, "data", f"fact_agg_{aggregate_no}.toml"),
+                               f"fact_agg_{aggregate_no}", fields, False)
+
+        for i in range(self.dimensions_no):
+            fields = [
+                self.__create_field("id", "service_key", f"dim_{i}_id_alias", None, None, "none", "number"),
+                self.__create_field("name", "dimension", f"dim_{i}_name_alias", None, None, f"Справочник {i}", "text",
+                                    use_sk_for_count=True),
+            ]
+
+            self.__write_table(os.path.join(directory, "dimension", f"dim_{i}.toml"), f"dim_{i}", fields, None)
+
+        return directory
+
+    @staticmethod
+    def __get_time_fields() -> list[tuple[str, str]]:
+        return [("year_f", "Год"), ("month_f", "Месяц"), ("day_f", "День")]
+
+    @staticmethod
+    def __create_field(field_name: str, field_type: str, alias: str, calculation_type: str | None,
+                       following_calculation: str | None, front_name: str, data_type: str,
+                       use_sk_for_count: bool = False) -> str:
+        """
+        Creates one line of [fields] section
+        :return: toml line
+        """
+        properties: list[str] = [f'field_type = "{field_type}"', f'alias = "{alias}"']
+
+        if calculation_type is not None:
+            properties.append(f'calculation_type = "{calculation_type}"')
+
+        if following_calculation is not None:
+            properties.append(f'following_calculation = "{following_calculation}"')
+
+        properties.append(f'front_name = "{front_name}"')
+
+        if use_sk_for_count:
+            properties.append('use_sk_for_count = "True"')
+
+        properties.append(f'data_type = "{data_type}"')
+
+        return f"{field_name} = {{{', '.join(properties)}}}"
+
+    def __write_table(self, file_path: str, table: str, fields: list[str], is_base_table: bool | None) -> None:
+        """
+        Writes .toml file of one table
+        :param file_path: path of the file
+        :param table: table name
+        :param fields: lines of [fields] section
+        :param is_base_table: value of base_table. None for dimension tables
+        :return: None
+        """
+        lines: list[str] = [f'table = "{table}"', f'schema = "{self.schema}"', f'database = "{self.database}"']
+
+        if is_base_table is not None:
+            lines.append(f'base_table = "{str(is_base_table).lower()}"')
+
+        lines += ["", "[fields]"] + fields
+
+        with open(file_path, "w", encoding="utf-8") as toml_file:
+            toml_file.write("\n".join(lines) + "\n")
+
+    def create_tables(self, connect: Connection) -> None:
+        """
+        Creates schema and tables of the cube and fills them with seeded data
+        Aggregate tables are grouped from fact table
+        :param connect: connection to OLAP database. Changes are committed by caller
+        :return: None
+        """
+        connect.execute(text(f"DROP SCHEMA IF EXISTS {self.schema} CASCADE"))
+        connect.execute(text(f"CREATE SCHEMA {self.schema}"))
+
+        for i in range(self.dimensions_no):
+            connect.execute(text(f"CREATE TABLE {self.schema}.dim_{i} (id int4 PRIMARY KEY, name text NOT NULL)"))
+            connect.execute(text(f"INSERT INTO {self.schema}.dim_{i} "
+                                 f"SELECT g, 'Значение {i}.' || g FROM generate_series(1, :rows_no) g"),
+                            {"rows_no": self.dimension_rows_no})
+
+        base_columns: list[str] = [f"dim_{i}_id int4" for i in range(self.dimensions_no)]
+        base_columns += ["year_f int4", "month_f int4", "day_f int4"]
+        base_columns += [f"value_{j} numeric" for j in range(self.values_no)]
+
+        connect.execute(text(f"CREATE TABLE {self.schema}.fact_base ({', '.join(base_columns)})"))
+
+        # setseed makes random() of this session repeatable
+        connect.execute(text("SELECT setseed(:seed)"), {"seed": (self.seed % 1000) / 1000})
+
+        base_values: list[str] = [f"1 + floor(random() * {self.dimension_rows_no})::int4"
+                                  for _ in range(self.dimensions_no)]
+        base_values += [f"{FIRST_YEAR} + floor(random() * {YEARS_NO})::int4", "1 + floor(random() * 12)::int4",
+                        "1 + floor(random() * 28)::int4"]
+        base_values += ["round((random() * 1000)::numeric, 2)" for _ in range(self.values_no)]
+
+        connect.execute(text(f"INSERT INTO {self.schema}.fact_base "
+                             f"SELECT {', '.join(base_values)} FROM generate_series(1, :rows_no)"),
+                        {"rows_no": self.rows_no})
+
+        for aggregate_no, (dimensions, time_fields) in enumerate(self.__aggregates):
+            group_columns: list[str] = [f"dim_{i}_id" for i in dimensions] + time_fields
+            value_columns: list[str] = [f"sum(value_{j}) AS sum_value_{j}" for j in range(self.values_no)]
+
+            connect.execute(text(f"CREATE TABLE {self.schema}.fact_agg_{aggregate_no} AS "
+                                 f"SELECT {', '.join(group_columns + value_columns)} "
+                                 f"FROM {self.schema}.fact_base GROUP BY {', '.join(group_columns)}"))
+
+        connect.execute(text("ANALYZE"))
+
+    def get_query_payloads(self) -> list[dict]:
+        """
+        Payloads of query_info. One payload per dimension: year, name from dimension and sum of first value
+        :return: list of FrontendFieldsJson dicts
+        """
+        return [{
+            "SELECT": [{"field_name": "year_f_alias"}, {"field_name": f"dim_{i}_name_alias"}],
+            "CALCULATION": [{"field_name": "value_0_alias", "calculation": "sum"}],
+            "WHERE": [],
+        } for i in range(self.dimensions_no)]
+
+    def get_distinct_payloads(self) -> list[dict]:
+        """
+        Payloads of filter_data and dimension. One payload per dimension
+        :return: list of FrontDistinctDTO dicts
+        """
+        return [{"SELECT_DISTINCT": {"field_name": f"dim_{i}_name_alias", "type": "all"}}
+                for i in range(self.dimensions_no)]
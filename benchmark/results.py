@@ -0,0 +1,161 @@
+import datetime
+import json
+import math
+import platform
+import subprocess
+from pathlib import Path
+
+# Version of results file. Files of different versions are not compared
+RESULTS_FORMAT_VERSION: int = 1
+
+# Metrics that are compared between runs. Lower is better for all of them
+COMPARED_METRICS: list[str] = ["p50_ms", "p99_ms"]
+
+
+def get_percentile(sorted_values: list[float], percentile: float) -> float:
+    """
+    Nearest-rank percentile
+    :param sorted_values: values sorted ascending
+    :param percentile: from 0 to 100
+    :return: value or 0.0 if there are no values
+    """
+    if len(sorted_values) == 0:
+        return 0.0
+
+    rank: int = max(math.ceil(percentile / 100 * len(sorted_values)), 1)
+
+    return sorted_values[rank - 1]
+
+
+def summarize(latencies: list[float], errors: int, wall_time: float) -> dict:
+    """
+    Creates summary of one benchmark
+    :param latencies: seconds of every successful call
+    :param errors: number of failed calls
+    :param wall_time: seconds from first call start to last call end
+    :return: dict with count, errors, latency percentiles in milliseconds and throughput in calls per second
+    """
+    latencies_ms: list[float] = sorted(latency * 1000 for latency in latencies)
+
+    return {
+        "count": len(latencies_ms),
+        "errors": errors,
+        "mean_ms": round(sum(latencies_ms) / len(latencies_ms), 4) if latencies_ms else 0.0,
+        "p50_ms": round(get_percentile(latencies_ms, 50), 4),
+        "p90_ms": round(get_percentile(latencies_ms, 90), 4),
+        "p99_ms": round(get_percentile(latencies_ms, 99), 4),
+        "max_ms": round(latencies_ms[-1], 4) if latencies_ms else 0.0,
+        "throughput_rps": round(len(latencies_ms) / wall_time, 2) if wall_time > 0 else 0.0,
+    }
+
+
+def get_git_revision() -> dict:
+    """
+    Commit of working tree, so results could be matched with code
+    :return: dict with commit and dirty flag. Values are None outside of git repository
+    """
+    repository: Path = Path(__file__).resolve().parent.parent
+
+    try:
+        commit: str = subprocess.run(["git", "rev-parse", "HEAD"], cwd=repository, capture_output=True, text=True,
+                                     check=True).stdout.strip()
+        status: str = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=repository,
+                                     capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return {"commit": None, "dirty": None}
+
+    return {"commit": commit, "dirty": len(status) > 0}
+
+
+def create_results(parameters: dict, results: dict[str, dict]) -> dict:
+    """
+    Creates content of results file
+    :param parameters: parameters of run. Only runs with the same parameters should be compared
+    :param results: summaries by benchmark name
+    :return: dict
+    """
+    return {
+        "format_version": RESULTS_FORMAT_VERSION,
+        "meta": {
+            "git": get_git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "created_at": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+        },
+        "parameters": parameters,
+        "results": results,
+    }
+
+
+def save_results(file_path: str, content: dict) -> None:
+    with open(file_path, "w", encoding="utf-8") as results_file:
+        json.dump(content, results_file, ensure_ascii=False, indent=2, sort_keys=True)
+        results_file.write("\n")
+
+
+def get_failed_benchmarks(content: dict) -> list[str]:
+    """
+    Finds benchmarks that failed on every call. Their latencies are zeros and must not be read as results
+    :param content: content of results file
+    :return: names of failed benchmarks
+    """
+    return [name for name, summary in sorted(content["results"].items())
+            if (summary["count"] == 0) and (summary["errors"] > 0)]
+
+
+def load_results(file_path: str) -> dict:
+    with open(file_path, "r", encoding="utf-8") as results_file:
+        return json.load(results_file)
+
+
+def compare_results(baseline: dict, current: dict, threshold: float) -> tuple[list[str], list[str]]:
+    """
+    Compares latencies of two runs
+    :param baseline: results of previous commit
+    :param current: results of current commit
+    :param threshold: allowed relative growth, e.g. 0.1 for 10%
+    :return:
+            [0] lines of report
+            [1] regressions, empty if there are none
+    """
+    report: list[str] = []
+    regressions: list[str] = []
+
+    if baseline.get("format_version") != current.get("format_version"):
+        raise ValueError("Results have different format versions and could not be compared")
+
+    if baseline.get("parameters") != current.get("parameters"):
+        report.append("Warning: runs have different parameters")
+
+    report.append(f"{'benchmark':<32} {'metric':<8} {'baseline':>12} {'current':>12} {'change':>9}")
+
+    for name in sorted(set(baseline["results"]) & set(current["results"])):
+        for metric in COMPARED_METRICS:
+            old_value: float = baseline["results"][name][metric]
+            new_value: float = current["results"][name][metric]
+
+            if old_value <= 0:
+                continue
+
+            change: float = new_value / old_value - 1
+            is_regression: bool = change > threshold
+
+            report.append(f"{name:<32} {metric:<8} {old_value:>12.3f} {new_value:>12.3f} {change:>+8.1%}"
+                          f"{'  REGRESSION' if is_regression else ''}")
+
+            if is_regression:
+                regressions.append(f"{name} {metric}")
+
+        if current["results"][name]["errors"] > baseline["results"][name]["errors"]:
+            report.append(f"{name}: errors {baseline['results'][name]['errors']} -> "
+                          f"{current['results'][name]['errors']}")
+            regressions.append(f"{name} errors")
+
+    for name in sorted(set(baseline["results"]) ^ set(current["results"])):
+        report.append(f"{name}: present only in {'baseline' if name in baseline['results'] else 'current'} run")
+
+    for name in get_failed_benchmarks(current):
+        report.append(f"{name}: every call failed, {current['results'][name].get('first_error', '')}")
+        regressions.append(f"{name} failed")
+
+    return report, regressions
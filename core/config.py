@@ -18,14 +18,97 @@ class Settings:
     # If result contains more
     QUERY_ROW_LIMIT = 1_000_000
     ROWS_PER_PAGE = 100_000
+    # exact, bounded or estimate. Cube could override it with olap_table.row_count_strategy
+    ROW_COUNT_STRATEGY: str = os.getenv("ROW_COUNT_STRATEGY", "bounded")
+
+    # Choose best table for query by planner cost (EXPLAIN) instead of number of not selected fields
+    COST_BASED_QUERY_SELECTION: bool = os.getenv("COST_BASED_QUERY_SELECTION", "true").lower() == "true"
+    # Planner costs of candidate queries are cached by query fingerprint
+    PLAN_COST_CACHE_SIZE = 10_000
+    # Time to live of cached planner cost in seconds
+    PLAN_COST_CACHE_TTL = 60 * 60
+
+    # Seconds between refreshes of table statistics (pg_class, pg_stats) of cubes. 0 disables refresh
+    TABLE_STATISTICS_REFRESH_INTERVAL = int(os.getenv("TABLE_STATISTICS_REFRESH_INTERVAL", 15 * 60))
+    # Seconds between checks of materialized views of cubes. Views that are due are refreshed. 0 disables refresh
+    MATERIALIZED_VIEW_CHECK_INTERVAL = int(os.getenv("MATERIALIZED_VIEW_CHECK_INTERVAL", 60))
+    # Seconds between refreshes of materialized view if its .toml file has no refresh_interval
+    MATERIALIZED_VIEW_REFRESH_INTERVAL = int(os.getenv("MATERIALIZED_VIEW_REFRESH_INTERVAL", 60 * 60))
+
+    # Seconds between checks of acl_version. Grants are reloaded only if version has changed
+    ACL_CACHE_REFRESH_INTERVAL = int(os.getenv("ACL_CACHE_REFRESH_INTERVAL", 30))
+
+    # Threads that build cubes at startup
+    CUBE_INIT_WORKERS = int(os.getenv("CUBE_INIT_WORKERS", 8))
+    # Build every cube on first access instead of startup
+    LAZY_CUBE_INIT: bool = os.getenv("LAZY_CUBE_INIT", "false").lower() == "true"
+    # Share of cube connections one user could hold at once
+    ADMISSION_USER_SHARE = float(os.getenv("ADMISSION_USER_SHARE", 0.5))
+    # Share of cube connections bulk requests (exports, next pages) could hold. The rest is kept for interactive
+    ADMISSION_BULK_SHARE = float(os.getenv("ADMISSION_BULK_SHARE", 0.5))
+    # Queries waiting for connection to one cube. Next ones get 429
+    ADMISSION_MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", 100))
+    # Seconds query waits for connection before 503
+    ADMISSION_QUEUE_TIMEOUT = int(os.getenv("ADMISSION_QUEUE_TIMEOUT", 30))
+    # Statement timeout of cube queries in seconds. Cube could override it with olap_table.statement_timeout
+    STATEMENT_TIMEOUT = int(os.getenv("STATEMENT_TIMEOUT", 30 * 60))
+    # Statement timeout of interactive requests (filters, dimensions, query info, first page). 0 uses cube timeout
+    INTERACTIVE_STATEMENT_TIMEOUT = int(os.getenv("INTERACTIVE_STATEMENT_TIMEOUT", 60))
+    # Statement timeout of bulk requests (exports, next pages). 0 uses cube timeout
+    BULK_STATEMENT_TIMEOUT = int(os.getenv("BULK_STATEMENT_TIMEOUT", 0))
+    # Seconds between checks if client of running query has disconnected
+    DISCONNECT_CHECK_INTERVAL = 0.5
+    # Connection pools of cubes. Could be overridden by columns of olap_table
+    OLAP_POOL_MAX_OVERFLOW = 0
+    OLAP_POOL_RECYCLE = 30 * 60
+    OLAP_POOL_PRE_PING: bool = True
+    OLAP_CONNECT_TIMEOUT = 10
+    # Connections opened in every pool at startup, not more than pool size
+    OLAP_POOL_PREWARM = int(os.getenv("OLAP_POOL_PREWARM", 2))
+    # Threads of one DuckDB connection of cubes with duckdb engine. 0 lets DuckDB use all cores
+    DUCKDB_THREADS = int(os.getenv("DUCKDB_THREADS", 0))
+    # Memory limit of one DuckDB connection, e.g. 4GB. None lets DuckDB use 80% of memory
+    DUCKDB_MEMORY_LIMIT: str | None = os.getenv("DUCKDB_MEMORY_LIMIT")
+    # Seconds between checks of olap_table.updated_at and .toml files of cubes. 0 disables reload
+    CUBE_RELOAD_INTERVAL = int(os.getenv("CUBE_RELOAD_INTERVAL", 60))
 
     MAX_FILTER_VALUES = 1_000
 
+    # Seek pages by the last key of previous page instead of offset-limit
+    # Works only for queries with GROUP BY, where select fields are unique
+    USE_KEYSET_PAGINATION: bool = True
+
+    # Rows fetched from server-side cursor at once while streaming export
+    STREAM_ROWS_PER_CHUNK = 10_000
+
+    # Same payload for the same cube reuses saved query (and its row count) for this number of seconds.
+    # 0 disables reuse
+    SAVED_QUERY_REUSE_TTL = int(os.getenv("SAVED_QUERY_REUSE_TTL", 10 * 60))
+
+    # Number of generated SelectCollections memoized by cube and payload. 0 disables memo
+    QUERIES_MEMO_SIZE = int(os.getenv("QUERIES_MEMO_SIZE", 1_000))
+
+    # Serialized pages of OLAP queries kept in memory. 0 disables cache
+    PAGE_CACHE_MAX_BYTES = int(os.getenv("PAGE_CACHE_MAX_BYTES", 256 * 1024 * 1024))
+    # Time to live of cached page in seconds. Cube could override it with olap_table.page_cache_ttl
+    PAGE_CACHE_TTL = int(os.getenv("PAGE_CACHE_TTL", 5 * 60))
+
     # Auth settings
     SECRET_KEY: str = os.getenv("SECRET_KEY")
     ALGORITHM: str = os.getenv("ALGORITHM")
     # Expiration time in seconds
     EXPIRE_JWT_IN: int = 24 * 60 * 60
+    # Comma-separated usernames that could use admin endpoints
+    ADMIN_USERNAMES: list[str] = [username.strip() for username in os.getenv("ADMIN_USERNAMES", "").split(",")
+                                  if username.strip() != ""]
+    # Add names of cubes user can access to JWT. They are trusted while acl_version is the same as at login
+    JWT_CUBE_GRANTS: bool = os.getenv("JWT_CUBE_GRANTS", "false").lower() == "true"
+    # Number of verified tokens kept in memory, so signature is not checked on every request
+    VERIFIED_TOKEN_CACHE_SIZE = 10_000
+    # Processes that hash and verify passwords. bcrypt is CPU-bound and should not block request threads
+    PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", 2))
+    # Hashing tasks waiting for worker. Requests over this limit get 429
+    PASSWORD_HASH_MAX_QUEUE = int(os.getenv("PASSWORD_HASH_MAX_QUEUE", 32))
     # Expiration time in seconds
     EXPIRE_CONFIRMATION_CODE: int = 24 * 60 * 60
     #Password expiration time in seconds
@@ -39,6 +122,26 @@ class Settings:
     MAIL_PASSWORD = os.getenv("MAIL_PASSWORD")
     MAIL_USE_TLS = os.getenv("MAIL_USE_TLS")
     MAIL_USE_SSL = os.getenv("MAIL_USE_SSL")
+    # Seconds between checks of mail outbox. New mails wake sender up without waiting
+    MAIL_OUTBOX_POLL_INTERVAL = 5
+    # Mails sent through one SMTP connection
+    MAIL_OUTBOX_BATCH_SIZE = 50
+    # Mail is marked as failed after this number of attempts
+    MAIL_OUTBOX_MAX_ATTEMPTS = 8
+    # Seconds before first retry. Delay is doubled after every attempt, but not more than one hour
+    MAIL_OUTBOX_RETRY_DELAY = 30
+
+    # Tracing. Share of requests that are traced, from 0 to 1. 0 disables tracing
+    TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", 0))
+    # Spans are exported in OTLP/JSON to file, one export request per line
+    TRACE_EXPORT_FILE = os.getenv("TRACE_EXPORT_FILE")
+    # and/or to OTLP/HTTP collector, e.g. http://localhost:4318/v1/traces
+    TRACE_EXPORT_ENDPOINT = os.getenv("TRACE_EXPORT_ENDPOINT")
+    # Seconds between exports
+    TRACE_EXPORT_INTERVAL = 5
+    # Finished spans waiting for export. Oldest spans are dropped if exporter is behind
+    TRACE_MAX_QUEUE = 10_000
+    TRACE_SERVICE_NAME = os.getenv("TRACE_SERVICE_NAME", "comradewolfapi")
 
 
 settings = Settings()
@@ -15,6 +15,15 @@ NO_FORGOT_PASSWORD_CODE = 14
 NO_CUBES_FOR_USER = 15
 CLASS_NOT_FOUND = 16
 TOO_MANY_ROWS = 17
+NO_ARROW_SUPPORT = 18
+PASSWORD_HASH_POOL_IS_FULL = 19
+ADMISSION_QUEUE_IS_FULL = 20
+ADMISSION_TIMEOUT = 21
+QUERY_CANCELLED = 22
+QUERY_TIMEOUT = 23
+NO_DUCKDB_SUPPORT = 24
+NO_TABLE_DATA_FILE = 25
+WRONG_MATERIALIZED_VIEW = 26
 
 class ComradeWolfApiException(Exception):
     """
@@ -186,3 +195,57 @@ class TooManyRows(ComradeWolfApiException):
         message: str = f"Too many rows in select"
 
         super().__init__(TOO_MANY_ROWS, message)
+
+class NoArrowSupport(ComradeWolfApiException):
+    def __init__(self):
+        message: str = f"pyarrow is not installed. Arrow and parquet formats are not available"
+
+        super().__init__(NO_ARROW_SUPPORT, message)
+
+class PasswordHashPoolIsFull(ComradeWolfApiException):
+    def __init__(self):
+        message: str = f"Too many password hashing tasks in queue"
+
+        super().__init__(PASSWORD_HASH_POOL_IS_FULL, message)
+
+class AdmissionQueueIsFull(ComradeWolfApiException):
+    def __init__(self):
+        message: str = f"Too many queries are waiting for connection to cube"
+
+        super().__init__(ADMISSION_QUEUE_IS_FULL, message)
+
+class AdmissionTimeout(ComradeWolfApiException):
+    def __init__(self):
+        message: str = f"Query has not got connection to cube in time"
+
+        super().__init__(ADMISSION_TIMEOUT, message)
+
+class QueryCancelled(ComradeWolfApiException):
+    def __init__(self):
+        message: str = f"Query was cancelled because client has disconnected"
+
+        super().__init__(QUERY_CANCELLED, message)
+
+class QueryTimeout(ComradeWolfApiException):
+    def __init__(self):
+        message: str = f"Query was cancelled by statement timeout"
+
+        super().__init__(QUERY_TIMEOUT, message)
+
+class NoDuckDBSupport(ComradeWolfApiException):
+    def __init__(self):
+        message: str = f"duckdb and duckdb-engine are not installed. DuckDB cubes are not available"
+
+        super().__init__(NO_DUCKDB_SUPPORT, message)
+
+class NoTableDataFile(ComradeWolfApiException):
+    def __init__(self, table_name: str, data_path: str):
+        message: str = f"No Parquet or CSV file for table {table_name} in {data_path}"
+
+        super().__init__(NO_TABLE_DATA_FILE, message)
+
+class WrongMaterializedView(ComradeWolfApiException):
+    def __init__(self, table_name: str, reason: str):
+        message: str = f"Materialized view {table_name} could not be created: {reason}"
+
+        super().__init__(WRONG_MATERIALIZED_VIEW, message)
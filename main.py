@@ -1,8 +1,19 @@
+import asyncio
+import contextlib
 from contextlib import asynccontextmanager
 
-from fastapi import FastAPI
+from fastapi import FastAPI, status
+from starlette.requests import Request
+from starlette.responses import JSONResponse
 
-from olap_info.olap_sales_cube import set_cubes
+from core.config import settings
+from core.utils.exceptions import AdmissionQueueIsFull, AdmissionTimeout, QueryTimeout, QueryCancelled
+from olap_info.olap_sales_cube import set_cubes, reload_cubes_forever, refresh_materialized_views_forever
+from service.acl_cache import acl_cache
+from service.mail_outbox import mail_outbox_sender
+from service.metrics import RequestMetricsMiddleware
+from service.tracing import TracingMiddleware, span_exporter
+from service.security import password_hash_pool
 from routers import basic_routes
 
 from routers.v1 import olap_router, user_router
@@ -17,11 +28,95 @@ structure = {}
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     structure["cube_collection"] = return_postgres_opt()
+
+    if settings.OLAP_POOL_PREWARM > 0:
+        await structure["cube_collection"].prewarm_pools_async(settings.OLAP_POOL_PREWARM)
+
+    statistics_task: asyncio.Task | None = None
+
+    if settings.TABLE_STATISTICS_REFRESH_INTERVAL > 0:
+        statistics_task = asyncio.create_task(structure["cube_collection"].refresh_table_statistics_forever(
+            settings.TABLE_STATISTICS_REFRESH_INTERVAL))
+
+    materialized_view_task: asyncio.Task | None = None
+
+    if settings.MATERIALIZED_VIEW_CHECK_INTERVAL > 0:
+        materialized_view_task = asyncio.create_task(refresh_materialized_views_forever(
+            structure["cube_collection"], settings.MATERIALIZED_VIEW_CHECK_INTERVAL))
+
+    acl_task: asyncio.Task = asyncio.create_task(acl_cache.refresh_forever(settings.ACL_CACHE_REFRESH_INTERVAL))
+
+    reload_task: asyncio.Task | None = None
+
+    if settings.CUBE_RELOAD_INTERVAL > 0:
+        reload_task = asyncio.create_task(reload_cubes_forever(structure["cube_collection"],
+                                                               settings.CUBE_RELOAD_INTERVAL))
+
+    mail_task: asyncio.Task = asyncio.create_task(mail_outbox_sender.send_forever(
+        settings.MAIL_OUTBOX_POLL_INTERVAL))
+
+    trace_task: asyncio.Task | None = None
+
+    if span_exporter.is_enabled():
+        trace_task = asyncio.create_task(span_exporter.export_forever(settings.TRACE_EXPORT_INTERVAL))
+
     yield {"cubes": structure["cube_collection"],}
+
+    for task in [statistics_task, materialized_view_task, acl_task, mail_task, reload_task, trace_task]:
+        if task is not None:
+            task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await task
+
+    password_hash_pool.shutdown()
+
+    # Spans of the last requests
+    if span_exporter.is_enabled():
+        span_exporter.export()
+
     structure.clear()
 
 
 app = FastAPI(lifespan=lifespan)
+app.add_middleware(RequestMetricsMiddleware)
+app.add_middleware(TracingMiddleware)
+
+
+@app.exception_handler(AdmissionQueueIsFull)
+def admission_queue_is_full_handler(request: Request, exc: AdmissionQueueIsFull) -> JSONResponse:
+    """
+    Too many queries are waiting for connection to cube
+    """
+    return JSONResponse(status_code=status.HTTP_429_TOO_MANY_REQUESTS, headers={"Retry-After": "1"},
+                        content={"detail": "Слишком много запросов к кубу. Повторите попытку позже"})
+
+
+@app.exception_handler(AdmissionTimeout)
+def admission_timeout_handler(request: Request, exc: AdmissionTimeout) -> JSONResponse:
+    """
+    Query has not got connection to cube in time
+    """
+    return JSONResponse(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, headers={"Retry-After": "5"},
+                        content={"detail": "Куб перегружен. Повторите попытку позже"})
+
+
+@app.exception_handler(QueryTimeout)
+def query_timeout_handler(request: Request, exc: QueryTimeout) -> JSONResponse:
+    """
+    Query to cube has run longer than statement timeout
+    """
+    return JSONResponse(status_code=status.HTTP_504_GATEWAY_TIMEOUT,
+                        content={"detail": "Запрос выполнялся слишком долго. Попробуйте выставить фильтры"})
+
+
+@app.exception_handler(QueryCancelled)
+def query_cancelled_handler(request: Request, exc: QueryCancelled) -> JSONResponse:
+    """
+    Client has disconnected before query finished. Response is not read by anyone
+    """
+    # 499 Client Closed Request, the same as in nginx
+    return JSONResponse(status_code=499, content={"detail": "Запрос отменен"})
+
 
 app.include_router(olap_router.router)
 app.include_router(user_router.router)
@@ -1,7 +1,8 @@
 from datetime import datetime
 from typing import List
 
-from sqlalchemy import Integer, Column, String, DateTime, Boolean, ForeignKey, Table
+from sqlalchemy import Integer, Column, String, DateTime, Boolean, ForeignKey, Table, Index, BigInteger, \
+    UniqueConstraint
 from sqlalchemy.orm import DeclarativeBase, mapped_column, Mapped, relationship
 
 
@@ -33,6 +34,22 @@ class OlapTable(Base):
     engine: Mapped[str] = Column(String(250), unique=False)
     database: Mapped[str] = Column(String(125), unique=False)
     max_connections: Mapped[int] = Column(Integer)
+    # Time to live of cached pages in seconds. NULL uses PAGE_CACHE_TTL from settings, 0 disables cache
+    page_cache_ttl: Mapped[int | None] = Column(Integer, nullable=True)
+    # exact, bounded or estimate. NULL uses ROW_COUNT_STRATEGY from settings
+    row_count_strategy: Mapped[str | None] = Column(String(25), nullable=True)
+    # Connection pool of the cube. NULL values are taken from settings, pool_size defaults to max_connections
+    pool_size: Mapped[int | None] = Column(Integer, nullable=True)
+    max_overflow: Mapped[int | None] = Column(Integer, nullable=True)
+    # Seconds after which connection is reopened
+    pool_recycle: Mapped[int | None] = Column(Integer, nullable=True)
+    pool_pre_ping: Mapped[bool | None] = Column(Boolean, nullable=True)
+    # Seconds to wait for new connection to database
+    connect_timeout: Mapped[int | None] = Column(Integer, nullable=True)
+    # Seconds query could run. NULL uses STATEMENT_TIMEOUT from settings, 0 disables timeout
+    statement_timeout: Mapped[int | None] = Column(Integer, nullable=True)
+    # Directory with Parquet/CSV files of tables for embedded engines (duckdb). Not used by database servers
+    data_path: Mapped[str | None] = Column(String(512), nullable=True)
     created_at: Mapped[datetime] = Column(DateTime, default=datetime.now)
     updated_at: Mapped[datetime] = Column(DateTime, default=datetime.now)
 
@@ -50,6 +67,22 @@ class SavedQuery(Base):
     query: Mapped[str] = mapped_column(String(), unique=False)
     pages: Mapped[str] = mapped_column(Integer)
     items_per_page: Mapped[int] = mapped_column(Integer)
+    # JSON list of column aliases used for keyset pagination. NULL if query is paged with offset-limit
+    order_by_keys: Mapped[str | None] = mapped_column(String(), nullable=True)
+    # JSON dictionary {page_no: [last key values of the page]}
+    page_keys: Mapped[str | None] = mapped_column(String(), nullable=True)
+    cube_name: Mapped[str | None] = mapped_column(String(50), nullable=True)
+    # sha256 of normalized frontend payload. Same request is answered with saved query while it is fresh
+    payload_hash: Mapped[str | None] = mapped_column(String(64), nullable=True)
+    # Version of cube definition. Query of previous version of reloaded cube is not reused
+    cube_version: Mapped[str | None] = mapped_column(String(64), nullable=True)
+    is_rows_no_exact: Mapped[bool] = mapped_column(Boolean, default=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.now)
+
+    __table_args__ = (
+        Index("saved_query_cube_name_payload_hash_idx", "cube_name", "payload_hash", created_at.desc()),
+        {"schema": "comradewolf"},
+    )
 
 
 class ConfirmationCode(Base):
@@ -95,3 +128,62 @@ class AppUser(Base):
 
     forgot_password_code: Mapped[List["ForgotPasswordCode"]] = relationship(back_populates="user")
 
+
+
+class AclVersion(Base):
+    """
+    One-row table. Version is incremented by triggers on user_olap, olap_table and app_user,
+    so cached access rights know when they should be reloaded
+    """
+    __tablename__ = "acl_version"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, default=1)
+    version: Mapped[int] = mapped_column(BigInteger, default=0)
+
+
+class MailOutbox(Base):
+    """
+    Mails waiting to be sent. Requests only add mail here, MailOutboxSender sends them in background
+    """
+    __tablename__ = "mail_outbox"
+
+    id: Mapped[int] = mapped_column(BigInteger, primary_key=True)
+    email_to: Mapped[str] = mapped_column(String(250))
+    subject: Mapped[str] = mapped_column(String(250))
+    html_content: Mapped[str] = mapped_column(String())
+    # pending, sent or failed. Failed mails are not retried anymore
+    status: Mapped[str] = mapped_column(String(25), default="pending")
+    attempts: Mapped[int] = mapped_column(Integer, default=0)
+    next_attempt_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.now)
+    last_error: Mapped[str | None] = mapped_column(String(), nullable=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.now)
+    sent_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
+
+    __table_args__ = (
+        Index("mail_outbox_status_next_attempt_at_idx", "status", "next_attempt_at"),
+        {"schema": "comradewolf"},
+    )
+
+
+class MaterializedViewRefresh(Base):
+    """
+    Last refresh of materialized view managed by cube. One row per view
+    """
+    __tablename__ = "materialized_view_refresh"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    cube_name: Mapped[str] = mapped_column(String(50))
+    # database.schema.table as in .toml files
+    table_name: Mapped[str] = mapped_column(String(250))
+    # sha256 of view query. View is created again when query changes
+    definition_hash: Mapped[str] = mapped_column(String(64))
+    refresh_started_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
+    # Start of the last successful refresh. View has data of base tables at this time
+    refreshed_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
+    # Error of the last refresh. NULL if it was successful
+    last_error: Mapped[str | None] = mapped_column(String(), nullable=True)
+
+    __table_args__ = (
+        UniqueConstraint("cube_name", "table_name", name="materialized_view_refresh_cube_name_table_name_uq"),
+        {"schema": "comradewolf"},
+    )
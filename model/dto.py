@@ -1,3 +1,6 @@
+import datetime
+from enum import Enum
+
 from comradewolf.utils.enums_and_field_dicts import FilterTypes, WhereConditionType
 from pydantic import BaseModel, EmailStr
 
@@ -49,11 +52,19 @@ class QueryMetaData(BaseModel):
     pages: int
     items_per_page: int
     cube_name: str
+    # Columns for keyset pagination. Empty if query should be paged with offset-limit
+    order_by_keys: list[str] = []
+    # False if rows_no (and pages) is planner estimate
+    is_rows_no_exact: bool = True
+    # Version of cube definition query was made for
+    cube_version: str | None = None
 
 class QueryDTO(BaseModel):
     id: int
     pages: int
     items_per_page: int
+    # False if number of pages is estimated. Last page could be found only by getting empty page
+    is_pages_exact: bool = True
 
 class UserRegisterDTO(BaseModel):
     """
@@ -118,3 +129,203 @@ class FrontDistinct(BaseModel):
 
 class FrontDistinctDTO(BaseModel):
     SELECT_DISTINCT: FrontDistinct
+
+class RowCountStrategy(str, Enum):
+    """
+    How optimizer counts rows of query before data is returned
+    """
+    # count(*) over complete query
+    EXACT = "exact"
+    # count(*) that stops after QUERY_ROW_LIMIT + 1 rows
+    BOUNDED = "bounded"
+    # Plan rows from EXPLAIN, database does not run query
+    ESTIMATE = "estimate"
+
+
+class ExportFormat(str, Enum):
+    """
+    Formats of streaming export
+    """
+    NDJSON = "ndjson"
+    CSV = "csv"
+    ARROW = "arrow"
+    PARQUET = "parquet"
+
+
+class PageCacheStatsDTO(BaseModel):
+    hits: int
+    misses: int
+    evictions: int
+    expirations: int
+    pages: int
+    total_bytes: int
+    max_bytes: int
+
+
+class ColumnStatistics(BaseModel):
+    # Estimated number of distinct values. None if column was not analyzed
+    n_distinct: float | None = None
+    # Fraction of NULL values
+    null_frac: float | None = None
+
+
+class TableStatistics(BaseModel):
+    table_name: str
+    # Planner estimate of rows. None if table was never analyzed
+    rows_no: int | None = None
+    # Size of table with indexes and toast
+    relation_bytes: int | None = None
+    columns: dict[str, ColumnStatistics] = {}
+
+
+class MemoStatsDTO(BaseModel):
+    hits: int
+    misses: int
+    hit_rate: float
+    entries: int
+    max_entries: int
+
+
+class TokenClaims(BaseModel):
+    """
+    Verified content of JWT
+    """
+    username: str
+    user_id: int
+    # Unix time
+    expires_at: int
+    # Names of cubes user could access at login. None if token has no grants
+    cube_names: list[str] | None = None
+    # acl_version at login. Grants are trusted only while version is the same
+    acl_version: int | None = None
+
+
+class PasswordHashStatsDTO(BaseModel):
+    workers: int
+    # Tasks that are hashed or wait for worker right now
+    queue_depth: int
+    max_queue_depth: int
+    completed: int
+    rejected: int
+    # Time from submit to result, including wait in queue
+    average_latency_ms: float
+    max_latency_ms: float
+
+
+class MailOutboxStatsDTO(BaseModel):
+    # Mails waiting to be sent, including retries
+    pending: int
+    failed: int
+    # Counters of current process
+    sent: int
+    send_errors: int
+
+
+class ReloadedCubesDTO(BaseModel):
+    cube_names: list[str]
+
+
+class PoolStatsDTO(BaseModel):
+    cube_name: str
+    # Limit of parallel queries of optimizer
+    max_connections: int
+    pool_size: int
+    checked_out: int
+    idle: int
+    # Connections opened over pool_size
+    overflow: int
+
+
+class RequestPriority(str, Enum):
+    """
+    Order in which queries get connections to cube
+    """
+    # User waits for result: filters, dimensions, query info, first page
+    INTERACTIVE = "interactive"
+    # Exports, next pages and background tasks
+    BULK = "bulk"
+
+
+class AdmissionStatsDTO(BaseModel):
+    cube_name: str
+    max_connections: int
+    max_per_user: int
+    max_bulk: int
+    running: int
+    running_bulk: int
+    waiting_interactive: int
+    waiting_bulk: int
+    admitted: int
+    rejected: int
+    timed_out: int
+    # Time from request for connection to admission
+    average_wait_ms: float
+    max_wait_ms: float
+
+
+class QueryInterruptionStatsDTO(BaseModel):
+    cube_name: str
+    # Queries cancelled because client has disconnected
+    cancelled: int
+    # Queries cancelled by statement timeout
+    timed_out: int
+
+
+class QueryPattern(BaseModel):
+    """
+    Fields of saved queries that aggregate table should contain to answer them
+    """
+    # Aliases of fields that query is grouped or filtered by. Fields of dimension tables are replaced with service keys
+    group_by: frozenset[str]
+    # Calculated fields as alias__calculation, e.g. qty_order_alias__sum
+    calculations: frozenset[str]
+    # Number of saved queries with this pattern
+    queries_no: int
+    # One of payloads, it is used to find tables of the cube that answer pattern now
+    payload: dict
+    # Rows of the smallest table of the cube that answers pattern now
+    rows_no: int | None = None
+
+
+class AggregateRecommendation(BaseModel):
+    # database.schema.table as in .toml files
+    table_name: str
+    group_by: list[str]
+    calculations: list[str]
+    # Estimates from table statistics of base table
+    rows_no: int
+    size_bytes: int
+    # Saved queries that would be answered by this table
+    queries_no: int
+    # Rows that would not be read by these queries
+    rows_saved: int
+    seconds_saved: float
+    ddl: str
+    toml: str
+
+
+class MaterializedView(BaseModel):
+    # database.schema.table as in .toml files
+    table_name: str
+    # Query of view over base table
+    query: str
+    # Grouped columns. Unique index on them lets refresh view concurrently
+    unique_columns: list[str]
+    # Seconds between refreshes
+    refresh_interval: int
+    # Seconds after refresh when view is still used. Queries go to base tables after that
+    max_staleness: int
+    # sha256 of query and unique columns
+    definition_hash: str
+
+
+class MaterializedViewStatsDTO(BaseModel):
+    cube_name: str
+    table_name: str
+    # View is fresh and queries could be answered by it
+    is_available: bool
+    is_refreshing: bool
+    refreshed_at: datetime.datetime | None
+    last_error: str | None
+    # Duration of the last successful refresh
+    last_refresh_ms: float | None
@@ -1,6 +1,11 @@
 """
 File for test cube
 """
+import asyncio
+import datetime
+import hashlib
+import logging
+from functools import partial
 from typing import Type
 
 from comradewolf.universe.olap_language_select_builders import OlapPostgresSelectBuilder
@@ -8,51 +13,328 @@ from comradewolf.universe.olap_prompt_converter_service import OlapPromptConvert
 from comradewolf.universe.olap_service import OlapService
 from comradewolf.universe.olap_structure_generator import OlapStructureGenerator
 from sqlalchemy import Engine, create_engine
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
 import os
 from dotenv import load_dotenv
 from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
 
-from core.database import get_session
-from model.base_model import OlapTable
+from core.config import settings
+from core.database import get_session, SessionLocal
+from model.base_model import OlapTable, MaterializedViewRefresh
+from model.dto import RowCountStrategy, MaterializedView
 from service.cube import CubeCollection
-from service.db import get_all_olap_cubes
+from service.db import get_all_olap_cubes, get_materialized_view_refreshes, save_materialized_view_refresh
+from service.materialized_views import MaterializedViewCatalog, MATERIALIZED_VIEWS_DIRECTORY, \
+    load_materialized_views
+from service.optimizer_duckdb import DUCKDB_ENGINE_NAME, create_duckdb_engine
 from service.optimizer_factory import OptimizerFactory, SelectBuilderFactory
-from service.optimizer_interface import OptimizerAbstract
+from service.optimizer_interface import OptimizerAbstract, OptimizerAsyncAbstract
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 def set_cubes() -> CubeCollection:
+    """
+    Creates collection of all cubes from olap_table
+    Cubes are built in parallel by CUBE_INIT_WORKERS threads. If LAZY_CUBE_INIT is on,
+    every cube is built on first access instead
+    :return: CubeCollection
+    """
     cubes_collection = CubeCollection()
 
     session: Session = get_session()
     possible_cubes: list[Type[OlapTable]] = get_all_olap_cubes(session)
 
     for cube in possible_cubes:
-        cube_name = str(cube.name)
-        toml_link = str(cube.toml_link)
-        olap_user = os.getenv(str(cube.username_env))
-        olap_password = os.getenv(str(cube.password_env))
-        olap_host = cube.host
-        olap_port = cube.port
-        olap_engine_name = str(cube.engine)
-        olap_db = cube.database
-        olap_max_connections = cube.max_connections
+        cubes_collection.add_lazy_cube(str(cube.name), partial(add_cube_from_olap_table, cube))
 
-        engine: Engine = create_engine(f"{olap_engine_name}://{olap_user}:{olap_password}@{olap_host}:{olap_port}/"
-                                       f"{olap_db}")
+    if not settings.LAZY_CUBE_INIT:
+        cubes_collection.build_all_cubes(settings.CUBE_INIT_WORKERS)
 
-        optimizer: OptimizerAbstract = OptimizerFactory.get(engine_name=olap_engine_name,
-                                                            max_connections=int(olap_max_connections),
-                                                            engine=engine)
+    return cubes_collection
 
-        olap_prompt_converter: OlapPromptConverterService = OlapPromptConverterService(OlapPostgresSelectBuilder())
+def add_cube_from_olap_table(cube: OlapTable, cubes_collection: CubeCollection) -> None:
+    """
+    Creates engine, optimizer and structure of one cube and adds it to collection
+    :param cube: row of olap_table
+    :param cubes_collection: collection to add cube to
+    :return: None
+    """
+    cube_name = str(cube.name)
+    toml_link = str(cube.toml_link)
+    # Version is taken before .toml files are read. If they change in between, cube is reloaded once more
+    version: str = get_cube_definition_version(cube)
+    olap_user = os.getenv(str(cube.username_env))
+    olap_password = os.getenv(str(cube.password_env))
+    olap_host = cube.host
+    olap_port = cube.port
+    olap_engine_name = str(cube.engine)
+    olap_db = cube.database
+    olap_max_connections = cube.max_connections
+    page_cache_ttl: int = settings.PAGE_CACHE_TTL if cube.page_cache_ttl is None else int(cube.page_cache_ttl)
+    row_count_strategy: RowCountStrategy = RowCountStrategy(cube.row_count_strategy or
+                                                            settings.ROW_COUNT_STRATEGY)
 
-        osg: OlapStructureGenerator = OlapStructureGenerator(toml_link)
+    engine_url: str = f"{olap_engine_name}://{olap_user}:{olap_password}@{olap_host}:{olap_port}/{olap_db}"
 
-        olap_select_builder = SelectBuilderFactory.get(olap_engine_name)
-        olap_service: OlapService = OlapService(olap_select_builder)
+    pool_size: int = int(olap_max_connections) if cube.pool_size is None else int(cube.pool_size)
+    max_overflow: int = settings.OLAP_POOL_MAX_OVERFLOW if cube.max_overflow is None else int(cube.max_overflow)
 
-        cubes_collection.add_cube(cube_name, optimizer, olap_prompt_converter,
-                    osg, olap_service)
+    # Optimizer lets max_connections queries at once. Others would wait for connection inside pool
+    if pool_size + max_overflow < int(olap_max_connections):
+        logger.warning("Cube %s: pool_size + max_overflow (%s) is less than max_connections (%s)",
+                       cube_name, pool_size + max_overflow, olap_max_connections)
 
-    return cubes_collection
+    connect_timeout: int = settings.OLAP_CONNECT_TIMEOUT if cube.connect_timeout is None else int(cube.connect_timeout)
+
+    pool_options: dict = {
+        "pool_size": pool_size,
+        "max_overflow": max_overflow,
+        "pool_recycle": settings.OLAP_POOL_RECYCLE if cube.pool_recycle is None else int(cube.pool_recycle),
+        "pool_pre_ping": settings.OLAP_POOL_PRE_PING if cube.pool_pre_ping is None else bool(cube.pool_pre_ping),
+        "connect_args": OptimizerFactory.get_connect_args(olap_engine_name, connect_timeout),
+    }
+
+    statement_timeout: int = settings.STATEMENT_TIMEOUT if cube.statement_timeout is None \
+        else int(cube.statement_timeout)
+
+    osg: OlapStructureGenerator = OlapStructureGenerator(toml_link)
+
+    views: list[MaterializedView] = []
+
+    # Views become data tables of the cube, optimizer chooses them as other aggregates
+    if olap_engine_name != DUCKDB_ENGINE_NAME:
+        views = load_materialized_views(toml_link, osg, settings.MATERIALIZED_VIEW_REFRESH_INTERVAL)
+    elif os.path.isdir(os.path.join(toml_link, MATERIALIZED_VIEWS_DIRECTORY)):
+        logger.warning("Cube %s: DuckDB has no materialized views, %s folder is skipped",
+                       cube_name, MATERIALIZED_VIEWS_DIRECTORY)
+
+    engine: Engine | AsyncEngine
+
+    if olap_engine_name == DUCKDB_ENGINE_NAME:
+        tables_collection = osg.get_tables_collection()
+        engine = create_duckdb_engine(tables_collection.get_data_table_names() +
+                                      tables_collection.get_dimension_table_names(),
+                                      str(cube.data_path), pool_options)
+    elif OptimizerFactory.is_async(olap_engine_name):
+        engine = create_async_engine(engine_url, **pool_options)
+    else:
+        engine = create_engine(engine_url, **pool_options)
+
+    optimizer: OptimizerAbstract | OptimizerAsyncAbstract = OptimizerFactory.get(engine_name=olap_engine_name,
+                                                        max_connections=int(olap_max_connections),
+                                                        engine=engine,
+                                                        row_count_strategy=row_count_strategy,
+                                                        statement_timeout=statement_timeout)
+    optimizer.get_materialized_views().set_views(views)
+
+    olap_prompt_converter: OlapPromptConverterService = OlapPromptConverterService(OlapPostgresSelectBuilder())
+
+    olap_select_builder = SelectBuilderFactory.get(olap_engine_name)
+    olap_service: OlapService = OlapService(olap_select_builder)
+
+    cubes_collection.add_cube(cube_name, optimizer, olap_prompt_converter,
+                osg, olap_service, page_cache_ttl, version)
+
+def get_cube_definition_version(cube: OlapTable) -> str:
+    """
+    Creates version of cube definition out of olap_table.updated_at and content of .toml files of the cube
+    :param cube: row of olap_table
+    :return: sha256 hex digest
+    """
+    version = hashlib.sha256(str(cube.updated_at).encode())
+
+    for directory, _, file_names in sorted(os.walk(str(cube.toml_link))):
+        for file_name in sorted(file_names):
+            if not file_name.endswith(".toml"):
+                continue
+
+            file_path: str = os.path.join(directory, file_name)
+            version.update(file_path.encode())
+
+            with open(file_path, "rb") as toml_file:
+                version.update(toml_file.read())
+
+    return version.hexdigest()
+
+async def reload_cubes(cubes_collection: CubeCollection, cube_name: str | None = None,
+                       force: bool = False) -> list[str]:
+    """
+    Reloads cubes which olap_table row or .toml files have changed
+    New cubes are added, cubes that were removed from olap_table are removed from collection
+    Cube that could not be built is logged, previous version of it is kept
+    Cube that was not built yet is not reloaded, it is built with new definition on first use
+    :param cubes_collection: collection of cubes
+    :param cube_name: reload only this cube. All cubes if None
+    :param force: reload even if definition has not changed
+    :return: names of reloaded cubes
+    """
+    possible_cubes: list[Type[OlapTable]] = await run_in_threadpool(get_olap_tables)
+    possible_cube_names: set[str] = {str(cube.name) for cube in possible_cubes}
+    registered_cube_names: set[str] = set(cubes_collection.get_cube_names())
+    reloaded: list[str] = []
+
+    for cube in possible_cubes:
+        if (cube_name is not None) and (cube.name != cube_name):
+            continue
+
+        cube_factory: partial = partial(add_cube_from_olap_table, cube)
+
+        if (str(cube.name) in registered_cube_names) and (not cubes_collection.is_cube_built(str(cube.name))):
+            # Factory gets current olap_table row, .toml files are read when cube is built
+            cubes_collection.add_lazy_cube(str(cube.name), cube_factory)
+            continue
+
+        version: str = await run_in_threadpool(get_cube_definition_version, cube)
+
+        if (not force) and (version == cubes_collection.get_cube_version(str(cube.name))):
+            continue
+
+        try:
+            is_rebuilt: bool = await cubes_collection.reload_cube_async(str(cube.name), cube_factory)
+        except Exception:
+            logger.exception("Could not reload cube %s", cube.name)
+            continue
+
+        if is_rebuilt:
+            reloaded.append(str(cube.name))
+        else:
+            logger.info("Cube %s was added", cube.name)
+
+    if cube_name is None:
+        for removed_cube_name in set(cubes_collection.get_cube_names()) - possible_cube_names:
+            cubes_collection.remove_cube(removed_cube_name)
+            logger.info("Cube %s was removed", removed_cube_name)
+
+    return reloaded
+
+async def reload_cubes_forever(cubes_collection: CubeCollection, interval: int) -> None:
+    """
+    Checks definitions of cubes every :param interval: seconds and reloads changed ones
+    Should be run as background task and cancelled on shutdown
+    :param cubes_collection: collection of cubes
+    :param interval: seconds between checks
+    :return: None
+    """
+    while True:
+        await asyncio.sleep(interval)
+
+        try:
+            await reload_cubes(cubes_collection)
+        except Exception:
+            logger.exception("Could not check definitions of cubes")
+
+def get_olap_tables() -> list[Type[OlapTable]]:
+    """
+    Reads all rows of olap_table with its own Session
+    :return: rows of olap_table
+    """
+    with SessionLocal() as db:
+        return get_all_olap_cubes(db)
+
+async def refresh_materialized_views(cubes_collection: CubeCollection, cube_name: str) -> None:
+    """
+    Reads refreshes of materialized views made by all instances of application and refreshes views that are due
+    Views are refreshed one by one. Error of one view is saved and does not stop refresh of others
+    Sync optimizers are run in thread pool
+    :param cubes_collection: collection of cubes
+    :param cube_name: name of the cube
+    :return: None
+    """
+    async with cubes_collection.use_cube_async(cube_name) as cube:
+        await refresh_views_of_cube(cube.get_optimizer(), cube_name)
+
+async def refresh_views_of_cube(optimizer: OptimizerAbstract | OptimizerAsyncAbstract, cube_name: str) -> None:
+    """
+    Refreshes views that are due with optimizer of one version of the cube
+    :param optimizer: optimizer of the cube
+    :param cube_name: name of the cube
+    :return: None
+    """
+    materialized_views: MaterializedViewCatalog = optimizer.get_materialized_views()
+    views: list[MaterializedView] = materialized_views.get_views()
+
+    if len(views) == 0:
+        return
+
+    refreshes: dict[str, MaterializedViewRefresh] = await run_in_threadpool(get_view_refreshes, cube_name)
+
+    for view in views:
+        refresh: MaterializedViewRefresh | None = refreshes.get(view.table_name, None)
+        # View with other definition is dropped and created again
+        recreate: bool = (refresh is not None) and (refresh.definition_hash != view.definition_hash)
+
+        if refresh is not None:
+            materialized_views.set_refreshed_at(view.table_name, None if recreate else refresh.refreshed_at)
+
+        if not materialized_views.is_refresh_due(view.table_name):
+            continue
+
+        refresh_started_at: datetime.datetime = datetime.datetime.now()
+        is_refreshed: bool
+        materialized_views.start_refresh(view.table_name)
+
+        try:
+            if isinstance(optimizer, OptimizerAsyncAbstract):
+                is_refreshed = await optimizer.refresh_materialized_view(view, recreate)
+            else:
+                is_refreshed = await run_in_threadpool(optimizer.refresh_materialized_view, view, recreate)
+        except Exception as error:
+            logger.exception("Could not refresh materialized view %s of cube %s", view.table_name, cube_name)
+            materialized_views.fail_refresh(view.table_name, str(error))
+            await run_in_threadpool(save_view_refresh, cube_name, view, refresh_started_at, str(error))
+            continue
+
+        if not is_refreshed:
+            logger.info("Materialized view %s of cube %s is refreshed by other instance", view.table_name, cube_name)
+            materialized_views.finish_refresh(view.table_name, None, 0)
+            continue
+
+        refresh_ms: float = (datetime.datetime.now() - refresh_started_at).total_seconds() * 1000
+        materialized_views.finish_refresh(view.table_name, refresh_started_at, refresh_ms)
+        await run_in_threadpool(save_view_refresh, cube_name, view, refresh_started_at)
+        logger.info("Materialized view %s of cube %s was refreshed in %.0f ms", view.table_name, cube_name,
+                    refresh_ms)
+
+async def refresh_materialized_views_forever(cubes_collection: CubeCollection, interval: int) -> None:
+    """
+    Checks materialized views of all cubes every :param interval: seconds, starting right away
+    Errors are logged, so one unavailable database does not stop refresh of other cubes
+    Should be run as background task and cancelled on shutdown
+    :param cubes_collection: collection of cubes
+    :param interval: seconds between checks
+    :return: None
+    """
+    while True:
+        # Only built cubes, lazy cubes are not built by refresh
+        for cube_name in list(cubes_collection.keys()):
+            try:
+                await refresh_materialized_views(cubes_collection, cube_name)
+            except Exception:
+                logger.exception("Could not refresh materialized views of cube %s", cube_name)
+
+        await asyncio.sleep(interval)
+
+def get_view_refreshes(cube_name: str) -> dict[str, MaterializedViewRefresh]:
+    """
+    Reads refreshes of materialized views of cube with its own Session
+    :param cube_name: name of the cube
+    :return: MaterializedViewRefresh by table name
+    """
+    with SessionLocal() as db:
+        return get_materialized_view_refreshes(db, cube_name)
+
+def save_view_refresh(cube_name: str, view: MaterializedView, refresh_started_at: datetime.datetime,
+                      error: str | None = None) -> None:
+    """
+    Saves result of refresh of materialized view with its own Session
+    :param cube_name: name of the cube
+    :param view: refreshed MaterializedView
+    :param refresh_started_at: start of refresh
+    :param error: text of error. None if refresh was successful
+    :return: None
+    """
+    with SessionLocal() as db:
+        save_materialized_view_refresh(db, cube_name, view, refresh_started_at, error)
@@ -1,4 +1,10 @@
 from fastapi import APIRouter, status
+from prometheus_client import generate_latest
+from starlette.requests import Request
+from starlette.responses import Response
+
+from service.cube import CubeCollection
+from service.metrics import registry, update_cube_stats, PROMETHEUS_MEDIA_TYPE
 
 router = APIRouter()
 
@@ -9,4 +15,18 @@ def check_health():
     Simply returns Ok status
     :return:
     """
-    return
\ No newline at end of file
+    return
+
+@router.get("/metrics")
+def get_metrics(request: Request) -> Response:
+    """
+    Returns metrics in prometheus text format
+    Durations of query pipeline stages, returned rows and bytes, admission and connection pools of cubes
+    :param request: starlette Request. No need to be provided
+    :return: text/plain response
+    """
+    cubes: CubeCollection = request.state.cubes
+
+    update_cube_stats(cubes.get_admission_stats(), cubes.get_pool_stats(), cubes.get_query_interruption_stats())
+
+    return Response(content=generate_latest(registry), media_type=PROMETHEUS_MEDIA_TYPE)
@@ -1,45 +1,78 @@
 from fastapi import APIRouter, Depends, status, HTTPException
 from sqlalchemy.dialects.mssql.information_schema import columns
 from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
 from starlette.requests import Request
+from fastapi.encoders import jsonable_encoder
+from starlette.responses import StreamingResponse, Response, JSONResponse
 
+from core.config import settings
 from core.database import get_db
-from core.utils.exceptions import NoCubesForUser, TooManyRows
+from core.utils.exceptions import NoCubesForUser, TooManyRows, NoArrowSupport
 from model.base_model import SavedQuery
+from olap_info.olap_sales_cube import reload_cubes
 from model.dto import FrontendFieldsJson, QueryMetaData, QueryDTO, FrontendDistinctJson, AvailableCubes, \
-    FilterDataFromColumnDTO, FrontDistinctDTO
-from service.db import save_query_meta_data
+    FilterDataFromColumnDTO, FrontDistinctDTO, ExportFormat, PageCacheStatsDTO, MemoStatsDTO, TokenClaims, \
+    ReloadedCubesDTO, PoolStatsDTO, AdmissionStatsDTO, RequestPriority, QueryInterruptionStatsDTO, \
+    MaterializedViewStatsDTO
+from service.admission import set_request_admission
+from service.arrow_serializer import get_columnar_format, COLUMNAR_MEDIA_TYPES
+from service.db import save_query_meta_data, get_fresh_saved_query
 from service.cube import CubeCollection
-from service.security import get_user_from_jwt, cube_security_check
+from service.metrics import set_metric_labels_from_route, stage_timer, add_returned_data
+from service.payload_fingerprint import get_payload_fingerprint
+from service.tracing import set_span_attributes_from_route, trace_span
+from service.query_cancel import run_cancellable
+from service.security import get_user_from_jwt, cube_security_check, get_token_claims, get_admin_from_jwt
 from service.user import get_available_cubes_for_user
 
-router = APIRouter()
+router = APIRouter(dependencies=[Depends(set_metric_labels_from_route), Depends(set_span_attributes_from_route)])
+
+
+def create_rows_response(rows: list) -> JSONResponse:
+    """
+    Encodes rows the same way FastAPI does, but measures encoding and counts returned data
+    :param rows: rows from database
+    :return: JSONResponse
+    """
+    with trace_span("serialization", {"serialization.format": "json"}) as span, stage_timer("serialize"):
+        response: JSONResponse = JSONResponse(jsonable_encoder(rows))
+        span.set_attributes({"query.rows": len(rows), "serialization.bytes": len(response.body)})
+
+    add_returned_data(len(rows), len(response.body))
+
+    return response
+
 
 @router.get("/v1/cube/{cube_name}/front-fields")
-def get_front_fields(cube_name: str, request: Request, username: str = Depends(get_user_from_jwt),
+def get_front_fields(cube_name: str, request: Request, token_claims: TokenClaims = Depends(get_token_claims),
                      db: Session = Depends(get_db)):
     """
     Get list of fields that are available for user to query
     :param db:
-    :param username:
+    :param token_claims: verified JWT, used for auth and cube access confirmation
     :param request: standard requests
     :param cube_name: Name of the cube
     :return:
     """
-    cube_security_check(username, cube_name, db)
+    cube_security_check(token_claims.username, cube_name, db, token_claims)
 
     cubes: CubeCollection = request.state.cubes
 
-    return cubes.get_front_fields_dto(cube_name)
+    with cubes.use_cube(cube_name):
+        return cubes.get_front_fields_dto(cube_name)
 
 
 @router.post("/v1/cube/{cube_name}/query_info")
-def get_query_info(cube_name: str, front_data: FrontendFieldsJson, request: Request, db: Session = Depends(get_db),
-                   username: str = Depends(get_user_from_jwt)) -> QueryDTO:
+async def get_query_info(cube_name: str, front_data: FrontendFieldsJson, request: Request,
+                         db: Session = Depends(get_db),
+                         token_claims: TokenClaims = Depends(get_token_claims)) -> QueryDTO:
     """
     Get query id, number of pages and items per page
+    If the same data (up to order of conditions) was requested recently, saved query is returned
+    without running optimizer and counting rows
 
-    :param username: username from JWT will be used for auth and cube access confirmation
+    :param token_claims: verified JWT, used for auth and cube access confirmation
     :param request: standard request
     :param db: required db connection
     :param cube_name: Name of the cube
@@ -47,72 +80,158 @@ def get_query_info(cube_name: str, front_data: FrontendFieldsJson, request: Requ
     :return: QueryDTO
     """
 
-    cube_security_check(username, cube_name, db)
+    await run_in_threadpool(cube_security_check, token_claims.username, cube_name, db, token_claims)
+
+    set_request_admission(token_claims.username, RequestPriority.INTERACTIVE)
 
     # We want to get data using limit-offset
     add_order_by: bool = True
 
     front_data_dict: dict = front_data.model_dump(mode='json')
+    payload_hash: str = get_payload_fingerprint(front_data)
 
     cubes: CubeCollection = request.state.cubes
-    try:
-        query_info: QueryMetaData = cubes.get_query_meta(cube_name, front_data, add_order_by)
-    except TooManyRows:
-        raise HTTPException(status.HTTP_406_NOT_ACCEPTABLE, detail="Слишком много строк выдаче. Попробуйте выставить "
-                                                                    "фильтры или обратитесь к администратору "
-                                                                    "для увеличения лимитов")
 
-    qry: SavedQuery = save_query_meta_data(db, query_info, front_data_dict)
+    # Reload in the middle of request does not mix two versions of the cube
+    async with cubes.use_cube_async(cube_name):
+        # Saved query could belong to previous version of reloaded cube
+        fresh_query: SavedQuery | None = await run_in_threadpool(get_fresh_saved_query, db, cube_name,
+                                                                 cubes.get_cube_version(cube_name), payload_hash,
+                                                                 settings.ROWS_PER_PAGE,
+                                                                 settings.SAVED_QUERY_REUSE_TTL)
+
+        if fresh_query is not None:
+            return QueryDTO(id=fresh_query.id, pages=fresh_query.pages, items_per_page=fresh_query.items_per_page,
+                            is_pages_exact=fresh_query.is_rows_no_exact)
 
-    query_dto: QueryDTO = QueryDTO(id = qry.id, pages=qry.pages, items_per_page=qry.items_per_page)
+        try:
+            query_info: QueryMetaData = await run_cancellable(request, cubes.get_query_meta_async(
+                cube_name, front_data, add_order_by))
+        except TooManyRows:
+            raise HTTPException(status.HTTP_406_NOT_ACCEPTABLE, detail="Слишком много строк выдаче. Попробуйте "
+                                                                        "выставить фильтры или обратитесь к "
+                                                                        "администратору для увеличения лимитов")
+
+    qry: SavedQuery = await run_in_threadpool(save_query_meta_data, db, query_info, front_data_dict, payload_hash)
+
+    query_dto: QueryDTO = QueryDTO(id = qry.id, pages=qry.pages, items_per_page=qry.items_per_page,
+                                  is_pages_exact=query_info.is_rows_no_exact)
 
     return query_dto
 
 
 @router.get("/v1/cube/{cube_name}/query_id/{query_id}")
-def get_data_by_page(cube_name: str, query_id: int, request: Request, page: int = 0,
-                     username: str = Depends(get_user_from_jwt), db: Session = Depends(get_db)):
+async def get_data_by_page(cube_name: str, query_id: int, request: Request, page: int = 0,
+                           token_claims: TokenClaims = Depends(get_token_claims), db: Session = Depends(get_db)):
     """
     Gets data from OLAP database by previously saved query in QueryMetaData
 
-    :param username:
+    :param token_claims: verified JWT, used for auth and cube access confirmation
+    :param cube_name: Name of the cube
+    :param query_id: query id of SavedQuery
+    :param request: starlette Request. No need to be provided
+    :param page: page no to be downloaded. Pages are sought by last key of previous page when it is known,
+        otherwise query works as offset-limit kind
+    :param db: dependency injected Session
+    :return: converted to dict data from database. If Accept header is application/vnd.apache.arrow.stream or
+        application/parquet, page is returned in this format
+    """
+
+    await run_in_threadpool(cube_security_check, token_claims.username, cube_name, db, token_claims)
+
+    # User waits for the first page, next ones are usually downloaded one after another
+    set_request_admission(token_claims.username,
+                          RequestPriority.INTERACTIVE if page == 0 else RequestPriority.BULK)
+
+    cubes: CubeCollection = request.state.cubes
+
+    columnar_format: ExportFormat | None = get_columnar_format(request.headers.get("accept"))
+
+    async with cubes.use_cube_async(cube_name):
+        if columnar_format is not None:
+            try:
+                content: bytes = await run_cancellable(request, cubes.select_data_by_pages_columnar_async(
+                    cube_name, query_id, page, columnar_format, db))
+            except NoArrowSupport:
+                raise HTTPException(status.HTTP_406_NOT_ACCEPTABLE,
+                                    detail="Формат arrow и parquet не поддерживается")
+
+            return Response(content=content, media_type=COLUMNAR_MEDIA_TYPES[columnar_format])
+
+        result = await run_cancellable(request, cubes.select_data_by_pages_async(cube_name, query_id, page, db))
+
+    return create_rows_response(result)
+
+@router.get("/v1/cube/{cube_name}/query_id/{query_id}/stream")
+async def stream_data(cube_name: str, query_id: int, request: Request,
+                      export_format: ExportFormat = ExportFormat.NDJSON,
+                      token_claims: TokenClaims = Depends(get_token_claims),
+                      db: Session = Depends(get_db)) -> StreamingResponse:
+    """
+    Streams complete result of previously saved query in QueryMetaData
+    Data is read with server-side cursor and sent by chunks, so all pages are downloaded in one request
+
     :param cube_name: Name of the cube
     :param query_id: query id of SavedQuery
     :param request: starlette Request. No need to be provided
-    :param page: page no to be downloaded query works as offset-limit kind
+    :param export_format: ndjson, csv, arrow or parquet. Accept header application/vnd.apache.arrow.stream or
+        application/parquet overrides it
+    :param token_claims: verified JWT, used for auth and cube access confirmation
     :param db: dependency injected Session
-    :return: converted to dict data from database
+    :return: StreamingResponse with ndjson, csv, arrow stream or parquet
     """
 
-    cube_security_check(username, cube_name, db)
+    await run_in_threadpool(cube_security_check, token_claims.username, cube_name, db, token_claims)
+
+    set_request_admission(token_claims.username, RequestPriority.BULK)
 
     cubes: CubeCollection = request.state.cubes
 
-    result = cubes.select_data_by_pages(cube_name, query_id, page, db)
+    media_types: dict[ExportFormat, str] = {
+        ExportFormat.NDJSON: "application/x-ndjson",
+        ExportFormat.CSV: "text/csv",
+        **COLUMNAR_MEDIA_TYPES,
+    }
+
+    # Accept header has priority over query parameter
+    columnar_format: ExportFormat | None = get_columnar_format(request.headers.get("accept"))
 
-    return result
+    if columnar_format is not None:
+        export_format = columnar_format
+
+    try:
+        # Stream keeps the version of the cube it was created from until it ends
+        async with cubes.use_cube_async(cube_name):
+            content = await run_in_threadpool(cubes.stream_data_by_query, cube_name, query_id, export_format, db)
+    except NoArrowSupport:
+        raise HTTPException(status.HTTP_406_NOT_ACCEPTABLE, detail="Формат arrow и parquet не поддерживается")
+
+    return StreamingResponse(content, media_type=media_types[export_format])
 
 @router.get("/v1/cube/{cube_name}/dimension")
-def get_dimension(cube_name: str, dimension_field: FrontendDistinctJson, request: Request,
-                  username: str = Depends(get_user_from_jwt), db: Session = Depends(get_db)):
+async def get_dimension(cube_name: str, dimension_field: FrontendDistinctJson, request: Request,
+                        token_claims: TokenClaims = Depends(get_token_claims), db: Session = Depends(get_db)):
     """
     Gets data from OLAP database with data of current dimension. To help frontend users use filters
 
     :param db:
-    :param username:
+    :param token_claims: verified JWT, used for auth and cube access confirmation
     :param dimension_field:
     :param cube_name: Name of the cube
     :param request: starlette Request. No need to be provided
     :return: converted JSON data from database
     """
 
-    cube_security_check(username, cube_name, db)
+    await run_in_threadpool(cube_security_check, token_claims.username, cube_name, db, token_claims)
+
+    set_request_admission(token_claims.username, RequestPriority.INTERACTIVE)
 
     cubes: CubeCollection = request.state.cubes
 
-    result = cubes.select_dimension(cube_name, dimension_field)
+    async with cubes.use_cube_async(cube_name):
+        result = await run_cancellable(request, cubes.select_dimension_async(cube_name, dimension_field))
 
-    return result
+    return create_rows_response(result)
 
 @router.get("/v1/cube/available")
 def get_available_cubes(username: str = Depends(get_user_from_jwt), db: Session = Depends(get_db)):
@@ -129,9 +248,105 @@ def get_available_cubes(username: str = Depends(get_user_from_jwt), db: Session
 
     return cubes
 
+@router.get("/v1/cube/page-cache/stats")
+def get_page_cache_stats(request: Request, username: str = Depends(get_user_from_jwt)) -> PageCacheStatsDTO:
+    """
+    Returns hit, miss and eviction counters of OLAP page cache
+    :param request: starlette Request. No need to be provided
+    :param username: username from JWT
+    :return: PageCacheStatsDTO
+    """
+
+    cubes: CubeCollection = request.state.cubes
+
+    return cubes.get_page_cache_stats()
+
+@router.get("/v1/cube/query-memo/stats")
+def get_queries_memo_stats(request: Request, username: str = Depends(get_user_from_jwt)) -> MemoStatsDTO:
+    """
+    Returns hit rate of memo of generated queries
+    :param request: starlette Request. No need to be provided
+    :param username: username from JWT
+    :return: MemoStatsDTO
+    """
+
+    cubes: CubeCollection = request.state.cubes
+
+    return cubes.get_queries_memo_stats()
+
+@router.get("/v1/cube/pool/stats")
+def get_pool_stats(request: Request, username: str = Depends(get_user_from_jwt)) -> list[PoolStatsDTO]:
+    """
+    Returns checked-out, idle and overflow connections of every cube engine
+    :param request: starlette Request. No need to be provided
+    :param username: username from JWT
+    :return: list of PoolStatsDTO
+    """
+
+    cubes: CubeCollection = request.state.cubes
+
+    return cubes.get_pool_stats()
+
+@router.get("/v1/cube/admission/stats")
+def get_admission_stats(request: Request, username: str = Depends(get_user_from_jwt)) -> list[AdmissionStatsDTO]:
+    """
+    Returns running and waiting queries and queue wait times of every cube
+    :param request: starlette Request. No need to be provided
+    :param username: username from JWT
+    :return: list of AdmissionStatsDTO
+    """
+
+    cubes: CubeCollection = request.state.cubes
+
+    return cubes.get_admission_stats()
+
+@router.get("/v1/cube/query/stats")
+def get_query_interruption_stats(request: Request,
+                                 username: str = Depends(get_user_from_jwt)) -> list[QueryInterruptionStatsDTO]:
+    """
+    Returns number of queries cancelled because client has disconnected and queries stopped by statement timeout
+    :param request: starlette Request. No need to be provided
+    :param username: username from JWT
+    :return: list of QueryInterruptionStatsDTO
+    """
+
+    cubes: CubeCollection = request.state.cubes
+
+    return cubes.get_query_interruption_stats()
+
+@router.get("/v1/cube/materialized-views/stats")
+def get_materialized_view_stats(request: Request,
+                                username: str = Depends(get_user_from_jwt)) -> list[MaterializedViewStatsDTO]:
+    """
+    Returns refresh state of materialized views. Queries go to base tables while view is not available
+    :param request: starlette Request. No need to be provided
+    :param username: username from JWT
+    :return: list of MaterializedViewStatsDTO
+    """
+
+    cubes: CubeCollection = request.state.cubes
+
+    return cubes.get_materialized_view_stats()
+
+@router.post("/v1/cube/reload")
+async def reload_cube_definitions(request: Request, cube_name: str | None = None,
+                                  username: str = Depends(get_admin_from_jwt)) -> ReloadedCubesDTO:
+    """
+    Reloads cubes from olap_table and .toml files without restart, even if definitions have not changed
+    Requests that have already started finish on previous version of the cube
+    :param request: starlette Request. No need to be provided
+    :param cube_name: reload only this cube. All cubes if not provided
+    :param username: admin username from JWT
+    :return: ReloadedCubesDTO with names of reloaded cubes
+    """
+
+    cubes: CubeCollection = request.state.cubes
+
+    return ReloadedCubesDTO(cube_names=await reload_cubes(cubes, cube_name, force=True))
+
 @router.post("/v1/cube/{cube_name}/filter_data")
-def get_filter_help(cube_name: str, field_dto: FrontDistinctDTO, request: Request,
-                        username: str = Depends(get_user_from_jwt), db: Session = Depends(get_db)) ->\
+async def get_filter_help(cube_name: str, field_dto: FrontDistinctDTO, request: Request,
+                          token_claims: TokenClaims = Depends(get_token_claims), db: Session = Depends(get_db)) ->\
         FilterDataFromColumnDTO:
     """
     Returns distinct data from dimension table
@@ -140,15 +355,19 @@ def get_filter_help(cube_name: str, field_dto: FrontDistinctDTO, request: Reques
     :param request:
     :param cube_name: name of the cube
     :param field_dto: name of the field, and type of select, values of which will be returned
-    :param username: Username from JWT
+    :param token_claims: verified JWT, used for auth and cube access confirmation
     :param db: DB from services
     :return: list of data (could be string or int or float)
     """
 
-    cube_security_check(username, cube_name, db)
+    await run_in_threadpool(cube_security_check, token_claims.username, cube_name, db, token_claims)
+
+    set_request_admission(token_claims.username, RequestPriority.INTERACTIVE)
 
     cubes: CubeCollection = request.state.cubes
 
-    distinct_values: FilterDataFromColumnDTO = cubes.get_distinct_data_from_column(cube_name, field_dto)
+    async with cubes.use_cube_async(cube_name):
+        distinct_values: FilterDataFromColumnDTO = await run_cancellable(
+            request, cubes.get_distinct_data_from_column_async(cube_name, field_dto))
 
     return distinct_values
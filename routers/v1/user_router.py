@@ -4,16 +4,20 @@ from sqlalchemy.orm import Session
 
 from core.database import get_db
 from core.utils.exceptions import UserAlreadyExists, UserWithMailAlreadyExists, NoConfirmationCode, UserIsActiveAlready, \
-    CodeActivationExpired, UserIsNotActivated, WrongPassword, UserNotFound, ForgotPasswordExists
-from model.dto import UserRegisterDTO, MessageOnly, AuthenticateDTO, Token, ChangeForgottenPassword
-from service.user import create_new_user, activate_user_code, authenticate_user_and_return_jwt, \
-    send_forgot_password_code, change_password_with_code
+    CodeActivationExpired, UserIsNotActivated, WrongPassword, UserNotFound, ForgotPasswordExists, \
+    PasswordHashPoolIsFull
+from model.dto import UserRegisterDTO, MessageOnly, AuthenticateDTO, Token, ChangeForgottenPassword, \
+    PasswordHashStatsDTO, MailOutboxStatsDTO
+from service.mail_outbox import mail_outbox_sender
+from service.security import password_hash_pool, get_user_from_jwt
+from service.user import activate_user_code, send_forgot_password_code, change_password_with_code_async, \
+    create_new_user_async, authenticate_user_and_return_jwt_async
 
 router = APIRouter()
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/v1/user/authenticate")
 
 @router.post("/v1/user/register", status_code=status.HTTP_201_CREATED, response_model=MessageOnly)
-def register_user(user_dto: UserRegisterDTO, db: Session = Depends(get_db)) -> MessageOnly:
+async def register_user(user_dto: UserRegisterDTO, db: Session = Depends(get_db)) -> MessageOnly:
     """
     Register user
 
@@ -25,7 +29,10 @@ def register_user(user_dto: UserRegisterDTO, db: Session = Depends(get_db)) -> M
     middle_activation_link: str = r"v1/user/activate"
 
     try:
-        create_new_user(user_dto, db, middle_activation_link)
+        await create_new_user_async(user_dto, db, middle_activation_link)
+    except PasswordHashPoolIsFull:
+        raise HTTPException(status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                            detail=f"Сервер перегружен. Повторите попытку позже", headers={"Retry-After": "1"})
     except UserAlreadyExists:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                             detail=f"Пользователь с именем {user_dto.username} уже существует")
@@ -89,7 +96,7 @@ def forgot_password(username: str, db: Session = Depends(get_db)):
     return message
 
 @router.post("/v1/user/change_forgotten_password", response_model=MessageOnly)
-def change_forgotten_password(change_password_dto:ChangeForgottenPassword, db: Session = Depends(get_db)):
+async def change_forgotten_password(change_password_dto:ChangeForgottenPassword, db: Session = Depends(get_db)):
     """
     Change forgotten password
 
@@ -97,14 +104,18 @@ def change_forgotten_password(change_password_dto:ChangeForgottenPassword, db: S
     :param db:
     :return:
     """
-    change_password_with_code(change_password_dto, db)
+    try:
+        await change_password_with_code_async(change_password_dto, db)
+    except PasswordHashPoolIsFull:
+        raise HTTPException(status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                            detail=f"Сервер перегружен. Повторите попытку позже", headers={"Retry-After": "1"})
 
     message: MessageOnly = MessageOnly(message="Пароль изменен")
 
     return message
 
 @router.post("/v1/user/authenticate", response_model=Token)
-def auth(authenticate: AuthenticateDTO, db: Session = Depends(get_db)) -> Token:
+async def auth(authenticate: AuthenticateDTO, db: Session = Depends(get_db)) -> Token:
     """
     Authenticate User
 
@@ -116,7 +127,10 @@ def auth(authenticate: AuthenticateDTO, db: Session = Depends(get_db)) -> Token:
     jwt: str
 
     try:
-        jwt = authenticate_user_and_return_jwt(authenticate.user, authenticate.password, db)
+        jwt = await authenticate_user_and_return_jwt_async(authenticate.user, authenticate.password, db)
+    except PasswordHashPoolIsFull:
+        raise HTTPException(status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                            detail=f"Сервер перегружен. Повторите попытку позже", headers={"Retry-After": "1"})
     except (UserIsNotActivated, UserNotFound):
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
                             detail=f"Пользователя не существует или он не активирован")
@@ -127,3 +141,26 @@ def auth(authenticate: AuthenticateDTO, db: Session = Depends(get_db)) -> Token:
     token: Token = Token(access_token=jwt, token_type="bearer")
 
     return token
+
+@router.get("/v1/user/password-hash/stats")
+def get_password_hash_stats(username: str = Depends(get_user_from_jwt)) -> PasswordHashStatsDTO:
+    """
+    Returns queue depth and latency of password hashing pool
+    :param username: username from JWT
+    :return: PasswordHashStatsDTO
+    """
+
+    return password_hash_pool.get_stats()
+
+
+@router.get("/v1/user/mail-outbox/stats")
+def get_mail_outbox_stats(username: str = Depends(get_user_from_jwt),
+                          db: Session = Depends(get_db)) -> MailOutboxStatsDTO:
+    """
+    Returns number of mails waiting in outbox and send counters
+    :param username: username from JWT
+    :param db:
+    :return: MailOutboxStatsDTO
+    """
+
+    return mail_outbox_sender.get_stats(db)
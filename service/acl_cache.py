@@ -0,0 +1,111 @@
+import asyncio
+import logging
+import threading
+
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+from core.database import SessionLocal
+from service.db import get_acl_version, get_cube_names_by_username
+
+logger = logging.getLogger(__name__)
+
+
+class AclCache:
+    """
+    Process-wide map of usernames to names of cubes they can access
+    All grants are loaded at once and reloaded only when acl_version in database changes,
+    so access check does not query metadata database
+    """
+
+    def __init__(self) -> None:
+        self.__cube_names_by_username: dict[str, frozenset[str]] | None = None
+        self.__version: int | None = None
+        self.__lock: threading.Lock = threading.Lock()
+
+    def is_loaded(self) -> bool:
+        """
+        Checks if grants were loaded at least once
+        :return: True if cache could answer access checks
+        """
+        return self.__cube_names_by_username is not None
+
+    def get_version(self) -> int | None:
+        """
+        Returns acl_version of loaded grants
+        :return: version or None if grants were not loaded or were invalidated
+        """
+        return self.__version
+
+    def has_access(self, username: str, cube_name: str) -> bool:
+        """
+        Checks if user can access cube
+        :param username: username
+        :param cube_name: name of the cube
+        :return: True if user has grant for the cube. False if there is no grant or cache was not loaded
+        """
+        cube_names_by_username: dict[str, frozenset[str]] | None = self.__cube_names_by_username
+
+        if cube_names_by_username is None:
+            return False
+
+        return cube_name in cube_names_by_username.get(username, frozenset())
+
+    def refresh(self, db: Session) -> bool:
+        """
+        Reloads all grants if acl_version has changed since the last load
+        :param db: Session
+        :return: True if grants were reloaded
+        """
+        with self.__lock:
+            # Version is read before grants. If grants change in between, next refresh loads them again
+            version: int | None = get_acl_version(db)
+
+            if self.is_loaded() and (version is not None) and (version == self.__version):
+                return False
+
+            cube_names_by_username: dict[str, set[str]] = get_cube_names_by_username(db)
+
+            self.__cube_names_by_username = {username: frozenset(cube_names)
+                                             for username, cube_names in cube_names_by_username.items()}
+            self.__version = version
+
+        logger.info("Access rights of %s users were loaded, acl version %s", len(cube_names_by_username), version)
+
+        return True
+
+    def invalidate(self) -> None:
+        """
+        Makes next refresh reload grants even if acl_version is the same.
+        Loaded grants are still used until then
+        :return: None
+        """
+        with self.__lock:
+            self.__version = None
+
+    async def refresh_forever(self, interval: int) -> None:
+        """
+        Checks acl_version every :param interval: seconds, starting right away
+        If metadata database is unavailable, previously loaded grants are used
+        Should be run as background task and cancelled on shutdown
+        :param interval: seconds between checks
+        :return: None
+        """
+        while True:
+            try:
+                await run_in_threadpool(self.__refresh_with_new_session)
+            except Exception:
+                logger.exception("Could not refresh access rights")
+
+            await asyncio.sleep(interval)
+
+    def __refresh_with_new_session(self) -> None:
+        """
+        Refresh with its own Session, background task has no request Session
+        :return: None
+        """
+        with SessionLocal() as db:
+            self.refresh(db)
+
+
+acl_cache: AclCache = AclCache()
@@ -0,0 +1,332 @@
+import asyncio
+import threading
+import time
+from collections import deque
+from contextvars import ContextVar
+
+from core.utils.exceptions import AdmissionQueueIsFull, AdmissionTimeout
+from model.dto import RequestPriority, AdmissionStatsDTO
+from service.metrics import stage_timer
+
+# Who runs the query and how urgent it is. Set by router, read when optimizer asks for connection
+admission_username: ContextVar[str | None] = ContextVar("admission_username", default=None)
+admission_priority: ContextVar[RequestPriority] = ContextVar("admission_priority", default=RequestPriority.BULK)
+
+
+def set_request_admission(username: str | None, priority: RequestPriority) -> None:
+    """
+    Sets user and priority of current request. Queries of request are admitted with them
+    Value is copied to thread pool and to iterators of streaming response
+    :param username: username from JWT
+    :param priority: RequestPriority.INTERACTIVE for requests user waits for, RequestPriority.BULK for exports
+    :return: None
+    """
+    admission_username.set(username)
+    admission_priority.set(priority)
+
+
+class _Waiter:
+    """
+    Request waiting for connection. Thread waits for event, coroutine waits for future
+    """
+
+    def __init__(self, username: str | None, priority: RequestPriority,
+                 loop: asyncio.AbstractEventLoop | None) -> None:
+        self.username: str | None = username
+        self.priority: RequestPriority = priority
+        self.enqueued_at: float = time.perf_counter()
+        self.is_admitted: bool = False
+        self.loop: asyncio.AbstractEventLoop | None = loop
+        self.event: threading.Event | None = None
+        self.future: asyncio.Future | None = None
+
+        if loop is None:
+            self.event = threading.Event()
+        else:
+            self.future = loop.create_future()
+
+    def wake_up(self) -> None:
+        """
+        Wakes waiter up from any thread
+        :return: None
+        """
+        if self.event is not None:
+            self.event.set()
+        else:
+            self.loop.call_soon_threadsafe(self.__set_future_result)
+
+    def __set_future_result(self) -> None:
+        if not self.future.done():
+            self.future.set_result(True)
+
+
+class AdmissionSlot:
+    """
+    Permission to use one connection. Used as context manager by sync and async optimizers:
+        with controller.admit(): ...
+        async with controller.admit(): ...
+    """
+
+    def __init__(self, controller: "AdmissionController") -> None:
+        self.__controller: AdmissionController = controller
+        self.__username: str | None = admission_username.get()
+        self.__priority: RequestPriority = admission_priority.get()
+
+    def __enter__(self) -> "AdmissionSlot":
+        with stage_timer("admission_wait"):
+            self.__controller.acquire(self.__username, self.__priority)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        self.__controller.release(self.__username, self.__priority)
+
+    async def __aenter__(self) -> "AdmissionSlot":
+        with stage_timer("admission_wait"):
+            await self.__controller.acquire_async(self.__username, self.__priority)
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb) -> None:
+        self.__controller.release(self.__username, self.__priority)
+
+
+class AdmissionController:
+    """
+    Limits parallel queries of one cube. Replaces first-come-first-served semaphore:
+        - not more than :param max_connections: queries at once
+        - one user could not hold more than :param max_per_user: connections
+        - bulk requests (exports, next pages) could not hold more than :param max_bulk: connections,
+          so interactive requests always have connections left
+        - interactive requests are admitted before bulk ones, FIFO inside priority
+        - waiting queue is bounded, request waits not more than :param queue_timeout: seconds
+    Request that could not run because of per-user or bulk limit does not block requests behind it
+    Works both for threads and coroutines
+    """
+
+    def __init__(self, max_connections: int, max_per_user: int, max_bulk: int, max_queue: int,
+                 queue_timeout: float) -> None:
+        """
+        :param max_connections: parallel queries of the cube
+        :param max_per_user: parallel queries of one user
+        :param max_bulk: parallel bulk queries
+        :param max_queue: requests waiting for connection. Next ones get AdmissionQueueIsFull
+        :param queue_timeout: seconds to wait for connection before AdmissionTimeout
+        """
+        self.__max_connections: int = max(max_connections, 1)
+        self.__max_per_user: int = max(min(max_per_user, self.__max_connections), 1)
+        self.__max_bulk: int = max(min(max_bulk, self.__max_connections), 1)
+        self.__max_queue: int = max_queue
+        self.__queue_timeout: float = queue_timeout
+
+        self.__lock: threading.Lock = threading.Lock()
+        self.__running: int = 0
+        self.__running_bulk: int = 0
+        self.__running_by_user: dict[str, int] = {}
+        self.__waiting: dict[RequestPriority, deque[_Waiter]] = {
+            RequestPriority.INTERACTIVE: deque(),
+            RequestPriority.BULK: deque(),
+        }
+
+        self.__admitted: int = 0
+        self.__rejected: int = 0
+        self.__timed_out: int = 0
+        self.__total_wait: float = 0.0
+        self.__max_wait: float = 0.0
+
+    def admit(self) -> AdmissionSlot:
+        """
+        Creates slot for user and priority of current request
+        :return: AdmissionSlot to be used with "with" or "async with"
+        """
+        return AdmissionSlot(self)
+
+    def acquire(self, username: str | None, priority: RequestPriority) -> None:
+        """
+        Waits for connection in current thread
+
+        :raises AdmissionQueueIsFull: if too many requests are waiting
+        :raises AdmissionTimeout: if connection was not given in queue_timeout
+
+        :param username: username or None for background tasks
+        :param priority: priority of request
+        :return: None
+        """
+        waiter: _Waiter = self.__enqueue(username, priority, None)
+
+        if waiter.is_admitted:
+            return
+
+        waiter.event.wait(self.__queue_timeout)
+
+        self.__check_admitted(waiter)
+
+    async def acquire_async(self, username: str | None, priority: RequestPriority) -> None:
+        """
+        Waits for connection without blocking event loop
+
+        :raises AdmissionQueueIsFull: if too many requests are waiting
+        :raises AdmissionTimeout: if connection was not given in queue_timeout
+
+        :param username: username or None for background tasks
+        :param priority: priority of request
+        :return: None
+        """
+        waiter: _Waiter = self.__enqueue(username, priority, asyncio.get_running_loop())
+
+        if waiter.is_admitted:
+            return
+
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter.future), self.__queue_timeout)
+        except asyncio.TimeoutError:
+            pass
+        except asyncio.CancelledError:
+            # Client has gone. Connection could have been given at the same moment
+            with self.__lock:
+                if not waiter.is_admitted:
+                    self.__waiting[waiter.priority].remove(waiter)
+                    raise
+
+            self.release(username, priority)
+            raise
+
+        self.__check_admitted(waiter)
+
+    def release(self, username: str | None, priority: RequestPriority) -> None:
+        """
+        Returns connection and admits next waiting requests
+        :param username: username of admitted request
+        :param priority: priority of admitted request
+        :return: None
+        """
+        with self.__lock:
+            self.__running -= 1
+
+            if priority == RequestPriority.BULK:
+                self.__running_bulk -= 1
+
+            if username is not None:
+                self.__running_by_user[username] -= 1
+
+                if self.__running_by_user[username] == 0:
+                    del self.__running_by_user[username]
+
+            self.__admit_waiting()
+
+    def get_stats(self, cube_name: str) -> AdmissionStatsDTO:
+        """
+        Returns state and counters of admission
+        :param cube_name: name of the cube
+        :return: AdmissionStatsDTO
+        """
+        with self.__lock:
+            average_wait: float = self.__total_wait / self.__admitted if self.__admitted > 0 else 0.0
+
+            return AdmissionStatsDTO(cube_name=cube_name, max_connections=self.__max_connections,
+                                     max_per_user=self.__max_per_user, max_bulk=self.__max_bulk,
+                                     running=self.__running, running_bulk=self.__running_bulk,
+                                     waiting_interactive=len(self.__waiting[RequestPriority.INTERACTIVE]),
+                                     waiting_bulk=len(self.__waiting[RequestPriority.BULK]),
+                                     admitted=self.__admitted, rejected=self.__rejected,
+                                     timed_out=self.__timed_out, average_wait_ms=average_wait * 1000,
+                                     max_wait_ms=self.__max_wait * 1000)
+
+    def __enqueue(self, username: str | None, priority: RequestPriority,
+                  loop: asyncio.AbstractEventLoop | None) -> _Waiter:
+        """
+        Puts request to queue and admits everything that could run
+        :param username: username or None for background tasks
+        :param priority: priority of request
+        :param loop: event loop of coroutine or None for thread
+        :return: waiter. It could be admitted already
+        """
+        waiter: _Waiter = _Waiter(username, priority, loop)
+
+        with self.__lock:
+            self.__waiting[priority].append(waiter)
+            self.__admit_waiting()
+
+            # Request that could not run at once stays in queue only if there is place for it
+            if (not waiter.is_admitted) and (self.__get_waiting_no() > self.__max_queue):
+                self.__waiting[priority].remove(waiter)
+                self.__rejected += 1
+                raise AdmissionQueueIsFull()
+
+        return waiter
+
+    def __check_admitted(self, waiter: _Waiter) -> None:
+        """
+        Removes waiter from queue if it was not admitted in time
+        :param waiter: waiter after wait
+        :raises AdmissionTimeout: if waiter was not admitted
+        :return: None
+        """
+        with self.__lock:
+            # Connection could have been given right after timeout
+            if waiter.is_admitted:
+                return
+
+            self.__waiting[waiter.priority].remove(waiter)
+            self.__timed_out += 1
+
+        raise AdmissionTimeout()
+
+    def __admit_waiting(self) -> None:
+        """
+        Admits waiting requests in order of priority while there are free connections. Should be called under lock
+        :return: None
+        """
+        for priority in [RequestPriority.INTERACTIVE, RequestPriority.BULK]:
+            for waiter in list(self.__waiting[priority]):
+                if self.__running >= self.__max_connections:
+                    return
+
+                if not self.__could_run(waiter):
+                    continue
+
+                self.__waiting[priority].remove(waiter)
+                self.__start(waiter)
+
+    def __could_run(self, waiter: _Waiter) -> bool:
+        """
+        Checks per-user and bulk limits. Should be called under lock
+        :param waiter: waiting request
+        :return: True if request could get free connection
+        """
+        if (waiter.username is not None) and \
+                (self.__running_by_user.get(waiter.username, 0) >= self.__max_per_user):
+            return False
+
+        if (waiter.priority == RequestPriority.BULK) and (self.__running_bulk >= self.__max_bulk):
+            return False
+
+        return True
+
+    def __start(self, waiter: _Waiter) -> None:
+        """
+        Gives connection to request. Should be called under lock
+        :param waiter: admitted request
+        :return: None
+        """
+        self.__running += 1
+
+        if waiter.priority == RequestPriority.BULK:
+            self.__running_bulk += 1
+
+        if waiter.username is not None:
+            self.__running_by_user[waiter.username] = self.__running_by_user.get(waiter.username, 0) + 1
+
+        wait: float = time.perf_counter() - waiter.enqueued_at
+
+        self.__admitted += 1
+        self.__total_wait += wait
+        self.__max_wait = max(self.__max_wait, wait)
+
+        waiter.is_admitted = True
+        waiter.wake_up()
+
+    def __get_waiting_no(self) -> int:
+        """
+        Number of waiting requests. Should be called under lock
+        :return: int
+        """
+        return sum(len(waiters) for waiters in self.__waiting.values())
@@ -0,0 +1,446 @@
+import hashlib
+import itertools
+import json
+import logging
+import math
+
+import toml
+from comradewolf.utils.enums_and_field_dicts import OlapFieldTypes, OlapCalculations
+from comradewolf.utils.olap_data_types import OlapTablesCollection, SelectCollection
+from comradewolf.utils.utils import create_field_with_calculation
+
+from model.dto import QueryPattern, AggregateRecommendation, TableStatistics
+from service.cube import CubeCollection
+from service.materialized_views import create_aggregate_query, REAGGREGATED_CALCULATIONS
+
+logger = logging.getLogger(__name__)
+
+# Calculations that give the same result over rows grouped by calculated field
+GROUPED_CALCULATIONS: list[str] = [OlapCalculations.MIN.value, OlapCalculations.MAX.value,
+                                   OlapCalculations.COUNT_DISTINCT.value]
+
+# Size of row header of PostgreSQL table
+ROW_HEADER_BYTES: int = 24
+# Size of column value if table statistics have no sizes
+DEFAULT_VALUE_BYTES: int = 8
+
+
+def get_group_by_alias(field_alias: str, base_table_name: str, tables_collection: OlapTablesCollection) -> str | None:
+    """
+    Finds field of base table that aggregate should be grouped by to answer query with :param field_alias:
+    Values of base table are not grouped by: optimizer would calculate them over grouped values
+    :param field_alias: alias of field from frontend
+    :param base_table_name: name of base table of the cube
+    :param tables_collection: tables of the cube
+    :return: alias of dimension field or service key of dimension table. None if there is no such field
+    """
+    base_fields: dict = tables_collection.get_fact_table_fields(base_table_name)
+
+    if (field_alias in base_fields) and (base_fields[field_alias]["field_type"] != OlapFieldTypes.VALUE.value):
+        return field_alias
+
+    dimension_table_and_service_key: list | None = tables_collection.get_dimension_table_with_field(field_alias)
+
+    if (dimension_table_and_service_key is not None) and (dimension_table_and_service_key[1] in base_fields):
+        return dimension_table_and_service_key[1]
+
+    return None
+
+
+def get_query_pattern(payload: dict, base_table_name: str,
+                      tables_collection: OlapTablesCollection) -> tuple[frozenset[str], frozenset[str]] | None:
+    """
+    Finds fields aggregate table should contain to answer query
+    Selected and filtered fields are grouped by. Sum, min and max of values are stored as calculated fields,
+    min, max and count_distinct of dimensions are answered by grouping by dimension
+    :param payload: frontend payload of saved query
+    :param base_table_name: name of base table of the cube
+    :param tables_collection: tables of the cube
+    :return: fields to group by and calculated fields. None if no aggregate could answer query, e.g. for count or avg
+    """
+    base_fields: dict = tables_collection.get_fact_table_fields(base_table_name)
+    group_by: set[str] = set()
+    calculations: set[str] = set()
+
+    for field in payload.get("SELECT", []) + payload.get("WHERE", []):
+        group_by_alias: str | None = get_group_by_alias(field["field_name"], base_table_name, tables_collection)
+
+        if group_by_alias is None:
+            return None
+
+        group_by.add(group_by_alias)
+
+    for field in payload.get("CALCULATION", []):
+        field_alias: str = field["field_name"]
+        calculation: str = field["calculation"]
+
+        if (field_alias in base_fields) and (base_fields[field_alias]["field_type"] == OlapFieldTypes.VALUE.value):
+            if calculation not in REAGGREGATED_CALCULATIONS:
+                return None
+
+            calculations.add(create_field_with_calculation(field_alias, calculation))
+            continue
+
+        group_by_alias = get_group_by_alias(field_alias, base_table_name, tables_collection)
+
+        if (calculation not in GROUPED_CALCULATIONS) or (group_by_alias is None):
+            return None
+
+        group_by.add(group_by_alias)
+
+    return frozenset(group_by), frozenset(calculations)
+
+
+def collect_query_patterns(payloads: list[str], base_table_name: str,
+                           tables_collection: OlapTablesCollection) -> tuple[list[QueryPattern], int]:
+    """
+    Groups saved queries by fields aggregate table should contain
+    :param payloads: JSON strings of frontend payloads
+    :param base_table_name: name of base table of the cube
+    :param tables_collection: tables of the cube
+    :return:
+            [0] patterns, the most frequent first
+            [1] number of queries that no aggregate could answer
+    """
+    patterns: dict[tuple[frozenset[str], frozenset[str]], QueryPattern] = {}
+    skipped_no: int = 0
+
+    for payload_string in payloads:
+        payload: dict = json.loads(payload_string)
+        pattern_key: tuple[frozenset[str], frozenset[str]] | None = get_query_pattern(payload, base_table_name,
+                                                                                     tables_collection)
+
+        # Queries without calculations read dimension tables or base table rows
+        if (pattern_key is None) or (len(payload.get("CALCULATION", [])) == 0):
+            skipped_no += 1
+            continue
+
+        if pattern_key in patterns:
+            patterns[pattern_key].queries_no += 1
+        else:
+            patterns[pattern_key] = QueryPattern(group_by=pattern_key[0], calculations=pattern_key[1], queries_no=1,
+                                                 payload=payload)
+
+    return sorted(patterns.values(), key=lambda pattern: pattern.queries_no, reverse=True), skipped_no
+
+
+def set_current_rows(patterns: list[QueryPattern], cubes: CubeCollection, cube_name: str) -> list[QueryPattern]:
+    """
+    Finds the smallest table of the cube that answers every pattern now. Tables are chosen by query generator,
+    the same way as for requests
+    :param patterns: patterns of saved queries
+    :param cubes: collection with the cube. Table statistics of its optimizer should be refreshed
+    :param cube_name: name of the cube
+    :return: patterns that could be answered by the cube. Fields of the cube could be changed since query was saved
+    """
+    table_statistics = cubes.get_optimizer(cube_name).get_table_statistics()
+    answered_patterns: list[QueryPattern] = []
+
+    for pattern in patterns:
+        try:
+            select_collection: SelectCollection = cubes.get_all_queries(cube_name, pattern.payload, False)
+        except Exception:
+            logger.warning("Could not create queries for payload %s", pattern.payload, exc_info=True)
+            continue
+
+        rows: list[int] = [table_statistics.get_rows_no(table_name) for table_name in select_collection.keys()
+                           if table_statistics.get_rows_no(table_name) is not None]
+
+        if len(rows) == 0:
+            continue
+
+        pattern.rows_no = min(rows)
+        answered_patterns.append(pattern)
+
+    return answered_patterns
+
+
+def create_candidates(patterns: list[QueryPattern], max_patterns: int) -> list[tuple[frozenset[str], frozenset[str]]]:
+    """
+    Creates possible aggregate tables: fields of every pattern and unions of fields of two patterns
+    :param patterns: patterns, the most frequent first
+    :param max_patterns: unions are created for this number of the most frequent patterns
+    :return: fields to group by and calculated fields of every candidate
+    """
+    candidates: list[tuple[frozenset[str], frozenset[str]]] = []
+
+    for pattern in patterns:
+        if (pattern.group_by, pattern.calculations) not in candidates:
+            candidates.append((pattern.group_by, pattern.calculations))
+
+    for first, second in itertools.combinations(patterns[:max_patterns], 2):
+        candidate: tuple[frozenset[str], frozenset[str]] = (first.group_by | second.group_by,
+                                                             first.calculations | second.calculations)
+
+        if candidate not in candidates:
+            candidates.append(candidate)
+
+    return candidates
+
+
+def estimate_rows(group_by: frozenset[str], base_table_name: str, tables_collection: OlapTablesCollection,
+                  base_statistics: TableStatistics) -> int:
+    """
+    Estimates rows of aggregate from distinct values of grouped columns of base table
+    Values are expected to be independent, so N rows fall into D = n_distinct_1 * ... * n_distinct_k groups and
+    D * (1 - exp(-N / D)) groups are not empty
+    :param group_by: aliases of grouped fields
+    :param base_table_name: name of base table of the cube
+    :param tables_collection: tables of the cube
+    :param base_statistics: statistics of base table
+    :return: rows. Rows of base table if column was not analyzed
+    """
+    base_rows_no: int = base_statistics.rows_no or 0
+    groups_no: float = 1.0
+
+    for field_alias in group_by:
+        column_name: str = tables_collection.get_backend_field_name(base_table_name, field_alias)
+        column_statistics = base_statistics.columns.get(column_name, None)
+
+        if (column_statistics is None) or (column_statistics.n_distinct is None):
+            return base_rows_no
+
+        groups_no *= max(column_statistics.n_distinct, 1.0)
+
+    if (len(group_by) == 0) or (base_rows_no == 0):
+        return 1
+
+    return min(math.ceil(groups_no * -math.expm1(-base_rows_no / groups_no)), base_rows_no)
+
+
+def estimate_row_bytes(columns_no: int, base_table_name: str, tables_collection: OlapTablesCollection,
+                       base_statistics: TableStatistics) -> int:
+    """
+    Estimates size of aggregate row. Columns are expected to be as large as average column of base table
+    :param columns_no: number of columns of aggregate
+    :param base_table_name: name of base table of the cube
+    :param tables_collection: tables of the cube
+    :param base_statistics: statistics of base table
+    :return: bytes
+    """
+    value_bytes: float = DEFAULT_VALUE_BYTES
+
+    if (base_statistics.relation_bytes is not None) and base_statistics.rows_no:
+        base_columns_no: int = len(tables_collection.get_fact_table_fields(base_table_name))
+        value_bytes = max(base_statistics.relation_bytes / base_statistics.rows_no - ROW_HEADER_BYTES,
+                          DEFAULT_VALUE_BYTES) / base_columns_no
+
+    return math.ceil(ROW_HEADER_BYTES + value_bytes * columns_no)
+
+
+def is_pattern_answered(pattern: QueryPattern, candidate: tuple[frozenset[str], frozenset[str]]) -> bool:
+    return (pattern.group_by <= candidate[0]) and (pattern.calculations <= candidate[1])
+
+
+def choose_aggregates(patterns: list[QueryPattern], candidates: list[tuple[frozenset[str], frozenset[str]]],
+                      candidate_rows: list[int], candidate_bytes: list[int], max_tables: int,
+                      max_bytes: int | None) -> list[int]:
+    """
+    Greedy choice of aggregates: on every step candidate that saves the most rows read per byte is chosen
+    Rows saved by candidate are counted against the smallest table that answers pattern at this step,
+    so candidate that answers the same queries as chosen ones saves nothing
+    :param patterns: patterns with rows of the smallest table that answers them now
+    :param candidates: fields to group by and calculated fields of every candidate
+    :param candidate_rows: estimated rows of every candidate
+    :param candidate_bytes: estimated size of every candidate
+    :param max_tables: maximum number of chosen candidates
+    :param max_bytes: maximum size of all chosen candidates. None for no limit
+    :return: indexes of chosen candidates
+    """
+    current_rows: list[int] = [pattern.rows_no for pattern in patterns]
+    chosen: list[int] = []
+    chosen_bytes: int = 0
+
+    while len(chosen) < max_tables:
+        best_candidate: int | None = None
+        best_benefit: float = 0.0
+
+        for candidate_no, candidate in enumerate(candidates):
+            if candidate_no in chosen:
+                continue
+
+            if (max_bytes is not None) and (chosen_bytes + candidate_bytes[candidate_no] > max_bytes):
+                continue
+
+            rows_saved: int = sum(pattern.queries_no * max(current_rows[pattern_no] - candidate_rows[candidate_no], 0)
+                                  for pattern_no, pattern in enumerate(patterns)
+                                  if is_pattern_answered(pattern, candidate))
+            benefit: float = rows_saved / max(candidate_bytes[candidate_no], 1)
+
+            if benefit > best_benefit:
+                best_candidate, best_benefit = candidate_no, benefit
+
+        if best_candidate is None:
+            break
+
+        chosen.append(best_candidate)
+        chosen_bytes += candidate_bytes[best_candidate]
+
+        for pattern_no, pattern in enumerate(patterns):
+            if is_pattern_answered(pattern, candidates[best_candidate]):
+                current_rows[pattern_no] = min(current_rows[pattern_no], candidate_rows[best_candidate])
+
+    return chosen
+
+
+def get_aggregate_table_name(candidate: tuple[frozenset[str], frozenset[str]], base_table_name: str) -> str:
+    """
+    Creates name of aggregate from its fields, so the same aggregate has the same name in every run
+    :param candidate: fields to group by and calculated fields
+    :param base_table_name: database.schema.table of base table
+    :return: database.schema.table
+    """
+    fields_hash: str = hashlib.sha256(json.dumps([sorted(candidate[0]), sorted(candidate[1])]).encode()).hexdigest()
+
+    return f"{base_table_name}_agg_{fields_hash[:8]}"
+
+
+def get_aggregate_columns(candidate: tuple[frozenset[str], frozenset[str]], base_table_name: str,
+                          tables_collection: OlapTablesCollection) -> list[tuple[str, str, dict, str | None]]:
+    """
+    Creates columns of aggregate in order of base table fields
+    :param candidate: fields to group by and calculated fields
+    :param base_table_name: name of base table of the cube
+    :param tables_collection: tables of the cube
+    :return: column name, alias, field of base table and calculation (None for grouped columns)
+    """
+    base_fields: dict = tables_collection.get_fact_table_fields(base_table_name)
+    group_by_columns: list[tuple[str, str, dict, str | None]] = []
+    calculation_columns: list[tuple[str, str, dict, str | None]] = []
+
+    for field_alias, field in base_fields.items():
+        if field_alias in candidate[0]:
+            group_by_columns.append((field["field_name"], field_alias, field, None))
+
+        for calculation in REAGGREGATED_CALCULATIONS:
+            if create_field_with_calculation(field_alias, calculation) in candidate[1]:
+                calculation_columns.append((f"{calculation}_{field['field_name']}", field_alias, field, calculation))
+
+    return group_by_columns + calculation_columns
+
+
+def create_aggregate_ddl(table_name: str, base_table_name: str,
+                         columns: list[tuple[str, str, dict, str | None]]) -> str:
+    """
+    Creates PostgreSQL statements that create and analyze aggregate
+    :param table_name: database.schema.table of aggregate
+    :param base_table_name: database.schema.table of base table
+    :param columns: columns from get_aggregate_columns
+    :return: sql
+    """
+    schema_table_name: str = ".".join(table_name.split(".")[-2:])
+
+    return f"create table {schema_table_name} as\n{create_aggregate_query(base_table_name, columns)};\n" \
+           f"analyze {schema_table_name};\n"
+
+
+def create_aggregate_toml(table_name: str, columns: list[tuple[str, str, dict, str | None]]) -> str:
+    """
+    Creates .toml file of aggregate in format of olap_info
+    :param table_name: database.schema.table of aggregate
+    :param columns: columns from get_aggregate_columns
+    :return: content of .toml file
+    """
+    database, schema, table = table_name.split(".")
+    fields: dict[str, dict[str, str]] = {}
+
+    for column_name, field_alias, field, calculation in columns:
+        fields[column_name] = {
+            "field_type": field["field_type"] if calculation is None else OlapFieldTypes.VALUE.value,
+            "alias": field_alias,
+            "calculation_type": calculation or "none",
+            "following_calculation": calculation or "none",
+            "front_name": field["front_name"] or "none",
+            "data_type": field["data_type"],
+        }
+
+    return toml.dumps({"table": table, "schema": schema, "database": database, "base_table": "false",
+                       "fields": fields})
+
+
+def advise_aggregates(cubes: CubeCollection, cube_name: str, payloads: list[str], max_tables: int = 5,
+                      max_bytes: int | None = None, rows_per_second: int = 10_000_000,
+                      max_patterns: int = 30) -> tuple[list[AggregateRecommendation], int]:
+    """
+    Finds aggregate tables that would answer the most saved queries with the least storage
+    Benefit is measured in rows of tables that queries read: a query reads the smallest table that answers it
+
+    :param cubes: collection with the cube. Table statistics of its optimizer should be refreshed
+    :param cube_name: name of the cube
+    :param payloads: JSON strings of frontend payloads of saved queries
+    :param max_tables: maximum number of recommended tables
+    :param max_bytes: maximum size of all recommended tables. None for no limit
+    :param rows_per_second: rows warehouse reads per second, it converts rows saved to time
+    :param max_patterns: candidates are created from pairs of this number of the most frequent patterns
+
+    :raises NoCubeInCollection: if :param cube_name: was not found in collection
+
+    :return:
+            [0] recommendations, the most time saved first
+            [1] number of queries that no aggregate could answer
+    """
+    olap_structure = cubes.get_olap_structure(cube_name)
+    tables_collection: OlapTablesCollection = olap_structure.get_tables_collection()
+    base_table_name: str = olap_structure.main_data_table.get_name()
+    base_statistics: TableStatistics | None = cubes.get_optimizer(cube_name).get_table_statistics()\
+        .get_table(base_table_name)
+
+    if (base_statistics is None) or (base_statistics.rows_no is None):
+        logger.warning("Cube %s: base table %s has no statistics", cube_name, base_table_name)
+        return [], len(payloads)
+
+    patterns, skipped_no = collect_query_patterns(payloads, base_table_name, tables_collection)
+    answered_patterns: list[QueryPattern] = set_current_rows(patterns, cubes, cube_name)
+    skipped_no += sum(pattern.queries_no for pattern in patterns) - \
+        sum(pattern.queries_no for pattern in answered_patterns)
+    patterns = answered_patterns
+
+    candidates: list[tuple[frozenset[str], frozenset[str]]] = create_candidates(patterns, max_patterns)
+    candidate_rows: list[int] = [estimate_rows(candidate[0], base_table_name, tables_collection, base_statistics)
+                                 for candidate in candidates]
+    candidate_bytes: list[int] = [candidate_rows[candidate_no] *
+                                  estimate_row_bytes(len(candidate[0]) + len(candidate[1]), base_table_name,
+                                                     tables_collection, base_statistics)
+                                  for candidate_no, candidate in enumerate(candidates)]
+
+    chosen: list[int] = choose_aggregates(patterns, candidates, candidate_rows, candidate_bytes, max_tables,
+                                          max_bytes)
+
+    recommendations: list[AggregateRecommendation] = []
+
+    for candidate_no in chosen:
+        candidate: tuple[frozenset[str], frozenset[str]] = candidates[candidate_no]
+        queries_no: int = 0
+        rows_saved: int = 0
+
+        # Query is counted for the smallest chosen table that answers it
+        for pattern in patterns:
+            answering: list[int] = [other_no for other_no in chosen
+                                    if is_pattern_answered(pattern, candidates[other_no])]
+
+            if (candidate_no not in answering) or \
+                    (min(answering, key=lambda other_no: candidate_rows[other_no]) != candidate_no) or \
+                    (candidate_rows[candidate_no] >= pattern.rows_no):
+                continue
+
+            queries_no += pattern.queries_no
+            rows_saved += pattern.queries_no * (pattern.rows_no - candidate_rows[candidate_no])
+
+        table_name: str = get_aggregate_table_name(candidate, base_table_name)
+        columns: list[tuple[str, str, dict, str | None]] = get_aggregate_columns(candidate, base_table_name,
+                                                                                  tables_collection)
+
+        recommendations.append(AggregateRecommendation(
+            table_name=table_name,
+            group_by=sorted(candidate[0]),
+            calculations=sorted(candidate[1]),
+            rows_no=candidate_rows[candidate_no],
+            size_bytes=candidate_bytes[candidate_no],
+            queries_no=queries_no,
+            rows_saved=rows_saved,
+            seconds_saved=rows_saved / rows_per_second,
+            ddl=create_aggregate_ddl(table_name, base_table_name, columns),
+            toml=create_aggregate_toml(table_name, columns),
+        ))
+
+    return sorted(recommendations, key=lambda recommendation: recommendation.rows_saved, reverse=True), skipped_no
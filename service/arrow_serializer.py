@@ -0,0 +1,251 @@
+import decimal
+import io
+from typing import Iterator, Any, AsyncIterator
+
+from comradewolf.utils.enums_and_field_dicts import FrontFieldTypes, OlapCalculations
+from comradewolf.utils.olap_data_types import OlapFrontend
+from comradewolf.utils.utils import get_calculation_from_field_name
+from sqlalchemy import Sequence
+
+from core.utils.exceptions import NoArrowSupport
+from model.dto import ExportFormat
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+ARROW_STREAM_MEDIA_TYPE = "application/vnd.apache.arrow.stream"
+PARQUET_MEDIA_TYPE = "application/parquet"
+
+COLUMNAR_MEDIA_TYPES: dict[ExportFormat, str] = {
+    ExportFormat.ARROW: ARROW_STREAM_MEDIA_TYPE,
+    ExportFormat.PARQUET: PARQUET_MEDIA_TYPE,
+}
+
+
+class _ChunkSink(io.RawIOBase):
+    """
+    Write-only file that gives away written bytes by chunks
+    Keeps position of complete output, parquet footer relies on it
+    """
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.__chunks: list[bytes] = []
+        self.__position: int = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        chunk: bytes = bytes(data)
+        self.__chunks.append(chunk)
+        self.__position += len(chunk)
+        return len(chunk)
+
+    def tell(self) -> int:
+        return self.__position
+
+    def pop_chunks(self) -> bytes:
+        """
+        Returns everything written since last call
+        :return: bytes
+        """
+        chunk: bytes = b"".join(self.__chunks)
+        self.__chunks = []
+        return chunk
+
+
+def check_arrow_support() -> None:
+    """
+    Checks that pyarrow is installed
+    :raises NoArrowSupport: if pyarrow is not installed
+    :return: None
+    """
+    if pyarrow is None:
+        raise NoArrowSupport()
+
+
+def get_columnar_format(accept: str | None) -> ExportFormat | None:
+    """
+    Chooses columnar format from Accept header
+    :param accept: Accept header
+    :return: ExportFormat.ARROW, ExportFormat.PARQUET or None if client wants something else
+    """
+    if accept is None:
+        return None
+
+    for export_format, media_type in COLUMNAR_MEDIA_TYPES.items():
+        if media_type in accept:
+            return export_format
+
+    return None
+
+
+def get_arrow_type(column: str, olap_frontend: OlapFrontend):
+    """
+    Returns arrow type of column based on data_type of field in cube
+    :param column: column alias. Could contain calculation, f.e. field_alias__sum
+    :param olap_frontend: fields of the cube
+    :return: pyarrow.DataType or None if field has no known data_type
+    """
+    field_name, calculation = get_calculation_from_field_name(column)
+
+    if calculation in [OlapCalculations.COUNT.value, OlapCalculations.COUNT_DISTINCT.value]:
+        return pyarrow.int64()
+
+    if field_name not in olap_frontend:
+        return None
+
+    data_type: str = olap_frontend.get_data_type(field_name)
+
+    arrow_types: dict = {
+        FrontFieldTypes.NUMBER.value: pyarrow.float64(),
+        FrontFieldTypes.TEXT.value: pyarrow.string(),
+        FrontFieldTypes.DATE.value: pyarrow.date32(),
+        FrontFieldTypes.DATETIME.value: pyarrow.timestamp("us"),
+        FrontFieldTypes.BOOLEAN.value: pyarrow.bool_(),
+    }
+
+    return arrow_types.get(data_type, None)
+
+
+def create_record_batch(columns: list[str], rows: Sequence, olap_frontend: OlapFrontend):
+    """
+    Creates arrow record batch out of rows from cursor
+    :param columns: column names
+    :param rows: rows from cursor
+    :param olap_frontend: fields of the cube
+    :return: pyarrow.RecordBatch
+    """
+    check_arrow_support()
+
+    # Rows to columns
+    values_by_column: list[tuple] = list(zip(*rows)) if len(rows) > 0 else [() for _ in columns]
+
+    arrays: list = []
+
+    for column, values in zip(columns, values_by_column):
+        arrow_type = get_arrow_type(column, olap_frontend)
+
+        if arrow_type == pyarrow.float64():
+            values = [_to_float(value) for value in values]
+        elif arrow_type is None:
+            # Type inferred from one chunk could differ from the next one (all NULLs give null type),
+            # while every chunk of stream should have the same schema
+            arrow_type = pyarrow.string()
+            values = [None if value is None else str(value) for value in values]
+
+        arrays.append(pyarrow.array(values, type=arrow_type))
+
+    return pyarrow.RecordBatch.from_arrays(arrays, names=columns)
+
+
+def _to_float(value: Any) -> float | None:
+    """
+    Numeric from postgres comes as decimal.Decimal, arrow does not convert it to float64 by itself
+    :param value: number
+    :return: float
+    """
+    if isinstance(value, decimal.Decimal):
+        return float(value)
+
+    return value
+
+
+def rows_to_bytes(columns: list[str], rows: Sequence, olap_frontend: OlapFrontend,
+                  export_format: ExportFormat) -> bytes:
+    """
+    Serializes one page of rows to arrow stream or parquet
+    :param columns: column names
+    :param rows: rows from cursor
+    :param olap_frontend: fields of the cube
+    :param export_format: ExportFormat.ARROW or ExportFormat.PARQUET
+    :return: serialized page
+    """
+    return b"".join(chunks_to_bytes(iter([(columns, rows)]), olap_frontend, export_format))
+
+
+class ColumnarStreamWriter:
+    """
+    Writes chunks of rows to arrow stream or parquet and gives away bytes as soon as chunk is written
+    Every chunk becomes one record batch (arrow) or row group (parquet)
+    """
+
+    def __init__(self, olap_frontend: OlapFrontend, export_format: ExportFormat) -> None:
+        """
+        :param olap_frontend: fields of the cube
+        :param export_format: ExportFormat.ARROW or ExportFormat.PARQUET
+        """
+        check_arrow_support()
+
+        self.__olap_frontend: OlapFrontend = olap_frontend
+        self.__export_format: ExportFormat = export_format
+        self.__sink: _ChunkSink = _ChunkSink()
+        self.__writer = None
+
+    def write_chunk(self, columns: list[str], rows: Sequence) -> bytes:
+        """
+        Writes one chunk of rows
+        :param columns: column names
+        :param rows: rows from cursor
+        :return: bytes written since previous call
+        """
+        record_batch = create_record_batch(columns, rows, self.__olap_frontend)
+
+        if self.__writer is None:
+            if self.__export_format == ExportFormat.PARQUET:
+                self.__writer = pyarrow.parquet.ParquetWriter(self.__sink, record_batch.schema)
+            else:
+                self.__writer = pyarrow.ipc.new_stream(self.__sink, record_batch.schema)
+
+        self.__writer.write_batch(record_batch)
+
+        return self.__sink.pop_chunks()
+
+    def close(self) -> bytes:
+        """
+        Finishes stream (parquet footer, arrow end of stream)
+        :return: bytes written since previous call
+        """
+        if self.__writer is not None:
+            self.__writer.close()
+
+        return self.__sink.pop_chunks()
+
+
+def chunks_to_bytes(chunks: Iterator[tuple[list[str], Sequence]], olap_frontend: OlapFrontend,
+                    export_format: ExportFormat) -> Iterator[bytes]:
+    """
+    Serializes chunks of rows to arrow stream or parquet
+    :param chunks: iterator of column names and rows
+    :param olap_frontend: fields of the cube
+    :param export_format: ExportFormat.ARROW or ExportFormat.PARQUET
+    :return: iterator of bytes
+    """
+    writer: ColumnarStreamWriter = ColumnarStreamWriter(olap_frontend, export_format)
+
+    for columns, rows in chunks:
+        yield writer.write_chunk(columns, rows)
+
+    yield writer.close()
+
+
+async def async_chunks_to_bytes(chunks: AsyncIterator[tuple[list[str], Sequence]], olap_frontend: OlapFrontend,
+                                export_format: ExportFormat) -> AsyncIterator[bytes]:
+    """
+    Serializes chunks of rows from async optimizer to arrow stream or parquet
+    :param chunks: async iterator of column names and rows
+    :param olap_frontend: fields of the cube
+    :param export_format: ExportFormat.ARROW or ExportFormat.PARQUET
+    :return: async iterator of bytes
+    """
+    writer: ColumnarStreamWriter = ColumnarStreamWriter(olap_frontend, export_format)
+
+    async for columns, rows in chunks:
+        yield writer.write_chunk(columns, rows)
+
+    yield writer.close()
@@ -1,19 +1,47 @@
+import asyncio
+import contextlib
+import csv
+import datetime
+import decimal
+import io
+import json
+import logging
+import threading
+import time
+import weakref
 from collections import UserDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator, Any, AsyncIterator, Callable
 
 from comradewolf.universe.olap_prompt_converter_service import OlapPromptConverterService
 from comradewolf.universe.olap_service import OlapService
 from comradewolf.universe.olap_structure_generator import OlapStructureGenerator
 from comradewolf.utils.olap_data_types import OlapFrontend, SelectCollection, OlapFrontendToBackend, OlapFilterFrontend, \
     OlapTablesCollection, SelectFilter, TableForFilter
-from sqlalchemy import Sequence, RowMapping, CursorResult
+from sqlalchemy import Sequence, RowMapping, CursorResult, Row, Engine, QueuePool
+from sqlalchemy.ext.asyncio import AsyncEngine
 from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
 
 from core.config import settings
 from core.utils.exceptions import NoCubeInCollection
 from model.base_model import SavedQuery
 from model.dto import FrontendFieldsJson, QueryMetaData, FrontendDistinctJson, FrontFieldsDTO, FrontFieldProperty, \
-    FilterDataFromColumnDTO, FrontDistinctDTO
-from service.optimizer_interface import OptimizerAbstract
+    FilterDataFromColumnDTO, FrontDistinctDTO, ExportFormat, PageCacheStatsDTO, MemoStatsDTO, PoolStatsDTO, \
+    AdmissionStatsDTO, QueryInterruptionStatsDTO, MaterializedViewStatsDTO
+from service.arrow_serializer import check_arrow_support, rows_to_bytes, chunks_to_bytes, COLUMNAR_MEDIA_TYPES, \
+    async_chunks_to_bytes
+from service.cube_entry import CubeEntry, CubeEntryLease, current_cube_entry
+from service.db import save_page_last_key
+from service.optimizer_interface import OptimizerAbstract, OptimizerAsyncAbstract
+from service.lru_memo import LruMemo
+from service.metrics import stage_timer, add_returned_data, count_streamed_rows, count_streamed_bytes, \
+    count_streamed_rows_async, count_streamed_bytes_async
+from service.page_cache import PageCache
+from service.tracing import traced, trace_span, set_span_attributes
+from service.payload_fingerprint import get_dict_fingerprint
+
+logger = logging.getLogger(__name__)
 
 
 class CubeCollection(UserDict):
@@ -21,28 +49,357 @@ class CubeCollection(UserDict):
     Structure contains all data that will be used for cubes
     """
 
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.__page_cache: PageCache = PageCache(settings.PAGE_CACHE_MAX_BYTES)
+        self.__queries_memo: LruMemo = LruMemo(settings.QUERIES_MEMO_SIZE)
+        # Cubes that are built on first access. Factory creates components and calls add_cube
+        self.__cube_factories: dict[str, Callable[["CubeCollection"], None]] = {}
+        self.__cube_locks: dict[str, threading.Lock] = {}
+        self.__cube_init_timings: dict[str, float] = {}
+        self.__disposal_tasks: set[asyncio.Task] = set()
+
+    def add_lazy_cube(self, cube_name: str, cube_factory: Callable[["CubeCollection"], None]) -> None:
+        """
+        Registers cube that will be built on first access
+        Factory is called once under lock of the cube, other requests to the same cube wait for it
+        If factory fails, error is raised and cube is built again on next access
+        :param cube_name: name of the cube
+        :param cube_factory: function that creates components of the cube and calls add_cube
+        :return: None
+        """
+        self.__cube_factories[cube_name] = cube_factory
+        self.__cube_locks.setdefault(cube_name, threading.Lock())
+
+    def build_all_cubes(self, workers: int) -> None:
+        """
+        Builds all registered lazy cubes in parallel
+        Cube that could not be built is logged and stays lazy, so it does not stop other cubes
+        :param workers: number of threads
+        :return: None
+        """
+        started_at: float = time.perf_counter()
+        cube_names: list[str] = [cube_name for cube_name in self.__cube_factories if cube_name not in self.data]
+
+        with ThreadPoolExecutor(max_workers=max(workers, 1), thread_name_prefix="cube-init") as executor:
+            for cube_name, error in zip(cube_names, executor.map(self.__try_build_cube, cube_names)):
+                if error is not None:
+                    logger.error("Cube %s was not initialized, it will be built on first access: %s",
+                                 cube_name, error)
+
+        logger.info("%s of %s cubes were initialized in %.0f ms", len(self.data), len(self.__cube_factories),
+                    (time.perf_counter() - started_at) * 1000)
+
+    def get_cube_init_timings(self) -> dict[str, float]:
+        """
+        Returns time of the last initialization of every built cube
+        :return: {cube_name: milliseconds}
+        """
+        return dict(self.__cube_init_timings)
+
+    def __try_build_cube(self, cube_name: str) -> Exception | None:
+        """
+        Builds cube and returns error instead of raising it
+        :param cube_name: name of the cube
+        :return: error or None if cube was built
+        """
+        try:
+            self.__build_cube(cube_name)
+        except Exception as error:
+            return error
+
+        return None
+
+    def __build_cube(self, cube_name: str) -> None:
+        """
+        Builds lazy cube if it was not built yet
+        :param cube_name: name of the cube
+
+        :raises NoCubeInCollection: if cube was not registered
+
+        :return: None
+        """
+        if cube_name not in self.__cube_factories:
+            raise NoCubeInCollection(cube_name)
+
+        with self.__cube_locks[cube_name]:
+            # Other thread could build cube while we were waiting for lock
+            if cube_name in self.data:
+                return
+
+            started_at: float = time.perf_counter()
+
+            self.__cube_factories[cube_name](self)
+
+            self.__cube_init_timings[cube_name] = (time.perf_counter() - started_at) * 1000
+
+        logger.info("Cube %s was initialized in %.0f ms", cube_name, self.__cube_init_timings[cube_name])
+
     def add_cube(self,
                  cube_name:str,
-                 optimizer: OptimizerAbstract,
+                 optimizer: OptimizerAbstract | OptimizerAsyncAbstract,
                  prompt_converter_service: OlapPromptConverterService,
                  olap_structure: OlapStructureGenerator,
-                 olap_service: OlapService) -> None:
+                 olap_service: OlapService,
+                 page_cache_ttl: int = settings.PAGE_CACHE_TTL,
+                 version: str | None = None) -> None:
         """
         Adds one cube to collection
+        If cube already exists, it is replaced at once. Requests that already took old entry finish with it
         :param cube_name: Name of the cube
         :param optimizer: Optimizer made for correct database type
         :param prompt_converter_service: Converter that correctly converts frontend data to backend-specific data
         :param olap_structure: Complete structure that created from .toml files, that describe cube
         :param olap_service: olap service that creates correct selects from
+        :param page_cache_ttl: time to live of cached pages in seconds. 0 disables page cache for the cube
+        :param version: version of cube definition. Cube is reloaded when it changes
         :return:
         """
-        self.data[cube_name] = {
-            "optimizer": optimizer,
-            "prompt_converter_service": prompt_converter_service,
-            "olap_structure": olap_structure,
-            "olap_frontend_fields": olap_structure.get_front_fields(),
-            "olap_service": olap_service,
-        }
+        self.data[cube_name] = CubeEntry(cube_name, optimizer, prompt_converter_service, olap_structure,
+                                         olap_service, page_cache_ttl, version)
+
+        # Queries generated from previous structure of the cube are not valid anymore
+        self.__queries_memo.invalidate_cube(cube_name)
+        # Cube could point to another database now
+        self.__page_cache.invalidate_cube(cube_name)
+
+    def get_cube_version(self, cube_name: str) -> str | None:
+        """
+        Returns version of cube definition that was used to build the cube
+        :param cube_name: name of the cube
+        :return: version of the cube pinned by request, otherwise of current entry. None if cube was not built yet
+        """
+        cube: CubeEntry | None = self.__get_pinned_entry(cube_name) or self.data.get(cube_name, None)
+
+        if cube is None:
+            return None
+
+        return cube.get_version()
+
+    async def reload_cube_async(self, cube_name: str, cube_factory: Callable[["CubeCollection"], None]) -> bool:
+        """
+        Builds new version of the cube in thread pool and swaps it in
+        Cube that was not built yet only gets new factory, it stays lazy and is built with new definition on first use
+        Engine of previous version is disposed in background, when the last request has released it
+
+        :param cube_name: name of the cube
+        :param cube_factory: function that creates components of the cube and calls add_cube
+        :return: True if built cube was rebuilt, False if cube is lazy
+        """
+        old_cube: CubeEntry | None = self.data.get(cube_name, None)
+
+        self.add_lazy_cube(cube_name, cube_factory)
+
+        if old_cube is None:
+            return False
+
+        await run_in_threadpool(self.__rebuild_cube, cube_name)
+        await self.__prewarm_pool_async(cube_name, settings.OLAP_POOL_PREWARM)
+
+        self.__retire_entry(old_cube)
+
+        return True
+
+    def remove_cube(self, cube_name: str) -> None:
+        """
+        Removes cube from collection. Should be called from event loop
+        Engine is disposed in background, when the last request has released the cube
+        :param cube_name: name of the cube
+        :return: None
+        """
+        old_cube: CubeEntry | None = self.data.pop(cube_name, None)
+
+        self.__cube_factories.pop(cube_name, None)
+        self.__cube_init_timings.pop(cube_name, None)
+        self.__queries_memo.invalidate_cube(cube_name)
+        self.__page_cache.invalidate_cube(cube_name)
+
+        if old_cube is not None:
+            self.__retire_entry(old_cube)
+
+    def is_cube_built(self, cube_name: str) -> bool:
+        """
+        Checks if cube was built. Lazy cube is not built until first access
+        :param cube_name: name of the cube
+        :return: True if cube was built
+        """
+        return cube_name in self.data
+
+    def get_cube_names(self) -> list[str]:
+        """
+        Returns names of all registered cubes, including not built lazy cubes
+        :return: names of cubes
+        """
+        return list(self.__cube_factories.keys())
+
+    def __rebuild_cube(self, cube_name: str) -> None:
+        """
+        Builds cube again with its current factory, even if it was built already
+        :param cube_name: name of the cube
+        :return: None
+        """
+        with self.__cube_locks[cube_name]:
+            started_at: float = time.perf_counter()
+
+            self.__cube_factories[cube_name](self)
+
+            self.__cube_init_timings[cube_name] = (time.perf_counter() - started_at) * 1000
+
+        logger.info("Cube %s was reloaded in %.0f ms", cube_name, self.__cube_init_timings[cube_name])
+
+    def __retire_entry(self, entry: CubeEntry) -> None:
+        """
+        Retires entry of previous version of the cube. Should be called from event loop
+        Optimizer is disposed in background when the last request has released the entry.
+        Entry could be released in thread pool, so disposal is passed back to event loop
+        :param entry: entry that was replaced or removed
+        :return: None
+        """
+        loop: asyncio.AbstractEventLoop = asyncio.get_running_loop()
+
+        entry.retire(lambda: self.__schedule_dispose(loop, entry))
+
+    def __schedule_dispose(self, loop: asyncio.AbstractEventLoop, entry: CubeEntry) -> None:
+        """
+        Starts disposal of optimizer of drained entry in event loop. Could be called from any thread
+        :param loop: event loop of application
+        :param entry: retired entry that is not used by requests anymore
+        :return: None
+        """
+        try:
+            loop.call_soon_threadsafe(self.__dispose_in_background, entry.get_optimizer())
+        except RuntimeError:
+            # Event loop is closed on shutdown, connections are closed together with process
+            logger.warning("Engine of previous version of cube %s was not disposed", entry.get_cube_name())
+
+    def __dispose_in_background(self, optimizer: OptimizerAbstract | OptimizerAsyncAbstract) -> None:
+        """
+        Starts disposal of optimizer engine. Should be called from event loop
+        :param optimizer: optimizer of previous version of the cube
+        :return: None
+        """
+        task: asyncio.Task = asyncio.create_task(self.__dispose_optimizer(optimizer))
+
+        # Event loop keeps only weak references to tasks
+        self.__disposal_tasks.add(task)
+        task.add_done_callback(self.__disposal_tasks.discard)
+
+    @staticmethod
+    async def __dispose_optimizer(optimizer: OptimizerAbstract | OptimizerAsyncAbstract) -> None:
+        """
+        Disposes optimizer that is not used by requests anymore
+        :param optimizer: optimizer of previous version of the cube
+        :return: None
+        """
+        try:
+            if isinstance(optimizer, OptimizerAsyncAbstract):
+                await optimizer.dispose()
+            else:
+                await run_in_threadpool(optimizer.dispose)
+        except Exception:
+            logger.exception("Could not dispose engine of reloaded cube")
+
+    @contextlib.contextmanager
+    def use_cube(self, cube_name: str) -> Iterator[CubeEntry]:
+        """
+        Pins current version of the cube for the request. All methods called with the same cube name inside
+        use pinned entry, so reload in the middle of request does not mix components of two versions.
+        Optimizer of pinned entry is not disposed until request has finished
+        Lazy cube is built here
+
+        :raises NoCubeInCollection: if  :param cube_name: was not found in collection
+
+        :param cube_name: name of the cube
+        :return: pinned entry
+        """
+        entry: CubeEntry = self.__acquire_entry(cube_name)
+        token = current_cube_entry.set(entry)
+
+        try:
+            yield entry
+        finally:
+            current_cube_entry.reset(token)
+            entry.release()
+
+    @contextlib.asynccontextmanager
+    async def use_cube_async(self, cube_name: str) -> AsyncIterator[CubeEntry]:
+        """
+        Same as use_cube, but lazy cube is built in thread pool, so event loop is not blocked
+        Entry is pinned in context of the caller, it is copied to thread pool and to tasks
+
+        :raises NoCubeInCollection: if  :param cube_name: was not found in collection
+
+        :param cube_name: name of the cube
+        :return: pinned entry
+        """
+        if cube_name not in self.data:
+            await run_in_threadpool(self.__is_cube_in_collection, cube_name)
+
+        entry: CubeEntry = self.__acquire_entry(cube_name)
+        token = current_cube_entry.set(entry)
+
+        try:
+            yield entry
+        finally:
+            current_cube_entry.reset(token)
+            entry.release()
+
+    def __acquire_entry(self, cube_name: str) -> CubeEntry:
+        """
+        Acquires entry pinned by current request or current entry of the cube. Lazy cube is built here
+        If cube is replaced between reading and acquiring its entry, the new entry is taken
+
+        :raises NoCubeInCollection: if  :param cube_name: was not found in collection
+
+        :param cube_name: name of the cube
+        :return: acquired entry, it should be released by caller
+        """
+        pinned_entry: CubeEntry | None = self.__get_pinned_entry(cube_name)
+
+        # Request holds pinned entry, so it is not drained
+        if (pinned_entry is not None) and pinned_entry.acquire():
+            return pinned_entry
+
+        while True:
+            self.__is_cube_in_collection(cube_name)
+
+            entry: CubeEntry | None = self.data.get(cube_name, None)
+
+            if (entry is not None) and entry.acquire():
+                return entry
+
+    @staticmethod
+    def __get_pinned_entry(cube_name: str) -> CubeEntry | None:
+        """
+        Returns entry of the cube pinned by current request
+        :param cube_name: name of the cube
+        :return: entry or None if request has not pinned this cube
+        """
+        entry: CubeEntry | None = current_cube_entry.get()
+
+        if (entry is None) or (entry.get_cube_name() != cube_name):
+            return None
+
+        return entry
+
+    def __get_entry(self, cube_name: str) -> CubeEntry:
+        """
+        Returns entry pinned by current request or current entry of the cube
+        If cube is lazy and was not built yet, it is built here
+
+        :raises NoCubeInCollection: if  :param cube_name: was not found in collection
+
+        :param cube_name: name of the cube
+        :return: entry of the cube
+        """
+        entry: CubeEntry | None = self.__get_pinned_entry(cube_name)
+
+        if entry is not None:
+            return entry
+
+        self.__is_cube_in_collection(cube_name)
+
+        return self.data[cube_name]
 
     def get_front_fields(self, cube_name: str) -> OlapFrontend:
         """
@@ -54,9 +411,7 @@ class CubeCollection(UserDict):
         :return: Frontend fields with types and names
         """
 
-        self.__is_cube_in_collection(cube_name)
-
-        olap_frontend: OlapFrontend = self.data[cube_name]["olap_frontend_fields"]
+        olap_frontend: OlapFrontend = self.__get_entry(cube_name).get_front_fields()
 
         return olap_frontend
 
@@ -70,8 +425,6 @@ class CubeCollection(UserDict):
         :return: Frontend fields with types and names
         """
 
-        self.__is_cube_in_collection(cube_name)
-
         olap_frontend: OlapFrontend = self.get_front_fields(cube_name)
 
         front_fields_dto: FrontFieldsDTO = FrontFieldsDTO(fields=[])
@@ -95,22 +448,22 @@ class CubeCollection(UserDict):
 
         :return: OlapStructureGenerator for cube
         """
-        self.__is_cube_in_collection(cube_name)
-
-        return self.data[cube_name]["olap_structure"]
+        return self.__get_entry(cube_name).get_olap_structure()
 
     def __is_cube_in_collection(self, cube_name) -> None:
         """
         Checks if cube in collection
         If cube is in collection, it does nothing
 
+        If cube is lazy and was not built yet, it is built here
+
         :raises NoCubeInCollection: if cube is not in collection
 
         :param cube_name: name of the cube
         :return: None
         """
         if cube_name not in self.data:
-            raise NoCubeInCollection(cube_name)
+            self.__build_cube(cube_name)
 
     def get_prompt_converter_service(self, cube_name: str) -> OlapPromptConverterService:
         """
@@ -121,11 +474,9 @@ class CubeCollection(UserDict):
         :return: OlapPromptConverterService for the cube
         """
 
-        self.__is_cube_in_collection(cube_name)
-
-        return self.data[cube_name]["prompt_converter_service"]
+        return self.__get_entry(cube_name).get_prompt_converter_service()
 
-    def get_optimizer(self, cube_name: str) -> OptimizerAbstract:
+    def get_optimizer(self, cube_name: str) -> OptimizerAbstract | OptimizerAsyncAbstract:
         """
         Get OptimizerAbstract service for cube
 
@@ -134,9 +485,66 @@ class CubeCollection(UserDict):
         :return: OptimizerAbstract for the cube
         """
 
-        self.__is_cube_in_collection(cube_name)
+        return self.__get_entry(cube_name).get_optimizer()
 
-        return self.data[cube_name]["optimizer"]
+    async def get_optimizer_async(self, cube_name: str) -> OptimizerAbstract | OptimizerAsyncAbstract:
+        """
+        Same as get_optimizer, but lazy cube is built in thread pool, so event loop is not blocked
+
+        :raises NoCubeInCollection: if  :param cube_name: was not found in collection
+        :param cube_name: name of the cube
+        :return: OptimizerAbstract for the cube
+        """
+        if (self.__get_pinned_entry(cube_name) is None) and (cube_name not in self.data):
+            await run_in_threadpool(self.__is_cube_in_collection, cube_name)
+
+        return self.get_optimizer(cube_name)
+
+    def get_table_names(self, cube_name: str) -> list[str]:
+        """
+        Returns names of all data and dimension tables of the cube
+        :param cube_name: name of the cube
+
+        :raises NoCubeInCollection: if  :param cube_name: was not found in collection
+
+        :return: table names as in .toml files
+        """
+        tables_collection: OlapTablesCollection = self.get_olap_structure(cube_name).get_tables_collection()
+
+        return tables_collection.get_data_table_names() + tables_collection.get_dimension_table_names()
+
+    async def refresh_table_statistics_async(self, cube_name: str) -> None:
+        """
+        Refreshes table statistics catalog of cube optimizer
+        Sync optimizers are run in thread pool
+        :param cube_name: name of the cube
+        :return: None
+        """
+        async with self.use_cube_async(cube_name) as cube:
+            optimizer: OptimizerAbstract | OptimizerAsyncAbstract = cube.get_optimizer()
+            table_names: list[str] = self.get_table_names(cube_name)
+
+            if isinstance(optimizer, OptimizerAsyncAbstract):
+                await optimizer.refresh_table_statistics(table_names)
+            else:
+                await run_in_threadpool(optimizer.refresh_table_statistics, table_names)
+
+    async def refresh_table_statistics_forever(self, interval: int) -> None:
+        """
+        Refreshes table statistics of all cubes every :param interval: seconds, starting right away
+        Errors are logged, so one unavailable database does not stop refresh of other cubes
+        Should be run as background task and cancelled on shutdown
+        :param interval: seconds between refreshes
+        :return: None
+        """
+        while True:
+            for cube_name in list(self.data.keys()):
+                try:
+                    await self.refresh_table_statistics_async(cube_name)
+                except Exception:
+                    logger.exception("Could not refresh table statistics of cube %s", cube_name)
+
+            await asyncio.sleep(interval)
 
     def get_olap_service(self, cube_name: str) -> OlapService:
         """
@@ -148,9 +556,7 @@ class CubeCollection(UserDict):
         :return: OlapService for cube
         """
 
-        self.__is_cube_in_collection(cube_name)
-
-        return self.data[cube_name]["olap_service"]
+        return self.__get_entry(cube_name).get_olap_service()
 
     def get_query_meta(self, cube_name: str, front_data: FrontendFieldsJson, add_order_by: bool) -> QueryMetaData:
         """
@@ -166,15 +572,76 @@ class CubeCollection(UserDict):
         frontend_dict: dict = front_data.model_dump(mode='json')
 
         optimizer: OptimizerAbstract = self.get_optimizer(cube_name)
+        cube_version: str | None = self.get_cube_version(cube_name)
 
         select_collection: SelectCollection = self.get_all_queries(cube_name, frontend_dict, add_order_by)
         query_meta_data: QueryMetaData = optimizer.get_query_meta_data(cube_name, select_collection)
+        query_meta_data.cube_version = cube_version
+
+        if add_order_by and settings.USE_KEYSET_PAGINATION:
+            query_meta_data.order_by_keys = self.get_keyset_order_by_keys(front_data, select_collection,
+                                                                          query_meta_data.sql_query)
+
+        return query_meta_data
+
+    async def get_query_meta_async(self, cube_name: str, front_data: FrontendFieldsJson,
+                                   add_order_by: bool) -> QueryMetaData:
+        """
+        Same as get_query_meta, but awaits async optimizers
+        Sync optimizers are run in thread pool
+        :param add_order_by: Add order by to query or not
+        :param cube_name: name of the cube
+        :param front_data: dictionary with fields and conditions that user demands
+        :return: QueryMetaData with query number, number of pages, number of rows per page and total number of rows
+        """
+
+        optimizer: OptimizerAbstract | OptimizerAsyncAbstract = await self.get_optimizer_async(cube_name)
+
+        if not isinstance(optimizer, OptimizerAsyncAbstract):
+            return await run_in_threadpool(self.get_query_meta, cube_name, front_data, add_order_by)
+
+        frontend_dict: dict = front_data.model_dump(mode='json')
+        cube_version: str | None = self.get_cube_version(cube_name)
+
+        select_collection: SelectCollection = self.get_all_queries(cube_name, frontend_dict, add_order_by)
+        query_meta_data: QueryMetaData = await optimizer.get_query_meta_data(cube_name, select_collection)
+        query_meta_data.cube_version = cube_version
+
+        if add_order_by and settings.USE_KEYSET_PAGINATION:
+            query_meta_data.order_by_keys = self.get_keyset_order_by_keys(front_data, select_collection,
+                                                                          query_meta_data.sql_query)
 
         return query_meta_data
 
+    @staticmethod
+    def get_keyset_order_by_keys(front_data: FrontendFieldsJson, select_collection: SelectCollection,
+                                 sql_query: str) -> list[str]:
+        """
+        Returns column aliases that can be used for keyset pagination
+        Select fields are unique only if query has GROUP BY. For other queries offset-limit is used
+
+        :param front_data: fields and conditions that user demands
+        :param select_collection: all possible queries
+        :param sql_query: query chosen by optimizer
+        :return: list of column aliases. Empty if keyset pagination is not possible
+        """
+        for table in select_collection:
+            if select_collection.get_sql(table) != sql_query:
+                continue
+
+            if select_collection.get_has_group_by(table):
+                return [field.field_name for field in front_data.SELECT]
+
+            break
+
+        return []
+
+    @traced("get_all_queries")
     def get_all_queries(self, cube_name: str, front_data: dict, add_order_by: bool) -> SelectCollection:
         """
         Gets all possible queries from the cube with front_data user needs
+        Generated SelectCollection is memoized by cube, payload and :param add_order_by:.
+        Returned SelectCollection is shared and should not be changed
 
         :param cube_name: name of the cube
         :param front_data: dictionary with fields and conditions that user demands
@@ -185,15 +652,40 @@ class CubeCollection(UserDict):
 
         :return: SelectCollection
         """
-        prompt_service: OlapPromptConverterService = self.get_prompt_converter_service(cube_name)
-        olap_frontend_fields: OlapFrontend = self.get_front_fields(cube_name)
-        olap_service: OlapService = self.get_olap_service(cube_name)
-        olap_structure: OlapStructureGenerator = self.get_olap_structure(cube_name)
+        cube: CubeEntry = self.__get_entry(cube_name)
+        # Request that finishes on previous version of reloaded cube does not put its queries under the new version
+        memo_key: tuple[str, str | None, str, bool] = (cube_name, cube.get_version(), get_dict_fingerprint(front_data),
+                                                       add_order_by)
+        select_collection: SelectCollection | None = self.__queries_memo.get(memo_key)
+
+        if select_collection is not None:
+            set_span_attributes({"query.memo_hit": True, "query.candidates": len(select_collection)})
+            return select_collection
+
+        prompt_service: OlapPromptConverterService = cube.get_prompt_converter_service()
+        olap_frontend_fields: OlapFrontend = cube.get_front_fields()
+        olap_service: OlapService = cube.get_olap_service()
+        olap_structure: OlapStructureGenerator = cube.get_olap_structure()
+
+        with stage_timer("generate_sql"):
+            frontend_to_backend_type: OlapFrontendToBackend = prompt_service\
+                .create_frontend_to_backend(front_data, olap_frontend_fields)
+
+            select_collection = olap_service.select_data(frontend_to_backend_type,
+                                                         olap_structure.get_tables_collection(), add_order_by)
+
+        self.__queries_memo.put(memo_key, select_collection)
 
-        frontend_to_backend_type: OlapFrontendToBackend = prompt_service\
-            .create_frontend_to_backend(front_data, olap_frontend_fields)
+        set_span_attributes({"query.memo_hit": False, "query.candidates": len(select_collection)})
 
-        return olap_service.select_data(frontend_to_backend_type, olap_structure.get_tables_collection(), add_order_by)
+        return select_collection
+
+    def get_queries_memo_stats(self) -> MemoStatsDTO:
+        """
+        Returns hit rate of generated queries memo
+        :return: MemoStatsDTO
+        """
+        return self.__queries_memo.get_stats()
 
     def select_data_by_pages(self, cube_name: str, query_id: int, page: int, db: Session) -> Sequence[RowMapping]:
         """
@@ -201,28 +693,523 @@ class CubeCollection(UserDict):
 
         :param cube_name: name of the cube
         :param query_id: query id of SavedQuery
-        :param page: page no to be downloaded query works as offset-limit kind
+        :param page: page no to be downloaded
+        :param db: db Session
+        :return:
+        """
+
+        columns: list[str]
+        rows: Sequence[Row]
+
+        columns, rows = self.select_page_rows(cube_name, query_id, page, db)
+
+        # Convert to smth similar to dict
+        dict_from_db: Sequence[RowMapping] = [row._mapping for row in rows]
+
+        return dict_from_db
+
+    async def select_data_by_pages_async(self, cube_name: str, query_id: int, page: int,
+                                         db: Session) -> Sequence[RowMapping]:
+        """
+        Same as select_data_by_pages, but awaits async optimizers
+
+        :param cube_name: name of the cube
+        :param query_id: query id of SavedQuery
+        :param page: page no to be downloaded
         :param db: db Session
         :return:
         """
 
-        # Get query to retrieve data from DB
-        sql: str
-        items_per_page: int
+        columns: list[str]
+        rows: Sequence[Row]
+
+        columns, rows = await self.select_page_rows_async(cube_name, query_id, page, db)
+
+        return [row._mapping for row in rows]
+
+    def select_data_by_pages_columnar(self, cube_name: str, query_id: int, page: int, export_format: ExportFormat,
+                                      db: Session) -> bytes:
+        """
+        Gets data from OLAP database by previously saved query in QueryMetaData
+        Serializes page to arrow stream or parquet with column types from cube fields
+
+        :param cube_name: name of the cube
+        :param query_id: query id of SavedQuery
+        :param page: page no to be downloaded
+        :param export_format: ExportFormat.ARROW or ExportFormat.PARQUET
+        :param db: db Session
+
+        :raises NoArrowSupport: if pyarrow is not installed
+
+        :return: serialized page
+        """
+        check_arrow_support()
+
+        columns: list[str]
+        rows: Sequence[Row]
+
+        columns, rows = self.select_page_rows(cube_name, query_id, page, db)
+
+        return self.__serialize_columnar_page(cube_name, columns, rows, export_format)
+
+    async def select_data_by_pages_columnar_async(self, cube_name: str, query_id: int, page: int,
+                                                  export_format: ExportFormat, db: Session) -> bytes:
+        """
+        Same as select_data_by_pages_columnar, but awaits async optimizers
+
+        :param cube_name: name of the cube
+        :param query_id: query id of SavedQuery
+        :param page: page no to be downloaded
+        :param export_format: ExportFormat.ARROW or ExportFormat.PARQUET
+        :param db: db Session
+
+        :raises NoArrowSupport: if pyarrow is not installed
+
+        :return: serialized page
+        """
+        check_arrow_support()
+
+        columns: list[str]
+        rows: Sequence[Row]
+
+        columns, rows = await self.select_page_rows_async(cube_name, query_id, page, db)
+
+        return self.__serialize_columnar_page(cube_name, columns, rows, export_format)
+
+    def __serialize_columnar_page(self, cube_name: str, columns: list[str], rows: Sequence[Row],
+                                  export_format: ExportFormat) -> bytes:
+        """
+        Serializes page to arrow stream or parquet and counts returned data
+        :param cube_name: name of the cube
+        :param columns: column names
+        :param rows: rows of the page
+        :param export_format: ExportFormat.ARROW or ExportFormat.PARQUET
+        :return: serialized page
+        """
+        with trace_span("serialization", {"serialization.format": export_format.value}) as span, \
+                stage_timer("serialize"):
+            content: bytes = rows_to_bytes(columns, rows, self.get_front_fields(cube_name), export_format)
+            span.set_attributes({"query.rows": len(rows), "serialization.bytes": len(content)})
+
+        add_returned_data(len(rows), len(content))
+
+        return content
+
+    def select_page_rows(self, cube_name: str, query_id: int, page: int, db: Session) \
+            -> tuple[list[str], Sequence[Row]]:
+        """
+        Gets rows of one page from OLAP database by previously saved query in QueryMetaData
+        If query has keyset keys and last key of previous page is known, page is selected by seek, not by offset
+
+        :param cube_name: name of the cube
+        :param query_id: query id of SavedQuery
+        :param page: page no to be downloaded
+        :param db: db Session
+        :return: column names and rows
+        """
 
         saved_query: SavedQuery = db.query(SavedQuery).filter(SavedQuery.id == query_id).first()
 
-        sql = saved_query.query
-        items_per_page = saved_query.items_per_page
+        order_by_keys, page_keys, last_key = self.get_page_keys(saved_query, page)
 
-        # Retrieve data
-        data_from_db = self.get_optimizer(cube_name=cube_name).select_page_from_olap(
-            sql=sql, page_no=page, items_per_page=items_per_page)
+        cache_key: tuple = self.__page_cache.create_key(cube_name, self.get_cube_version(cube_name), saved_query.query,
+                                                        page, saved_query.items_per_page)
+        cached_page: tuple[list[str], Sequence[Row]] | None = self.__get_cached_page(cube_name, cache_key)
 
-        # Convert to smth similar to dict
-        dict_from_db: Sequence[RowMapping] = data_from_db.mappings().all()
+        columns: list[str]
+        rows: Sequence[Row]
 
-        return dict_from_db
+        if cached_page is not None:
+            columns, rows = cached_page
+        else:
+            # Retrieve data
+            with trace_span("select_page_from_olap", {"page.no": page, "page.keyset": last_key is not None}) as span:
+                with stage_timer("execute"):
+                    data_from_db = self.get_optimizer(cube_name=cube_name).select_page_from_olap(
+                        sql=saved_query.query, page_no=page, items_per_page=saved_query.items_per_page,
+                        order_by_keys=order_by_keys, last_key=last_key)
+
+                with stage_timer("materialize"):
+                    columns = list(data_from_db.keys())
+                    rows = data_from_db.all()
+
+                span.set_attribute("query.rows", len(rows))
+
+            self.__page_cache.put(cache_key, columns, rows, self.get_page_cache_ttl(cube_name))
+
+        self.__remember_page_last_key(db, saved_query, page, columns, rows, order_by_keys, page_keys)
+
+        return columns, rows
+
+    async def select_page_rows_async(self, cube_name: str, query_id: int, page: int, db: Session) \
+            -> tuple[list[str], Sequence[Row]]:
+        """
+        Same as select_page_rows, but awaits async optimizers
+        Sync optimizers are run in thread pool. Metadata database is always queried in thread pool
+
+        :param cube_name: name of the cube
+        :param query_id: query id of SavedQuery
+        :param page: page no to be downloaded
+        :param db: db Session
+        :return: column names and rows
+        """
+        optimizer: OptimizerAbstract | OptimizerAsyncAbstract = await self.get_optimizer_async(cube_name)
+
+        if not isinstance(optimizer, OptimizerAsyncAbstract):
+            return await run_in_threadpool(self.select_page_rows, cube_name, query_id, page, db)
+
+        saved_query: SavedQuery = await run_in_threadpool(
+            lambda: db.query(SavedQuery).filter(SavedQuery.id == query_id).first())
+
+        order_by_keys, page_keys, last_key = self.get_page_keys(saved_query, page)
+
+        cache_key: tuple = self.__page_cache.create_key(cube_name, self.get_cube_version(cube_name), saved_query.query,
+                                                        page, saved_query.items_per_page)
+        cached_page: tuple[list[str], Sequence[Row]] | None = self.__get_cached_page(cube_name, cache_key)
+
+        columns: list[str]
+        rows: Sequence[Row]
+
+        if cached_page is not None:
+            columns, rows = cached_page
+        else:
+            with trace_span("select_page_from_olap", {"page.no": page, "page.keyset": last_key is not None}) as span:
+                with stage_timer("execute"):
+                    data_from_db: CursorResult = await optimizer.select_page_from_olap(
+                        sql=saved_query.query, page_no=page, items_per_page=saved_query.items_per_page,
+                        order_by_keys=order_by_keys, last_key=last_key)
+
+                with stage_timer("materialize"):
+                    columns = list(data_from_db.keys())
+                    rows = data_from_db.all()
+
+                span.set_attribute("query.rows", len(rows))
+
+            self.__page_cache.put(cache_key, columns, rows, self.get_page_cache_ttl(cube_name))
+
+        await run_in_threadpool(self.__remember_page_last_key, db, saved_query, page, columns, rows, order_by_keys,
+                                page_keys)
+
+        return columns, rows
+
+    def get_page_cache_ttl(self, cube_name: str) -> int:
+        """
+        Returns time to live of cached pages of the cube
+        :param cube_name: name of the cube
+
+        :raises NoCubeInCollection: if  :param cube_name: was not found in collection
+
+        :return: seconds
+        """
+        return self.__get_entry(cube_name).get_page_cache_ttl()
+
+    async def prewarm_pools_async(self, connections: int) -> None:
+        """
+        Opens connections of all built cubes in advance. Cubes are warmed up concurrently
+        Errors are logged, unavailable database does not stop startup
+        :param connections: connections per cube, not more than pool size
+        :return: None
+        """
+        await asyncio.gather(*[self.__prewarm_pool_async(cube_name, connections) for cube_name in list(self.data)])
+
+    async def __prewarm_pool_async(self, cube_name: str, connections: int) -> None:
+        """
+        Opens connections of one cube in advance
+        :param cube_name: name of the cube
+        :param connections: number of connections, not more than pool size
+        :return: None
+        """
+        optimizer: OptimizerAbstract | OptimizerAsyncAbstract = self.get_optimizer(cube_name)
+
+        try:
+            if isinstance(optimizer, OptimizerAsyncAbstract):
+                await optimizer.prewarm_pool(connections)
+            else:
+                await run_in_threadpool(optimizer.prewarm_pool, connections)
+        except Exception as error:
+            logger.warning("Could not prewarm connection pool of cube %s: %s", cube_name, error)
+
+    def get_pool_stats(self) -> list[PoolStatsDTO]:
+        """
+        Returns state of connection pools of built cubes
+        :return: list of PoolStatsDTO
+        """
+        pool_stats: list[PoolStatsDTO] = []
+
+        for cube_name, cube in list(self.data.items()):
+            optimizer: OptimizerAbstract | OptimizerAsyncAbstract = cube.get_optimizer()
+            engine: Engine | AsyncEngine = optimizer.get_engine()
+            pool = engine.sync_engine.pool if isinstance(engine, AsyncEngine) else engine.pool
+
+            if not isinstance(pool, QueuePool):
+                continue
+
+            pool_stats.append(PoolStatsDTO(cube_name=cube_name, max_connections=optimizer.get_max_connections(),
+                                           pool_size=pool.size(), checked_out=pool.checkedout(),
+                                           idle=pool.checkedin(), overflow=max(pool.overflow(), 0)))
+
+        return pool_stats
+
+    def get_admission_stats(self) -> list[AdmissionStatsDTO]:
+        """
+        Returns running and waiting queries and wait times of built cubes
+        :return: list of AdmissionStatsDTO
+        """
+        return [cube.get_optimizer().get_admission_controller().get_stats(cube_name)
+                for cube_name, cube in list(self.data.items())]
+
+    def get_query_interruption_stats(self) -> list[QueryInterruptionStatsDTO]:
+        """
+        Returns number of cancelled and timed out queries of built cubes
+        :return: list of QueryInterruptionStatsDTO
+        """
+        return [cube.get_optimizer().get_query_interruptions().get_stats(cube_name)
+                for cube_name, cube in list(self.data.items())]
+
+    def get_materialized_view_stats(self) -> list[MaterializedViewStatsDTO]:
+        """
+        Returns refresh state of materialized views of built cubes
+        :return: list of MaterializedViewStatsDTO
+        """
+        return [view_stats for cube_name, cube in list(self.data.items())
+                for view_stats in cube.get_optimizer().get_materialized_views().get_stats(cube_name)]
+
+    def get_page_cache_stats(self) -> PageCacheStatsDTO:
+        """
+        Returns hit, miss and eviction counters of page cache
+        :return: PageCacheStatsDTO
+        """
+        return self.__page_cache.get_stats()
+
+    def __get_cached_page(self, cube_name: str, cache_key: tuple) -> tuple[list[str], Sequence[Row]] | None:
+        """
+        Returns page from cache if cache is enabled for the cube
+        :param cube_name: name of the cube
+        :param cache_key: key of the page
+        :return: column names and rows or None
+        """
+        if self.get_page_cache_ttl(cube_name) <= 0:
+            return None
+
+        return self.__page_cache.get(cache_key)
+
+    @staticmethod
+    def get_page_keys(saved_query: SavedQuery, page: int) -> tuple[list[str] | None, dict, list | None]:
+        """
+        Reads keyset pagination data of saved query
+        :param saved_query: SavedQuery
+        :param page: page no to be downloaded
+        :return: order by keys (None if query is paged with offset-limit), last keys of all pages,
+            last key of previous page (None if unknown)
+        """
+        order_by_keys: list[str] | None = None
+        page_keys: dict = {}
+        last_key: list | None = None
+
+        if saved_query.order_by_keys is not None:
+            order_by_keys = json.loads(saved_query.order_by_keys)
+            page_keys = json.loads(saved_query.page_keys or "{}")
+            last_key = page_keys.get(str(page - 1), None)
+
+        return order_by_keys, page_keys, last_key
+
+    @staticmethod
+    def __remember_page_last_key(db: Session, saved_query: SavedQuery, page: int, columns: list[str],
+                                 rows: Sequence[Row], order_by_keys: list[str] | None, page_keys: dict) -> None:
+        """
+        Remembers where page ends, so the next page could be selected with seek
+        :param db: db Session
+        :param saved_query: SavedQuery
+        :param page: page no that was downloaded
+        :param columns: column names
+        :param rows: rows of the page
+        :param order_by_keys: keyset keys of the query
+        :param page_keys: already known last keys of pages
+        :return: None
+        """
+        page_last_key: list | None = CubeCollection.get_page_last_key(columns, rows, order_by_keys)
+
+        # NULL keys are saved too, seek condition knows that NULLs come last
+        if (page_last_key is not None) and (str(page) not in page_keys):
+            save_page_last_key(db, saved_query, page, page_last_key)
+
+    @staticmethod
+    def get_page_last_key(columns: list[str], rows: Sequence[Row], order_by_keys: list[str] | None) -> list | None:
+        """
+        Returns values of keyset keys of the last row of page
+        :param columns: column names
+        :param rows: rows of the page
+        :param order_by_keys: keyset keys of the query
+        :return: values of keys or None if query is paged with offset-limit or page is empty
+        """
+        if (order_by_keys is None) or (len(rows) == 0):
+            return None
+
+        return [rows[-1][columns.index(key)] for key in order_by_keys]
+
+    def stream_data_by_query(self, cube_name: str, query_id: int, export_format: ExportFormat, db: Session) \
+            -> Iterator[bytes] | AsyncIterator[bytes]:
+        """
+        Streams complete result of previously saved query in QueryMetaData
+        Rows are read from server-side cursor, so memory does not depend on number of rows
+        For async optimizers async iterator is returned
+
+        :param cube_name: name of the cube
+        :param query_id: query id of SavedQuery
+        :param export_format: ndjson, csv, arrow or parquet
+        :param db: db Session
+
+        :raises NoArrowSupport: if arrow or parquet is requested and pyarrow is not installed
+
+        :return: iterator of utf-8 encoded text (ndjson, csv) or binary (arrow, parquet) chunks
+        """
+
+        # Saved query is read before streaming starts. Session could be closed while response is sent
+        saved_query: SavedQuery = db.query(SavedQuery).filter(SavedQuery.id == query_id).first()
+
+        # Response is sent after request handler has returned, so stream holds entry of the cube itself
+        cube: CubeEntry = self.__acquire_entry(cube_name)
+        lease: CubeEntryLease = CubeEntryLease(cube)
+
+        try:
+            content: Iterator[bytes] | AsyncIterator[bytes] = self.__stream_entry(cube, saved_query, export_format)
+        except BaseException:
+            lease.release()
+            raise
+
+        stream: Iterator[bytes] | AsyncIterator[bytes]
+
+        if isinstance(content, AsyncIterator):
+            stream = self.__release_after_async(content, lease)
+        else:
+            stream = self.__release_after(content, lease)
+
+        # Stream that is not started is not closed by server
+        weakref.finalize(stream, lease.release)
+
+        return stream
+
+    @staticmethod
+    def __stream_entry(cube: CubeEntry, saved_query: SavedQuery, export_format: ExportFormat) \
+            -> Iterator[bytes] | AsyncIterator[bytes]:
+        """
+        Creates stream of saved query with components of one version of the cube
+        :param cube: entry of the cube
+        :param saved_query: SavedQuery
+        :param export_format: ndjson, csv, arrow or parquet
+
+        :raises NoArrowSupport: if arrow or parquet is requested and pyarrow is not installed
+
+        :return: iterator of encoded chunks, async for async optimizers
+        """
+        optimizer: OptimizerAbstract | OptimizerAsyncAbstract = cube.get_optimizer()
+
+        chunks = optimizer.stream_query(saved_query.query, settings.STREAM_ROWS_PER_CHUNK)
+
+        if export_format in COLUMNAR_MEDIA_TYPES:
+            check_arrow_support()
+
+            if isinstance(optimizer, OptimizerAsyncAbstract):
+                return count_streamed_bytes_async(async_chunks_to_bytes(count_streamed_rows_async(chunks),
+                                                                        cube.get_front_fields(), export_format))
+
+            return count_streamed_bytes(chunks_to_bytes(count_streamed_rows(chunks), cube.get_front_fields(),
+                                                        export_format))
+
+        if isinstance(optimizer, OptimizerAsyncAbstract):
+            return count_streamed_bytes_async(CubeCollection.__stream_rows_async(count_streamed_rows_async(chunks),
+                                                                                 export_format))
+
+        return count_streamed_bytes(CubeCollection.__stream_rows(count_streamed_rows(chunks), export_format))
+
+    @staticmethod
+    def __release_after(content: Iterator[bytes], lease: CubeEntryLease) -> Iterator[bytes]:
+        try:
+            yield from content
+        finally:
+            lease.release()
+
+    @staticmethod
+    async def __release_after_async(content: AsyncIterator[bytes], lease: CubeEntryLease) -> AsyncIterator[bytes]:
+        try:
+            async for chunk in content:
+                yield chunk
+        finally:
+            lease.release()
+
+    @staticmethod
+    def __stream_rows(chunks: Iterator[tuple[list[str], Sequence[Row]]],
+                      export_format: ExportFormat) -> Iterator[bytes]:
+        """
+        Converts chunks of rows from optimizer to text
+        :param chunks: iterator of column names and rows from optimizer
+        :param export_format: ndjson or csv
+        :return: iterator of utf-8 encoded text chunks
+        """
+        is_first_chunk: bool = True
+
+        for columns, rows in chunks:
+            yield CubeCollection.__format_chunk(columns, rows, export_format, is_first_chunk)
+            is_first_chunk = False
+
+    @staticmethod
+    async def __stream_rows_async(chunks: AsyncIterator[tuple[list[str], Sequence[Row]]],
+                                  export_format: ExportFormat) -> AsyncIterator[bytes]:
+        """
+        Converts chunks of rows from async optimizer to text
+        :param chunks: async iterator of column names and rows from optimizer
+        :param export_format: ndjson or csv
+        :return: async iterator of utf-8 encoded text chunks
+        """
+        is_first_chunk: bool = True
+
+        async for columns, rows in chunks:
+            yield CubeCollection.__format_chunk(columns, rows, export_format, is_first_chunk)
+            is_first_chunk = False
+
+    @staticmethod
+    def __format_chunk(columns: list[str], rows: Sequence[Row], export_format: ExportFormat,
+                       is_first_chunk: bool) -> bytes:
+        """
+        Converts one chunk of rows to ndjson or csv
+        Text is encoded here, so size of returned data is known
+        :param columns: column names
+        :param rows: rows
+        :param export_format: ndjson or csv
+        :param is_first_chunk: csv header is written before first chunk
+        :return: utf-8 encoded text
+        """
+        with stage_timer("serialize"):
+            if export_format == ExportFormat.CSV:
+                buffer: io.StringIO = io.StringIO()
+                writer = csv.writer(buffer)
+
+                if is_first_chunk:
+                    writer.writerow(columns)
+
+                writer.writerows(rows)
+
+                return buffer.getvalue().encode("utf-8")
+
+            return "".join([json.dumps(dict(zip(columns, row)), default=CubeCollection.__json_default,
+                                       ensure_ascii=False) + "\n" for row in rows]).encode("utf-8")
+
+    @staticmethod
+    def __json_default(value: Any) -> Any:
+        """
+        Converts values json does not know. Numbers stay numbers, same as in FastAPI responses
+        :param value: value from database
+        :return: json-serializable value
+        """
+        if isinstance(value, decimal.Decimal):
+            if value == value.to_integral_value():
+                return int(value)
+            return float(value)
+
+        if isinstance(value, (datetime.date, datetime.datetime)):
+            return value.isoformat()
+
+        return str(value)
 
     def select_dimension(self, cube_name: str, dimension_field: FrontendDistinctJson) -> Sequence[RowMapping]:
         """
@@ -241,9 +1228,38 @@ class CubeCollection(UserDict):
 
         optimizer: OptimizerAbstract = self.get_optimizer(cube_name)
 
-        dimension_from_db: CursorResult = optimizer.select_dimension(select_filter)
+        with stage_timer("execute"):
+            dimension_from_db: CursorResult = optimizer.select_dimension(select_filter)
+
+        with stage_timer("materialize"):
+            return dimension_from_db.mappings().all()
+
+    async def select_dimension_async(self, cube_name: str,
+                                     dimension_field: FrontendDistinctJson) -> Sequence[RowMapping]:
+        """
+        Same as select_dimension, but awaits async optimizers
+        :param cube_name:
+        :param dimension_field:
+        :return:
+        """
+        optimizer: OptimizerAbstract | OptimizerAsyncAbstract = await self.get_optimizer_async(cube_name)
+
+        if not isinstance(optimizer, OptimizerAsyncAbstract):
+            return await run_in_threadpool(self.select_dimension, cube_name, dimension_field)
+
+        front_data_dict: dict = dimension_field.model_dump(mode='json')
+        front_to_back = OlapFilterFrontend(front_data_dict)
+
+        olap_service: OlapService = self.get_olap_service(cube_name)
+        tables_collection: OlapTablesCollection = self.get_olap_structure(cube_name).get_tables_collection()
+
+        select_filter: SelectFilter = olap_service.select_filter_for_frontend(front_to_back, tables_collection)
+
+        with stage_timer("execute"):
+            dimension_from_db: CursorResult = await optimizer.select_dimension(select_filter)
 
-        return dimension_from_db.mappings().all()
+        with stage_timer("materialize"):
+            return dimension_from_db.mappings().all()
 
     def get_distinct_data_from_column(self, cube_name: str, field_name: FrontDistinctDTO) -> FilterDataFromColumnDTO:
         """
@@ -256,13 +1272,36 @@ class CubeCollection(UserDict):
         # Get all possible select distinct queries
         select_collection: SelectFilter = self.get_distinct_data(cube_name, field_name)
 
-        dimension_res_from_db: CursorResult = optimizer.select_dimension(select_collection)
+        with stage_timer("execute"):
+            dimension_res_from_db: CursorResult = optimizer.select_dimension(select_collection)
 
-        filter_data: FilterDataFromColumnDTO = FilterDataFromColumnDTO(
-            distinct_data=[item[0] for item in dimension_res_from_db])
+        with stage_timer("materialize"):
+            filter_data: FilterDataFromColumnDTO = FilterDataFromColumnDTO(
+                distinct_data=[item[0] for item in dimension_res_from_db])
 
         return filter_data
 
+    async def get_distinct_data_from_column_async(self, cube_name: str,
+                                                  field_name: FrontDistinctDTO) -> FilterDataFromColumnDTO:
+        """
+        Same as get_distinct_data_from_column, but awaits async optimizers
+        :param cube_name: name of the cube
+        :param field_name: column name
+        :return:
+        """
+        optimizer: OptimizerAbstract | OptimizerAsyncAbstract = await self.get_optimizer_async(cube_name)
+
+        if not isinstance(optimizer, OptimizerAsyncAbstract):
+            return await run_in_threadpool(self.get_distinct_data_from_column, cube_name, field_name)
+
+        select_collection: SelectFilter = self.get_distinct_data(cube_name, field_name)
+
+        with stage_timer("execute"):
+            dimension_res_from_db: CursorResult = await optimizer.select_dimension(select_collection)
+
+        with stage_timer("materialize"):
+            return FilterDataFromColumnDTO(distinct_data=[item[0] for item in dimension_res_from_db])
+
 
 
     def get_distinct_data(self, cube_name: str, field_dto: FrontDistinctDTO) -> SelectFilter:
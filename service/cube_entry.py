@@ -0,0 +1,144 @@
+import threading
+from contextvars import ContextVar
+from typing import Callable
+
+from comradewolf.universe.olap_prompt_converter_service import OlapPromptConverterService
+from comradewolf.universe.olap_service import OlapService
+from comradewolf.universe.olap_structure_generator import OlapStructureGenerator
+from comradewolf.utils.olap_data_types import OlapFrontend
+
+from service.optimizer_interface import OptimizerAbstract, OptimizerAsyncAbstract
+
+
+class CubeEntry:
+    """
+    Components of one version of the cube. Entry is not changed after it is created:
+    reload puts new entry to collection, requests that took previous entry finish with it
+
+    Entry counts requests that use it. When entry is replaced, it is retired
+    and its optimizer is disposed after the last request has released it
+    """
+
+    def __init__(self,
+                 cube_name: str,
+                 optimizer: OptimizerAbstract | OptimizerAsyncAbstract,
+                 prompt_converter_service: OlapPromptConverterService,
+                 olap_structure: OlapStructureGenerator,
+                 olap_service: OlapService,
+                 page_cache_ttl: int,
+                 version: str | None) -> None:
+        self.__cube_name: str = cube_name
+        self.__optimizer: OptimizerAbstract | OptimizerAsyncAbstract = optimizer
+        self.__prompt_converter_service: OlapPromptConverterService = prompt_converter_service
+        self.__olap_structure: OlapStructureGenerator = olap_structure
+        self.__olap_frontend_fields: OlapFrontend = olap_structure.get_front_fields()
+        self.__olap_service: OlapService = olap_service
+        self.__page_cache_ttl: int = page_cache_ttl
+        self.__version: str | None = version
+
+        self.__lock: threading.Lock = threading.Lock()
+        self.__in_flight: int = 0
+        self.__is_retired: bool = False
+        self.__on_drained: Callable[[], None] | None = None
+
+    def get_cube_name(self) -> str:
+        return self.__cube_name
+
+    def get_optimizer(self) -> OptimizerAbstract | OptimizerAsyncAbstract:
+        return self.__optimizer
+
+    def get_prompt_converter_service(self) -> OlapPromptConverterService:
+        return self.__prompt_converter_service
+
+    def get_olap_structure(self) -> OlapStructureGenerator:
+        return self.__olap_structure
+
+    def get_front_fields(self) -> OlapFrontend:
+        return self.__olap_frontend_fields
+
+    def get_olap_service(self) -> OlapService:
+        return self.__olap_service
+
+    def get_page_cache_ttl(self) -> int:
+        return self.__page_cache_ttl
+
+    def get_version(self) -> str | None:
+        return self.__version
+
+    def get_in_flight(self) -> int:
+        """
+        Returns number of requests that use the entry
+        :return: number of requests
+        """
+        return self.__in_flight
+
+    def acquire(self) -> bool:
+        """
+        Marks entry as used by one more request
+        Retired entry can still be acquired while other requests use it
+        :return: False if entry is retired and was released by all requests, its optimizer is being disposed
+        """
+        with self.__lock:
+            if self.__is_retired and (self.__in_flight == 0):
+                return False
+
+            self.__in_flight += 1
+
+            return True
+
+    def release(self) -> None:
+        """
+        Marks that request does not use entry anymore. Could be called from any thread
+        If entry is retired and this was the last request, on_drained callback of retire is called
+        :return: None
+        """
+        with self.__lock:
+            self.__in_flight -= 1
+
+            on_drained: Callable[[], None] | None = self.__on_drained if self.__in_flight == 0 else None
+
+            if on_drained is not None:
+                self.__on_drained = None
+
+        if on_drained is not None:
+            on_drained()
+
+    def retire(self, on_drained: Callable[[], None]) -> None:
+        """
+        Marks entry as replaced or removed from collection
+        :param on_drained: called once when no request uses the entry, at once if it is not used right now
+        :return: None
+        """
+        with self.__lock:
+            self.__is_retired = True
+
+            if self.__in_flight > 0:
+                self.__on_drained = on_drained
+                return
+
+        on_drained()
+
+
+class CubeEntryLease:
+    """
+    One acquisition of entry that is released only once
+    Used by streams: stream releases entry when it ends, or when it is garbage collected without being started
+    """
+
+    def __init__(self, entry: CubeEntry) -> None:
+        self.__entry: CubeEntry = entry
+        self.__lock: threading.Lock = threading.Lock()
+        self.__is_released: bool = False
+
+    def release(self) -> None:
+        with self.__lock:
+            if self.__is_released:
+                return
+
+            self.__is_released = True
+
+        self.__entry.release()
+
+
+# Entry pinned by request. Set by router, copied to thread pool and to tasks of run_cancellable
+current_cube_entry: ContextVar[CubeEntry | None] = ContextVar("current_cube_entry", default=None)
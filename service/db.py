@@ -1,23 +1,81 @@
+import datetime
 import json
 from typing import Type
 
+from sqlalchemy import func
 from sqlalchemy.orm import Session
 
 from core.utils.exceptions import UserAlreadyExists, UserWithMailAlreadyExists, NoConfirmationCode, UserNotFound, \
     NoForgotPasswordCode, NoCubesForUser
-from model.base_model import SavedQuery, AppUser, ConfirmationCode, ForgotPasswordCode, OlapTable, user_olap_table
-from model.dto import QueryMetaData
+from model.base_model import SavedQuery, AppUser, ConfirmationCode, ForgotPasswordCode, OlapTable, user_olap_table, \
+    AclVersion, MailOutbox, MaterializedViewRefresh
+from model.dto import QueryMetaData, MaterializedView
+from service.tracing import traced
 
 
-def save_query_meta_data(db: Session, query_info: QueryMetaData, frontend: dict) -> SavedQuery:
+@traced("save_query_meta_data")
+def save_query_meta_data(db: Session, query_info: QueryMetaData, frontend: dict,
+                         payload_hash: str | None = None) -> SavedQuery:
+    order_by_keys: str | None = None
+
+    if len(query_info.order_by_keys) > 0:
+        order_by_keys = json.dumps(query_info.order_by_keys)
+
     saved_query = SavedQuery(frontend = json.dumps(frontend), query = query_info.sql_query, pages=query_info.pages,
-                             items_per_page=query_info.items_per_page)
+                             items_per_page=query_info.items_per_page, order_by_keys=order_by_keys,
+                             cube_name=query_info.cube_name, payload_hash=payload_hash,
+                             is_rows_no_exact=query_info.is_rows_no_exact, cube_version=query_info.cube_version)
     db.add(saved_query)
     db.commit()
     db.refresh(saved_query)
 
     return saved_query
 
+def get_fresh_saved_query(db: Session, cube_name: str, cube_version: str | None, payload_hash: str,
+                          items_per_page: int, max_age: int) -> SavedQuery | None:
+    """
+    Finds the latest query saved for the same payload
+    :param db: Session
+    :param cube_name: name of the cube
+    :param cube_version: current version of cube definition. Queries saved for other versions are not reused
+    :param payload_hash: hash of normalized frontend payload
+    :param items_per_page: current rows per page. Queries saved with other page size are not reused
+    :param max_age: seconds since query was saved
+    :return: SavedQuery or None if there is no fresh one
+    """
+    if (max_age <= 0) or (cube_version is None):
+        return None
+
+    fresh_after: datetime.datetime = datetime.datetime.now() - datetime.timedelta(seconds=max_age)
+
+    return db.query(SavedQuery).filter(SavedQuery.cube_name == cube_name,
+                                       SavedQuery.cube_version == cube_version,
+                                       SavedQuery.payload_hash == payload_hash,
+                                       SavedQuery.items_per_page == items_per_page,
+                                       SavedQuery.created_at >= fresh_after) \
+        .order_by(SavedQuery.created_at.desc()).first()
+
+def save_page_last_key(db: Session, saved_query: SavedQuery, page: int, last_key: list) -> None:
+    """
+    Saves last key of the page. Next page will be selected with keyset pagination using this key
+    :param db: Session
+    :param saved_query: SavedQuery that was paged
+    :param page: page number
+    :param last_key: values of order by keys of the last row in page
+    :return: None
+    """
+    # Pages of the same query could be downloaded in parallel. Row is locked, so keys saved by others are not lost
+    db.refresh(saved_query, attribute_names=["page_keys"], with_for_update=True)
+
+    page_keys: dict = json.loads(saved_query.page_keys or "{}")
+
+    page_keys[str(page)] = last_key
+
+    saved_query.page_keys = json.dumps(page_keys, default=str)
+
+    db.flush()
+    db.commit()
+
 def create_user(db: Session, app_user: AppUser) -> AppUser:
     """
     Saves user to DB and returns updated data
@@ -186,6 +244,176 @@ def deactivate_forgotten_password_code(forgot_password_code: ForgotPasswordCode,
     db.flush()
     db.commit()
 
+def get_acl_version(db: Session) -> int | None:
+    """
+    Returns version of access rights. It is incremented by triggers when grants, cube names or usernames change
+    :param db: Session
+    :return: version or None if there is no version row
+    """
+    acl_version: AclVersion | None = db.query(AclVersion).filter(AclVersion.id == 1).first()
+
+    if acl_version is None:
+        return None
+
+    return acl_version.version
+
+def get_cube_names_by_username(db: Session) -> dict[str, set[str]]:
+    """
+    Loads all grants at once
+    :param db: Session
+    :return: names of cubes that user can access by username
+    """
+    grants = db.query(AppUser.username, OlapTable.name) \
+        .join(user_olap_table, user_olap_table.c.user_id == AppUser.id) \
+        .join(OlapTable, user_olap_table.c.olap_id == OlapTable.id).all()
+
+    cube_names_by_username: dict[str, set[str]] = {}
+
+    for username, cube_name in grants:
+        cube_names_by_username.setdefault(username, set()).add(cube_name)
+
+    return cube_names_by_username
+
 def get_all_olap_cubes(db: Session) -> list[Type[OlapTable]]:
     cubes = db.query(OlapTable).all()
     return cubes
+
+def get_saved_query_payloads(db: Session, cube_name: str, created_after: datetime.datetime | None = None) -> list[str]:
+    """
+    Returns frontend payloads of queries saved for cube
+    :param db: Session
+    :param cube_name: name of the cube
+    :param created_after: only queries saved after this time. All queries if None
+    :return: JSON strings of payloads
+    """
+    query = db.query(SavedQuery.frontend).filter(SavedQuery.cube_name == cube_name)
+
+    if created_after is not None:
+        query = query.filter(SavedQuery.created_at >= created_after)
+
+    return [frontend for frontend, in query.all()]
+
+def get_materialized_view_refreshes(db: Session, cube_name: str) -> dict[str, MaterializedViewRefresh]:
+    """
+    Returns last refreshes of materialized views of cube
+    :param db: Session
+    :param cube_name: name of the cube
+    :return: MaterializedViewRefresh by table name
+    """
+    refreshes = db.query(MaterializedViewRefresh).filter(MaterializedViewRefresh.cube_name == cube_name).all()
+
+    return {refresh.table_name: refresh for refresh in refreshes}
+
+def save_materialized_view_refresh(db: Session, cube_name: str, view: MaterializedView,
+                                   refresh_started_at: datetime.datetime, error: str | None = None) -> None:
+    """
+    Saves result of refresh of materialized view
+    Definition of failed refresh is not saved: transaction was rolled back and view still has previous definition
+    :param db: Session
+    :param cube_name: name of the cube
+    :param view: refreshed MaterializedView
+    :param refresh_started_at: start of refresh
+    :param error: text of error. None if refresh was successful
+    :return: None
+    """
+    refresh: MaterializedViewRefresh | None = db.query(MaterializedViewRefresh).filter(
+        MaterializedViewRefresh.cube_name == cube_name, MaterializedViewRefresh.table_name == view.table_name).first()
+
+    if refresh is None:
+        refresh = MaterializedViewRefresh(cube_name=cube_name, table_name=view.table_name,
+                                          definition_hash=view.definition_hash)
+        db.add(refresh)
+
+    refresh.refresh_started_at = refresh_started_at
+    refresh.last_error = error
+
+    if error is None:
+        refresh.definition_hash = view.definition_hash
+        refresh.refreshed_at = refresh_started_at
+
+    db.commit()
+
+def add_mail_to_outbox(db: Session, email_to: str, subject: str, html_content: str) -> MailOutbox:
+    """
+    Saves mail to outbox. It will be sent by MailOutboxSender
+    :param db: Session
+    :param email_to: recipient
+    :param subject: subject of mail
+    :param html_content: html body of mail
+    :return: saved MailOutbox
+    """
+    mail: MailOutbox = MailOutbox(email_to=email_to, subject=subject, html_content=html_content, status="pending",
+                                  attempts=0, next_attempt_at=datetime.datetime.now(),
+                                  created_at=datetime.datetime.now())
+    db.add(mail)
+    db.commit()
+    db.refresh(mail)
+
+    return mail
+
+def claim_mails_to_send(db: Session, batch_size: int, lease: int) -> list[MailOutbox]:
+    """
+    Takes pending mails that should be sent now and postpones their next attempt by :param lease: seconds,
+    so other senders do not take them while they are sent. Attempt counter is incremented
+    Rows locked by other senders are skipped
+    :param db: Session
+    :param batch_size: maximum number of mails
+    :param lease: seconds mails belong to this sender
+    :return: claimed mails
+    """
+    now: datetime.datetime = datetime.datetime.now()
+
+    mails: list[MailOutbox] = db.query(MailOutbox) \
+        .filter(MailOutbox.status == "pending", MailOutbox.next_attempt_at <= now) \
+        .order_by(MailOutbox.next_attempt_at) \
+        .limit(batch_size) \
+        .with_for_update(skip_locked=True).all()
+
+    for mail in mails:
+        mail.attempts += 1
+        mail.next_attempt_at = now + datetime.timedelta(seconds=lease)
+
+    db.commit()
+
+    return mails
+
+def set_mail_sent(db: Session, mail: MailOutbox) -> None:
+    """
+    Marks mail as sent
+    :param db: Session
+    :param mail: claimed mail
+    :return: None
+    """
+    mail.status = "sent"
+    mail.sent_at = datetime.datetime.now()
+    mail.last_error = None
+
+    db.commit()
+
+def set_mail_not_sent(db: Session, mail: MailOutbox, error: str, retry_in: int | None) -> None:
+    """
+    Saves error of attempt and schedules next attempt
+    :param db: Session
+    :param mail: claimed mail
+    :param error: text of error
+    :param retry_in: seconds till next attempt. None marks mail as failed
+    :return: None
+    """
+    mail.last_error = error
+
+    if retry_in is None:
+        mail.status = "failed"
+    else:
+        mail.next_attempt_at = datetime.datetime.now() + datetime.timedelta(seconds=retry_in)
+
+    db.commit()
+
+def get_mail_outbox_counts(db: Session) -> dict[str, int]:
+    """
+    Counts mails in outbox by status
+    :param db: Session
+    :return: {status: number of mails}
+    """
+    counts = db.query(MailOutbox.status, func.count(MailOutbox.id)).group_by(MailOutbox.status).all()
+
+    return {status: count for status, count in counts}
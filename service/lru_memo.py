@@ -0,0 +1,78 @@
+import threading
+from collections import OrderedDict
+from typing import Any, Hashable
+
+from model.dto import MemoStatsDTO
+
+
+class LruMemo:
+    """
+    Thread-safe memo with least recently used eviction
+    Keys are tuples with cube name first, so all entries of one cube could be invalidated
+    """
+
+    def __init__(self, max_entries: int) -> None:
+        """
+        :param max_entries: maximum number of saved values. 0 disables memo
+        """
+        self.__max_entries: int = max_entries
+        self.__values: OrderedDict[tuple, Any] = OrderedDict()
+        self.__lock: threading.Lock = threading.Lock()
+
+        self.__hits: int = 0
+        self.__misses: int = 0
+
+    def get(self, key: tuple[Hashable, ...]) -> Any | None:
+        """
+        Returns saved value
+        :param key: tuple, first item is cube name
+        :return: value or None if key is unknown
+        """
+        with self.__lock:
+            if key not in self.__values:
+                self.__misses += 1
+                return None
+
+            self.__values.move_to_end(key)
+            self.__hits += 1
+
+            return self.__values[key]
+
+    def put(self, key: tuple[Hashable, ...], value: Any) -> None:
+        """
+        Saves value and evicts least recently used values
+        :param key: tuple, first item is cube name
+        :param value: value to save
+        :return: None
+        """
+        if self.__max_entries <= 0:
+            return
+
+        with self.__lock:
+            self.__values[key] = value
+            self.__values.move_to_end(key)
+
+            while len(self.__values) > self.__max_entries:
+                self.__values.popitem(last=False)
+
+    def invalidate_cube(self, cube_name: str) -> None:
+        """
+        Removes all values of the cube
+        :param cube_name: name of the cube
+        :return: None
+        """
+        with self.__lock:
+            for key in [key for key in self.__values if key[0] == cube_name]:
+                del self.__values[key]
+
+    def get_stats(self) -> MemoStatsDTO:
+        """
+        Returns counters of the memo
+        :return: MemoStatsDTO
+        """
+        with self.__lock:
+            requests_no: int = self.__hits + self.__misses
+
+            return MemoStatsDTO(hits=self.__hits, misses=self.__misses,
+                                hit_rate=self.__hits / requests_no if requests_no > 0 else 0.0,
+                                entries=len(self.__values), max_entries=self.__max_entries)
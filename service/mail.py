@@ -1,37 +1,25 @@
-import smtplib
-from email.mime.multipart import MIMEMultipart
-from email.mime.text import MIMEText
+from sqlalchemy.orm import Session
 
 from core.config import settings
+from service.mail_outbox import mail_outbox_sender
 
 
-def send_html_mail(html_content: str, email_to: str, subject: str) -> None:
-    message = MIMEMultipart("alternative")
-    message["From"] = settings.MAIL_DEFAULT_SENDER
-    message["To"] = email_to
-    message["Subject"] = subject
-
-    # Attach the plain text and HTML parts to the message
-    html_part = MIMEText(html_content, "html")
-    message.attach(html_part)
-
-    # Connect to the SMTP server
-    with smtplib.SMTP(settings.MAIL_SERVER, settings.MAIL_PORT) as server:
-        server.starttls()  # Secure the connection
-        server.login(settings.MAIL_USERNAME, settings.MAIL_PASSWORD)  # Log in to the SMTP server
-        server.sendmail(settings.MAIL_DEFAULT_SENDER, email_to, message.as_string())  # Send the email
-
-def send_confirmation_mail(code: str, email_to: str, middle_link: str):
+def send_confirmation_mail(code: str, email_to: str, middle_link: str, db: Session):
+    """
+    Puts confirmation mail to outbox. It is sent in background
+    """
     subject: str = "Код подтверждения"
 
     html_message: str = f"""Подтвердите свой email и перейдите по ссылке: {settings.PROJECT_HOST}{middle_link}/{code}"""
 
-    send_html_mail(html_message, email_to, subject)
+    mail_outbox_sender.queue_mail(db, email_to, subject, html_message)
 
-def send_forgot_password_mail(code: str, email_to: str) -> None:
+def send_forgot_password_mail(code: str, email_to: str, db: Session) -> None:
+    """
+    Puts password restoration mail to outbox. It is sent in background
+    """
     subject: str = "Код подтверждения"
 
     html_message: str = f"""Код подтверждения для смены пароля: {code}"""
 
-    send_html_mail(html_message, email_to, subject)
-
+    mail_outbox_sender.queue_mail(db, email_to, subject, html_message)
@@ -0,0 +1,229 @@
+import asyncio
+import logging
+import smtplib
+import threading
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+from core.config import settings
+from core.database import SessionLocal
+from model.base_model import MailOutbox
+from model.dto import MailOutboxStatsDTO
+from service.db import add_mail_to_outbox, claim_mails_to_send, set_mail_sent, set_mail_not_sent, \
+    get_mail_outbox_counts
+
+logger = logging.getLogger(__name__)
+
+# Seconds claimed mails belong to one sender. If sender dies, mails are taken by another one after that
+MAIL_LEASE_SECONDS: int = 5 * 60
+MAX_RETRY_DELAY: int = 60 * 60
+
+
+def create_html_message(html_content: str, email_to: str, subject: str) -> MIMEMultipart:
+    """
+    Creates mail with html part
+    :param html_content: html body
+    :param email_to: recipient
+    :param subject: subject of mail
+    :return: MIMEMultipart
+    """
+    message = MIMEMultipart("alternative")
+    message["From"] = settings.MAIL_DEFAULT_SENDER
+    message["To"] = email_to
+    message["Subject"] = subject
+
+    # Attach the plain text and HTML parts to the message
+    html_part = MIMEText(html_content, "html")
+    message.attach(html_part)
+
+    return message
+
+
+def open_smtp_connection() -> smtplib.SMTP:
+    """
+    Connects to SMTP server and logs in
+    SSL is used if MAIL_USE_SSL is true, STARTTLS unless MAIL_USE_TLS is false.
+    Login is skipped if MAIL_USERNAME is not set
+    :return: connected smtplib.SMTP
+    """
+    server: smtplib.SMTP
+
+    if (settings.MAIL_USE_SSL or "false").lower() == "true":
+        server = smtplib.SMTP_SSL(settings.MAIL_SERVER, settings.MAIL_PORT)
+    else:
+        server = smtplib.SMTP(settings.MAIL_SERVER, settings.MAIL_PORT)
+
+        if (settings.MAIL_USE_TLS or "true").lower() == "true":
+            server.starttls()  # Secure the connection
+
+    if settings.MAIL_USERNAME:
+        server.login(settings.MAIL_USERNAME, settings.MAIL_PASSWORD)  # Log in to the SMTP server
+
+    return server
+
+
+class MailOutboxSender:
+    """
+    Sends mails from mail_outbox table in background
+    Mails are sent by batches, one SMTP connection is used for the whole batch
+    Failed mails are retried with exponential backoff until max_attempts
+    Several application processes could send at once, every mail is claimed by one of them
+    """
+
+    def __init__(self, batch_size: int, max_attempts: int, retry_delay: int) -> None:
+        """
+        :param batch_size: mails sent through one connection
+        :param max_attempts: mail is marked as failed after this number of attempts
+        :param retry_delay: seconds before first retry, doubled after every attempt
+        """
+        self.__batch_size: int = batch_size
+        self.__max_attempts: int = max_attempts
+        self.__retry_delay: int = retry_delay
+
+        self.__lock: threading.Lock = threading.Lock()
+        self.__sent: int = 0
+        self.__send_errors: int = 0
+
+        self.__loop: asyncio.AbstractEventLoop | None = None
+        self.__wake_up_event: asyncio.Event | None = None
+
+    def queue_mail(self, db: Session, email_to: str, subject: str, html_content: str) -> None:
+        """
+        Saves mail to outbox and wakes sender up. Mail is not sent in request
+        :param db: Session
+        :param email_to: recipient
+        :param subject: subject of mail
+        :param html_content: html body
+        :return: None
+        """
+        add_mail_to_outbox(db, email_to, subject, html_content)
+
+        self.wake_up()
+
+    def wake_up(self) -> None:
+        """
+        Makes background sender check outbox right away. Could be called from any thread
+        :return: None
+        """
+        loop: asyncio.AbstractEventLoop | None = self.__loop
+        wake_up_event: asyncio.Event | None = self.__wake_up_event
+
+        if (loop is None) or (wake_up_event is None) or loop.is_closed():
+            return
+
+        loop.call_soon_threadsafe(wake_up_event.set)
+
+    def send_batch(self, db: Session) -> int:
+        """
+        Sends one batch of mails that should be sent now
+        :param db: Session
+        :return: number of claimed mails
+        """
+        mails: list[MailOutbox] = claim_mails_to_send(db, self.__batch_size, MAIL_LEASE_SECONDS)
+
+        if len(mails) == 0:
+            return 0
+
+        try:
+            server: smtplib.SMTP = open_smtp_connection()
+        except (smtplib.SMTPException, OSError) as error:
+            logger.warning("Could not connect to SMTP server: %s", error)
+
+            for mail in mails:
+                self.__set_not_sent(db, mail, error)
+
+            return len(mails)
+
+        with server:
+            for mail in mails:
+                try:
+                    message: MIMEMultipart = create_html_message(mail.html_content, mail.email_to, mail.subject)
+                    server.sendmail(settings.MAIL_DEFAULT_SENDER, mail.email_to, message.as_string())
+                except (smtplib.SMTPException, OSError) as error:
+                    self.__set_not_sent(db, mail, error)
+                    continue
+
+                set_mail_sent(db, mail)
+
+                with self.__lock:
+                    self.__sent += 1
+
+        return len(mails)
+
+    async def send_forever(self, interval: int) -> None:
+        """
+        Sends mails every :param interval: seconds or right after new mail is queued
+        Full batch is followed by the next one without waiting
+        Should be run as background task and cancelled on shutdown
+        :param interval: seconds between checks of outbox
+        :return: None
+        """
+        self.__loop = asyncio.get_running_loop()
+        self.__wake_up_event = asyncio.Event()
+
+        while True:
+            self.__wake_up_event.clear()
+
+            claimed: int = 0
+
+            try:
+                claimed = await run_in_threadpool(self.__send_batch_with_new_session)
+            except Exception:
+                logger.exception("Could not send mails from outbox")
+
+            if claimed >= self.__batch_size:
+                continue
+
+            try:
+                await asyncio.wait_for(self.__wake_up_event.wait(), timeout=interval)
+            except asyncio.TimeoutError:
+                pass
+
+    def get_stats(self, db: Session) -> MailOutboxStatsDTO:
+        """
+        Returns size of outbox and counters of current process
+        :param db: Session
+        :return: MailOutboxStatsDTO
+        """
+        counts: dict[str, int] = get_mail_outbox_counts(db)
+
+        with self.__lock:
+            return MailOutboxStatsDTO(pending=counts.get("pending", 0), failed=counts.get("failed", 0),
+                                      sent=self.__sent, send_errors=self.__send_errors)
+
+    def __set_not_sent(self, db: Session, mail: MailOutbox, error: Exception) -> None:
+        """
+        Schedules next attempt with exponential backoff or marks mail as failed
+        :param db: Session
+        :param mail: claimed mail
+        :param error: error of attempt
+        :return: None
+        """
+        retry_in: int | None = None
+
+        if mail.attempts < self.__max_attempts:
+            retry_in = min(self.__retry_delay * 2 ** (mail.attempts - 1), MAX_RETRY_DELAY)
+
+        set_mail_not_sent(db, mail, str(error), retry_in)
+
+        with self.__lock:
+            self.__send_errors += 1
+
+        if retry_in is None:
+            logger.error("Mail %s was not sent after %s attempts: %s", mail.id, mail.attempts, error)
+
+    def __send_batch_with_new_session(self) -> int:
+        """
+        Send batch with its own Session, background task has no request Session
+        :return: number of claimed mails
+        """
+        with SessionLocal() as db:
+            return self.send_batch(db)
+
+
+mail_outbox_sender: MailOutboxSender = MailOutboxSender(settings.MAIL_OUTBOX_BATCH_SIZE,
+                                                        settings.MAIL_OUTBOX_MAX_ATTEMPTS,
+                                                        settings.MAIL_OUTBOX_RETRY_DELAY)
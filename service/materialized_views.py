@@ -0,0 +1,368 @@
+import datetime
+import hashlib
+import json
+import os
+import threading
+
+import toml
+from comradewolf.universe.olap_structure_generator import OlapStructureGenerator
+from comradewolf.utils.enums_and_field_dicts import OlapCalculations, OlapFieldTypes
+from comradewolf.utils.olap_data_types import OlapDataTable, OlapTablesCollection
+from comradewolf.utils.utils import list_toml_files_in_directory, return_none_on_text
+from sqlalchemy import TextClause, text, bindparam
+
+from core.utils.exceptions import WrongMaterializedView
+from model.dto import MaterializedView, MaterializedViewStatsDTO
+
+# Folder of cube with .toml files of materialized views
+MATERIALIZED_VIEWS_DIRECTORY: str = "materialized"
+
+# Calculations that give the same result when applied to already aggregated values
+# Optimizer applies the same calculation to aggregated column, so only they could be stored as aggregates
+REAGGREGATED_CALCULATIONS: list[str] = [OlapCalculations.SUM.value, OlapCalculations.MIN.value,
+                                        OlapCalculations.MAX.value]
+
+
+class MaterializedViewCatalog:
+    """
+    Materialized views of the cube and their refresh state
+    Optimizer skips queries to views that were not refreshed yet or are older than max_staleness
+    """
+
+    def __init__(self) -> None:
+        self.__views: dict[str, MaterializedView] = {}
+        self.__refreshed_at: dict[str, datetime.datetime] = {}
+        self.__refreshing: set[str] = set()
+        self.__last_errors: dict[str, str] = {}
+        self.__last_refresh_ms: dict[str, float] = {}
+        self.__lock: threading.Lock = threading.Lock()
+
+    def set_views(self, views: list[MaterializedView]) -> None:
+        """
+        Replaces views of the cube. Views are not available until refresh time is known
+        :param views: views from load_materialized_views
+        :return: None
+        """
+        with self.__lock:
+            self.__views = {view.table_name: view for view in views}
+            self.__refreshed_at = {}
+            self.__refreshing = set()
+            self.__last_errors = {}
+            self.__last_refresh_ms = {}
+
+    def get_views(self) -> list[MaterializedView]:
+        """
+        Returns views of the cube
+        :return: list of MaterializedView
+        """
+        with self.__lock:
+            return list(self.__views.values())
+
+    def is_available(self, table_name: str) -> bool:
+        """
+        Checks if queries could be answered by table
+        :param table_name: table name as in cube structure
+        :return: True for tables that are not views and for views refreshed not later than max_staleness ago
+        """
+        with self.__lock:
+            view: MaterializedView | None = self.__views.get(table_name, None)
+
+            if view is None:
+                return True
+
+            return self.__is_fresh(view, datetime.datetime.now())
+
+    def is_refresh_due(self, table_name: str) -> bool:
+        """
+        Checks if view should be refreshed now
+        :param table_name: table name of view
+        :return: True if view was never refreshed or refresh_interval has passed and it is not being refreshed
+        """
+        with self.__lock:
+            if table_name in self.__refreshing:
+                return False
+
+            refreshed_at: datetime.datetime | None = self.__refreshed_at.get(table_name, None)
+
+            if refreshed_at is None:
+                return True
+
+            return datetime.datetime.now() - refreshed_at >= \
+                datetime.timedelta(seconds=self.__views[table_name].refresh_interval)
+
+    def set_refreshed_at(self, table_name: str, refreshed_at: datetime.datetime | None) -> None:
+        """
+        Sets time of refresh made by this or other instance of application
+        :param table_name: table name of view
+        :param refreshed_at: time of refresh. None if view has no data of current definition
+        :return: None
+        """
+        with self.__lock:
+            if refreshed_at is None:
+                self.__refreshed_at.pop(table_name, None)
+                return
+
+            current_refreshed_at: datetime.datetime | None = self.__refreshed_at.get(table_name, None)
+
+            if (current_refreshed_at is None) or (refreshed_at > current_refreshed_at):
+                self.__refreshed_at[table_name] = refreshed_at
+
+    def start_refresh(self, table_name: str) -> None:
+        """
+        Marks view as being refreshed
+        :param table_name: table name of view
+        :return: None
+        """
+        with self.__lock:
+            self.__refreshing.add(table_name)
+
+    def finish_refresh(self, table_name: str, refreshed_at: datetime.datetime | None, refresh_ms: float) -> None:
+        """
+        Saves result of successful refresh
+        :param table_name: table name of view
+        :param refreshed_at: start of refresh. None if refresh was skipped because other instance was refreshing
+        :param refresh_ms: duration of refresh
+        :return: None
+        """
+        with self.__lock:
+            self.__refreshing.discard(table_name)
+
+            if refreshed_at is None:
+                return
+
+            self.__refreshed_at[table_name] = refreshed_at
+            self.__last_errors.pop(table_name, None)
+            self.__last_refresh_ms[table_name] = refresh_ms
+
+    def fail_refresh(self, table_name: str, error: str) -> None:
+        """
+        Saves error of refresh. Previous data of view is used until it becomes stale
+        :param table_name: table name of view
+        :param error: text of error
+        :return: None
+        """
+        with self.__lock:
+            self.__refreshing.discard(table_name)
+            self.__last_errors[table_name] = error
+
+    def get_stats(self, cube_name: str) -> list[MaterializedViewStatsDTO]:
+        """
+        Returns refresh state of views
+        :param cube_name: name of the cube
+        :return: list of MaterializedViewStatsDTO
+        """
+        now: datetime.datetime = datetime.datetime.now()
+
+        with self.__lock:
+            return [MaterializedViewStatsDTO(cube_name=cube_name, table_name=table_name,
+                                             is_available=self.__is_fresh(view, now),
+                                             is_refreshing=table_name in self.__refreshing,
+                                             refreshed_at=self.__refreshed_at.get(table_name, None),
+                                             last_error=self.__last_errors.get(table_name, None),
+                                             last_refresh_ms=self.__last_refresh_ms.get(table_name, None))
+                    for table_name, view in self.__views.items()]
+
+    def __is_fresh(self, view: MaterializedView, now: datetime.datetime) -> bool:
+        """
+        Should be called with lock
+        :param view: MaterializedView
+        :param now: current time
+        :return: True if view was refreshed not later than max_staleness ago
+        """
+        refreshed_at: datetime.datetime | None = self.__refreshed_at.get(view.table_name, None)
+
+        if refreshed_at is None:
+            return False
+
+        return now - refreshed_at <= datetime.timedelta(seconds=view.max_staleness)
+
+
+def transform_calculation(calculation: str | None) -> str | None:
+    """
+    Converts calculation from .toml file the same way as OlapStructureGenerator
+    :param calculation: calculation_type or following_calculation
+    :return: calculation in lower case or None
+    """
+    if (calculation is None) or (calculation.lower() == "none"):
+        return None
+
+    return calculation.lower()
+
+
+def create_aggregate_query(base_table_name: str, columns: list[tuple[str, str, dict, str | None]]) -> str:
+    """
+    Creates query that groups base table into aggregate
+    :param base_table_name: database.schema.table of base table
+    :param columns: column name, alias, field of base table and calculation (None for grouped columns)
+    :return: sql
+    """
+    group_by: list[str] = [field["field_name"] for _, _, field, calculation in columns if calculation is None]
+    select: list[str] = []
+
+    for column_name, _, field, calculation in columns:
+        if calculation is not None:
+            select.append(f"{calculation}({field['field_name']}) as {column_name}")
+        elif column_name != field["field_name"]:
+            select.append(f"{field['field_name']} as {column_name}")
+        else:
+            select.append(column_name)
+
+    query: str = f"select {', '.join(select)}\nfrom {'.'.join(base_table_name.split('.')[-2:])}"
+
+    if len(group_by) > 0:
+        query += f"\ngroup by {', '.join(group_by)}"
+
+    return query
+
+
+def get_materialized_view_columns(table_name: str, fields: dict, base_table_name: str,
+                                  tables_collection: OlapTablesCollection) -> list[tuple[str, str, dict, str | None]]:
+    """
+    Matches fields of view .toml file with fields of base table
+
+    :raises WrongMaterializedView: if view could not be calculated from base table
+
+    :param table_name: database.schema.table of view
+    :param fields: [fields] of view .toml file
+    :param base_table_name: name of base table of the cube
+    :param tables_collection: tables of the cube
+    :return: column name, alias, field of base table and calculation (None for grouped columns)
+    """
+    base_fields: dict = tables_collection.get_fact_table_fields(base_table_name)
+    columns: list[tuple[str, str, dict, str | None]] = []
+
+    for column_name, field in fields.items():
+        field_alias: str | None = return_none_on_text(field["alias"])
+        calculation: str | None = transform_calculation(field["calculation_type"])
+
+        if field_alias not in base_fields:
+            raise WrongMaterializedView(table_name, f"base table has no field with alias {field_alias}")
+
+        if (calculation is not None) and (calculation not in REAGGREGATED_CALCULATIONS):
+            raise WrongMaterializedView(table_name, f"{column_name}: only {REAGGREGATED_CALCULATIONS} are allowed")
+
+        if (calculation is None) and (base_fields[field_alias]["field_type"] == OlapFieldTypes.VALUE.value):
+            raise WrongMaterializedView(table_name, f"{column_name}: values should be calculated")
+
+        columns.append((column_name, field_alias, base_fields[field_alias], calculation))
+
+    return columns
+
+
+def load_materialized_views(toml_link: str, olap_structure: OlapStructureGenerator,
+                            default_refresh_interval: int) -> list[MaterializedView]:
+    """
+    Reads .toml files from materialized folder of the cube. Files have the same format as data tables
+    and optional refresh_interval and max_staleness in seconds
+    Views are added to tables of the cube as data tables, so optimizer could choose them
+
+    :raises WrongMaterializedView: if view could not be calculated from base table
+
+    :param toml_link: folder of the cube
+    :param olap_structure: structure of the cube
+    :param default_refresh_interval: refresh_interval of views without it
+    :return: list of MaterializedView
+    """
+    path_for_views: str = os.path.join(toml_link, MATERIALIZED_VIEWS_DIRECTORY)
+
+    if not os.path.isdir(path_for_views):
+        return []
+
+    tables_collection: OlapTablesCollection = olap_structure.get_tables_collection()
+    base_table_name: str = olap_structure.main_data_table.get_name()
+    views: list[MaterializedView] = []
+
+    for view_file in list_toml_files_in_directory(path_for_views):
+        view_from_toml: dict = toml.load(view_file)
+
+        table_name: str = "{}.{}.{}".format(view_from_toml["database"], view_from_toml["schema"],
+                                            view_from_toml["table"])
+
+        columns: list[tuple[str, str, dict, str | None]] = get_materialized_view_columns(
+            table_name, view_from_toml["fields"], base_table_name, tables_collection)
+
+        data_table: OlapDataTable = OlapDataTable(table_name)
+
+        for field in view_from_toml["fields"]:
+            data_table.add_field(field,
+                                 return_none_on_text(view_from_toml["fields"][field]["alias"]),
+                                 return_none_on_text(view_from_toml["fields"][field]["field_type"]),
+                                 transform_calculation(view_from_toml["fields"][field]["calculation_type"]),
+                                 transform_calculation(view_from_toml["fields"][field]["following_calculation"]),
+                                 view_from_toml["fields"][field]["data_type"],
+                                 return_none_on_text(view_from_toml["fields"][field]["front_name"]))
+
+        tables_collection.add_data_table(data_table)
+
+        query: str = create_aggregate_query(base_table_name, columns)
+        unique_columns: list[str] = [column_name for column_name, _, _, calculation in columns if calculation is None]
+        refresh_interval: int = int(view_from_toml.get("refresh_interval", default_refresh_interval))
+
+        views.append(MaterializedView(table_name=table_name, query=query, unique_columns=unique_columns,
+                                      refresh_interval=refresh_interval,
+                                      max_staleness=int(view_from_toml.get("max_staleness", 2 * refresh_interval)),
+                                      definition_hash=hashlib.sha256(
+                                          json.dumps([query, unique_columns]).encode()).hexdigest()))
+
+    return views
+
+
+def create_materialized_view_queries(view: MaterializedView, recreate: bool) -> list[TextClause]:
+    """
+    Creates view without data and unique index that lets refresh it concurrently
+    :param view: MaterializedView
+    :param recreate: drop view first, its query has changed
+    :return: queries to execute in order
+    """
+    schema_table_name: str = ".".join(view.table_name.split(".")[-2:])
+    queries: list[TextClause] = []
+
+    if recreate:
+        queries.append(text(f"drop materialized view if exists {schema_table_name}"))
+
+    queries.append(text(f"create materialized view if not exists {schema_table_name} as\n{view.query}\n"
+                        f"with no data"))
+
+    if len(view.unique_columns) > 0:
+        index_name: str = f"{schema_table_name.split('.')[-1]}_uq"
+        queries.append(text(f"create unique index if not exists {index_name} on {schema_table_name} "
+                            f"({', '.join(view.unique_columns)})"))
+
+    return queries
+
+
+def create_materialized_view_lock_query(view: MaterializedView) -> TextClause:
+    """
+    Takes lock of view until the end of transaction, so only one instance of application refreshes it
+    :param view: MaterializedView
+    :return: query that returns true if lock was taken
+    """
+    return text("select pg_try_advisory_xact_lock(hashtext(:table_name))").bindparams(table_name=view.table_name)
+
+
+def create_materialized_view_populated_query(view: MaterializedView) -> TextClause:
+    """
+    Checks if view has data. View without data could not be refreshed concurrently
+    :param view: MaterializedView
+    :return: query that returns ispopulated
+    """
+    schema_name, table_name = view.table_name.split(".")[-2:]
+
+    return text("select ispopulated from pg_catalog.pg_matviews where schemaname = :schema_name "
+                "and matviewname = :table_name").bindparams(bindparam("schema_name", schema_name),
+                                                             bindparam("table_name", table_name))
+
+
+def create_materialized_view_refresh_queries(view: MaterializedView, is_populated: bool) -> list[TextClause]:
+    """
+    Refreshes view and its statistics
+    Populated view with unique index is refreshed concurrently, queries could read it during refresh
+    :param view: MaterializedView
+    :param is_populated: view has data
+    :return: queries to execute in order
+    """
+    schema_table_name: str = ".".join(view.table_name.split(".")[-2:])
+    concurrently: str = "concurrently " if is_populated and (len(view.unique_columns) > 0) else ""
+
+    return [text(f"refresh materialized view {concurrently}{schema_table_name}"),
+            text(f"analyze {schema_table_name}")]
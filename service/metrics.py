@@ -0,0 +1,278 @@
+import contextlib
+import threading
+import time
+from contextvars import ContextVar
+from typing import Iterator, AsyncIterator, Sequence
+
+from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram, CONTENT_TYPE_LATEST
+from prometheus_client.core import GaugeMetricFamily, CounterMetricFamily, Metric
+from prometheus_client.registry import Collector
+from starlette.requests import Request
+from starlette.types import ASGIApp, Scope, Receive, Send, Message
+
+from model.dto import AdmissionStatsDTO, PoolStatsDTO, QueryInterruptionStatsDTO
+
+# Cube and endpoint of current request. Set by router dependency, copied to thread pool and to streaming iterators
+metric_labels: ContextVar[tuple[str, str]] = ContextVar("metric_labels", default=("", "background"))
+
+# Seconds. From cached page to long export
+DEFAULT_BUCKETS: tuple[float, ...] = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+                                      30.0, 60.0, 300.0)
+
+PROMETHEUS_MEDIA_TYPE = CONTENT_TYPE_LATEST
+
+
+def set_request_metric_labels(cube_name: str, endpoint: str) -> None:
+    """
+    Sets labels that metrics of current request are written with
+    :param cube_name: name of the cube, empty if request is not about one cube
+    :param endpoint: path template of the route, e.g. /v1/cube/{cube_name}/query_info
+    :return: None
+    """
+    metric_labels.set((cube_name, endpoint))
+
+
+class CubeStatsCollector(Collector):
+    """
+    Admission, connection pools and interrupted queries of cubes
+    Stats are taken from cube collection right before metrics are rendered, so removed cubes disappear
+    """
+
+    def __init__(self) -> None:
+        self.__lock: threading.Lock = threading.Lock()
+        self.__admission_stats: list[AdmissionStatsDTO] = []
+        self.__pool_stats: list[PoolStatsDTO] = []
+        self.__interruption_stats: list[QueryInterruptionStatsDTO] = []
+
+    def set_stats(self, admission_stats: list[AdmissionStatsDTO], pool_stats: list[PoolStatsDTO],
+                  interruption_stats: list[QueryInterruptionStatsDTO]) -> None:
+        """
+        Replaces stats of all cubes
+        :param admission_stats: stats of admission controllers
+        :param pool_stats: stats of connection pools
+        :param interruption_stats: counters of cancelled and timed out queries
+        :return: None
+        """
+        with self.__lock:
+            self.__admission_stats = admission_stats
+            self.__pool_stats = pool_stats
+            self.__interruption_stats = interruption_stats
+
+    def collect(self) -> Iterator[Metric]:
+        with self.__lock:
+            admission_stats: list[AdmissionStatsDTO] = self.__admission_stats
+            pool_stats: list[PoolStatsDTO] = self.__pool_stats
+            interruption_stats: list[QueryInterruptionStatsDTO] = self.__interruption_stats
+
+        admission_running = GaugeMetricFamily("comradewolf_admission_running", "Connections of the cube in use",
+                                              labels=("cube",))
+        admission_waiting = GaugeMetricFamily("comradewolf_admission_waiting",
+                                              "Requests waiting for connection to the cube",
+                                              labels=("cube", "priority"))
+        admission_max_connections = GaugeMetricFamily("comradewolf_admission_max_connections",
+                                                      "Parallel queries allowed for the cube", labels=("cube",))
+        pool_connections = GaugeMetricFamily("comradewolf_pool_connections", "Connections of cube pool by state",
+                                             labels=("cube", "state"))
+        # Counted by optimizers since start of the process
+        queries_interrupted = CounterMetricFamily("comradewolf_queries_interrupted",
+                                                  "Queries cancelled on client disconnect or stopped by statement "
+                                                  "timeout", labels=("cube", "reason"))
+
+        for stats in admission_stats:
+            admission_running.add_metric((stats.cube_name,), stats.running)
+            admission_waiting.add_metric((stats.cube_name, "interactive"), stats.waiting_interactive)
+            admission_waiting.add_metric((stats.cube_name, "bulk"), stats.waiting_bulk)
+            admission_max_connections.add_metric((stats.cube_name,), stats.max_connections)
+
+        for stats in pool_stats:
+            pool_connections.add_metric((stats.cube_name, "checked_out"), stats.checked_out)
+            pool_connections.add_metric((stats.cube_name, "idle"), stats.idle)
+            pool_connections.add_metric((stats.cube_name, "overflow"), stats.overflow)
+
+        for stats in interruption_stats:
+            queries_interrupted.add_metric((stats.cube_name, "cancelled"), stats.cancelled)
+            queries_interrupted.add_metric((stats.cube_name, "timed_out"), stats.timed_out)
+
+        yield from [admission_running, admission_waiting, admission_max_connections, pool_connections,
+                    queries_interrupted]
+
+
+# Own registry, so metrics of the process and platform collectors of default one are not mixed in
+registry: CollectorRegistry = CollectorRegistry()
+
+stage_duration: Histogram = Histogram(
+    "comradewolf_stage_duration_seconds",
+    "Duration of query pipeline stages: generate_sql, choose_query, admission_wait, count_rows, execute, "
+    "materialize, serialize",
+    ("cube", "endpoint", "stage"), registry=registry, buckets=DEFAULT_BUCKETS)
+
+request_duration: Histogram = Histogram(
+    "comradewolf_request_duration_seconds", "Duration of HTTP requests", ("endpoint", "method", "status"),
+    registry=registry, buckets=DEFAULT_BUCKETS)
+
+rows_returned: Counter = Counter(
+    "comradewolf_rows_returned_total", "Rows returned to clients", ("cube", "endpoint"), registry=registry)
+
+bytes_returned: Counter = Counter(
+    "comradewolf_bytes_returned_total", "Bytes of data returned to clients", ("cube", "endpoint"), registry=registry)
+
+# Updated by password hash pool. Latency includes wait for free worker process
+password_hash_duration: Histogram = Histogram(
+    "comradewolf_password_hash_duration_seconds", "Duration of password hashing and checking in hash pool",
+    registry=registry, buckets=DEFAULT_BUCKETS)
+
+password_hash_queue_depth: Gauge = Gauge(
+    "comradewolf_password_hash_queue_depth", "Password hash tasks running or waiting for worker process",
+    registry=registry)
+
+password_hash_rejected: Counter = Counter(
+    "comradewolf_password_hash_rejected_total", "Password hash tasks rejected because hash pool queue is full",
+    registry=registry)
+
+cube_stats: CubeStatsCollector = CubeStatsCollector()
+registry.register(cube_stats)
+
+
+@contextlib.contextmanager
+def stage_timer(stage: str) -> Iterator[None]:
+    """
+    Measures duration of pipeline stage of current request
+    Works across awaits, so could be used in async code too
+    :param stage: name of the stage
+    :return: None
+    """
+    started_at: float = time.perf_counter()
+
+    try:
+        yield
+    finally:
+        cube_name, endpoint = metric_labels.get()
+        stage_duration.labels(cube_name, endpoint, stage).observe(time.perf_counter() - started_at)
+
+
+def add_returned_data(rows_no: int, bytes_no: int) -> None:
+    """
+    Counts rows and bytes returned by current request
+    :param rows_no: number of rows
+    :param bytes_no: size of serialized data
+    :return: None
+    """
+    labels: tuple[str, str] = metric_labels.get()
+
+    rows_returned.labels(*labels).inc(rows_no)
+    bytes_returned.labels(*labels).inc(bytes_no)
+
+
+def count_streamed_rows(chunks: Iterator[tuple[list[str], Sequence]]) -> Iterator[tuple[list[str], Sequence]]:
+    """
+    Counts rows of stream while it is sent
+    :param chunks: iterator of column names and rows from optimizer
+    :return: the same chunks
+    """
+    labels: tuple[str, str] = metric_labels.get()
+
+    for columns, rows in chunks:
+        rows_returned.labels(*labels).inc(len(rows))
+        yield columns, rows
+
+
+async def count_streamed_rows_async(chunks: AsyncIterator[tuple[list[str], Sequence]]) \
+        -> AsyncIterator[tuple[list[str], Sequence]]:
+    """
+    Counts rows of async stream while it is sent
+    :param chunks: async iterator of column names and rows from optimizer
+    :return: the same chunks
+    """
+    labels: tuple[str, str] = metric_labels.get()
+
+    async for columns, rows in chunks:
+        rows_returned.labels(*labels).inc(len(rows))
+        yield columns, rows
+
+
+def count_streamed_bytes(chunks: Iterator[bytes]) -> Iterator[bytes]:
+    """
+    Counts bytes of stream while it is sent
+    :param chunks: serialized chunks
+    :return: the same chunks
+    """
+    labels: tuple[str, str] = metric_labels.get()
+
+    for chunk in chunks:
+        bytes_returned.labels(*labels).inc(len(chunk))
+        yield chunk
+
+
+async def count_streamed_bytes_async(chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    """
+    Counts bytes of async stream while it is sent
+    :param chunks: serialized chunks
+    :return: the same chunks
+    """
+    labels: tuple[str, str] = metric_labels.get()
+
+    async for chunk in chunks:
+        bytes_returned.labels(*labels).inc(len(chunk))
+        yield chunk
+
+
+async def set_metric_labels_from_route(request: Request) -> None:
+    """
+    Router dependency. Labels metrics of request with cube from path and path template of the route
+    Dependency is async, so labels are set in request task and copied to thread pool from there
+    :param request: starlette Request
+    :return: None
+    """
+    set_request_metric_labels(request.path_params.get("cube_name", ""), get_route_path(request.scope))
+
+
+def get_route_path(scope: Scope) -> str:
+    """
+    Returns path template of matched route. Raw path is not used, it would create label for every query id
+    :param scope: ASGI scope after routing
+    :return: path template or "unmatched"
+    """
+    return getattr(scope.get("route"), "path", "unmatched")
+
+
+def update_cube_stats(admission_stats: list[AdmissionStatsDTO], pool_stats: list[PoolStatsDTO],
+                       interruption_stats: list[QueryInterruptionStatsDTO]) -> None:
+    """
+    Sets stats of cubes right before metrics are rendered. Metrics of removed cubes are dropped
+    :param admission_stats: stats of admission controllers
+    :param pool_stats: stats of connection pools
+    :param interruption_stats: counters of cancelled and timed out queries
+    :return: None
+    """
+    cube_stats.set_stats(admission_stats, pool_stats, interruption_stats)
+
+
+class RequestMetricsMiddleware:
+    """
+    Measures HTTP requests until the last byte is sent, so streaming exports are measured completely
+    """
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app: ASGIApp = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started_at: float = time.perf_counter()
+        status_code: int = 500
+
+        async def send_with_status(message: Message) -> None:
+            nonlocal status_code
+
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            request_duration.labels(get_route_path(scope), scope["method"],
+                                    str(status_code)).observe(time.perf_counter() - started_at)
@@ -0,0 +1,388 @@
+import contextlib
+import json
+import logging
+import os
+import threading
+from typing import Iterator, Any
+
+from comradewolf.utils.olap_data_types import SelectCollection, SelectFilter
+from sqlalchemy import Engine, text, Result, Sequence, Row, TextClause, \
+    Connection, QueuePool, create_engine, event
+from sqlalchemy.exc import DBAPIError
+
+from core.config import Settings
+from core.utils.exceptions import NoQuery, QueryCancelled, QueryTimeout, NoDuckDBSupport, NoTableDataFile, \
+    WrongMaterializedView
+from model.dto import RowCountStrategy, TableStatistics, MaterializedView
+from service.optimizer_interface import OptimizerAbstract
+from service.optimizer_postgres import PostgresQueryMixin
+from service.metrics import stage_timer
+from service.tracing import traced, set_span_attributes
+from service.query_cancel import cancellable_connection, query_cancel_handle, QueryCancelHandle
+
+try:
+    import duckdb
+    import duckdb_engine
+except ImportError:
+    duckdb = None
+
+logger = logging.getLogger(__name__)
+
+DUCKDB_ENGINE_NAME: str = "duckdb"
+
+
+def check_duckdb_support() -> None:
+    """
+    Checks that duckdb and duckdb-engine are installed
+    :raises NoDuckDBSupport: if they are not installed
+    :return: None
+    """
+    if duckdb is None:
+        raise NoDuckDBSupport()
+
+
+def get_duckdb_config(settings: Settings) -> dict[str, Any]:
+    """
+    Creates configuration of new DuckDB connection
+    :param settings: Settings
+    :return: config for duckdb.connect
+    """
+    config: dict[str, Any] = {}
+
+    if settings.DUCKDB_THREADS > 0:
+        config["threads"] = settings.DUCKDB_THREADS
+
+    if settings.DUCKDB_MEMORY_LIMIT:
+        config["memory_limit"] = settings.DUCKDB_MEMORY_LIMIT
+
+    return config
+
+
+def quote_identifier(name: str) -> str:
+    return '"{}"'.format(name.replace('"', '""'))
+
+
+def quote_literal(value: str) -> str:
+    return "'{}'".format(value.replace("'", "''"))
+
+
+def find_table_source(table_name: str, data_path: str) -> str:
+    """
+    Finds file of the table and creates DuckDB table function that reads it
+    File of table database.schema.table is searched in :param data_path:/schema/:
+        - table.parquet
+        - table/ directory with Parquet files, hive partitioning is supported
+        - table.csv with header
+    :param table_name: table name as in .toml files: database.schema.table or schema.table
+    :param data_path: directory with files of cube tables
+    :raises NoTableDataFile: if there is no file for table
+    :return: table function, e.g. read_parquet('/data/olap/sales.parquet')
+    """
+    schema, table = table_name.split(".")[-2:]
+    table_path: str = os.path.join(data_path, schema, table)
+
+    if os.path.isfile(f"{table_path}.parquet"):
+        return f"read_parquet({quote_literal(table_path + '.parquet')})"
+
+    if os.path.isdir(table_path):
+        return f"read_parquet({quote_literal(os.path.join(table_path, '**', '*.parquet'))}, hive_partitioning = true)"
+
+    if os.path.isfile(f"{table_path}.csv"):
+        return f"read_csv_auto({quote_literal(table_path + '.csv')}, header = true)"
+
+    raise NoTableDataFile(table_name, data_path)
+
+
+def create_table_views_queries(table_names: list[str], data_path: str) -> list[str]:
+    """
+    Creates queries that make cube tables available under names from .toml files
+    Every database of the cube is attached as in-memory catalog, every table is a view over its file,
+    so queries of select builder run without changes
+    :param table_names: table names as in .toml files
+    :param data_path: directory with files of cube tables
+    :raises NoTableDataFile: if there is no file for one of tables
+    :return: list of sql queries
+    """
+    databases: list[str] = []
+    schemas: list[str] = []
+    views: list[str] = []
+
+    for table_name in table_names:
+        parts: list[str] = [quote_identifier(part) for part in table_name.split(".")]
+
+        if (len(parts) == 3) and (parts[0] not in databases):
+            databases.append(parts[0])
+
+        if ".".join(parts[:-1]) not in schemas:
+            schemas.append(".".join(parts[:-1]))
+
+        views.append(f"CREATE OR REPLACE VIEW {'.'.join(parts)} AS SELECT * FROM "
+                     f"{find_table_source(table_name, data_path)}")
+
+    return [f"ATTACH IF NOT EXISTS ':memory:' AS {database}" for database in databases] + \
+        [f"CREATE SCHEMA IF NOT EXISTS {schema}" for schema in schemas] + views
+
+
+def create_duckdb_engine(table_names: list[str], data_path: str, pool_options: dict) -> Engine:
+    """
+    Creates engine of in-memory DuckDB connections. Every new connection gets views over files of cube tables
+    Views are created when engine is created, so missing files are found before cube is added to collection
+    :param table_names: table names as in .toml files
+    :param data_path: directory with files of cube tables
+    :param pool_options: pool options of create_engine, as for database servers
+
+    :raises NoDuckDBSupport: if duckdb is not installed
+    :raises NoTableDataFile: if there is no file for one of tables
+
+    :return: sqlalchemy Engine
+    """
+    check_duckdb_support()
+
+    queries: list[str] = create_table_views_queries(table_names, data_path)
+
+    # duckdb-engine uses SingletonThreadPool for in-memory database, requests need pool of connections
+    engine: Engine = create_engine(f"{DUCKDB_ENGINE_NAME}:///:memory:", poolclass=QueuePool, **pool_options)
+
+    @event.listens_for(engine, "connect")
+    def create_table_views(dbapi_connection: Any, connection_record: Any) -> None:
+        for query in queries:
+            dbapi_connection.execute(query)
+
+    return engine
+
+
+class OptimizerDuckDB(PostgresQueryMixin, OptimizerAbstract):
+    """
+    Optimizer for embedded DuckDB over Parquet/CSV files
+    Query choice, pages and counts are shared with postgres optimizers, dialect-specific queries are overridden
+    DuckDB has no planner costs, so query is always chosen by number of not selected fields and table rows
+    """
+
+    def __init__(self, max_connections: int, engine: Engine,
+                 row_count_strategy: RowCountStrategy = RowCountStrategy.EXACT,
+                 statement_timeout: int | None = None):
+        check_duckdb_support()
+        super().__init__(max_connections, engine, row_count_strategy, statement_timeout)
+
+    @traced("select_best_query")
+    def select_best_query(self, cube_name: str, select_collection: SelectCollection) -> str:
+        """
+        Select best query from SelectCollection
+        Query with the least amount of not selected fields is chosen, ties are resolved by rows of table
+        :param cube_name: name of the cube
+        :param select_collection: all possible queries
+        :return: select string
+        """
+        candidates: list[tuple[str, str, int]] = self.get_query_candidates(select_collection)
+        set_span_attributes({"query.candidates": len(candidates), "query.cost_based": False})
+
+        return self.choose_query_by_fields(candidates) or ""
+
+    @traced("select_best_query")
+    def select_best_filter_query(self, select_filter: SelectFilter) -> str:
+        """
+        Choose best filter query
+        Candidates are chosen the same way as in select_best_query
+        :param select_filter:
+
+        :raises NoQuery: if there are no candidates
+
+        :return: sql-query
+        """
+        candidates: list[tuple[str, str, int]] = self.get_filter_query_candidates(select_filter)
+        set_span_attributes({"query.candidates": len(candidates), "query.cost_based": False})
+
+        query: str | None = self.choose_query_by_fields(candidates)
+
+        if query is None:
+            raise NoQuery
+
+        return query
+
+    @staticmethod
+    def get_estimated_rows(value: Any) -> int | None:
+        """
+        Returns estimated cardinality of top plan node of EXPLAIN (FORMAT JSON)
+        :param value: second column of the first row of explain query
+        :return: number of rows or None if plan has no estimate
+        """
+        plan: list = json.loads(value) if isinstance(value, str) else value
+        estimate: Any = plan[0].get("extra_info", {}).get("Estimated Cardinality")
+
+        return None if estimate is None else int(estimate)
+
+    def select_page_from_olap(self, sql: str, page_no: int, items_per_page: int,
+                              order_by_keys: list[str] | None = None, last_key: list | None = None) -> Result:
+        """
+        Select one page from olap
+        If :param order_by_keys: and :param last_key: are provided, page is selected with keyset pagination
+        Otherwise pager with offset and limit is used
+        :param sql: sql query
+        :param page_no: page we want to download
+        :param items_per_page: how many items per page
+        :param order_by_keys: column aliases that define unique order of rows
+        :param last_key: values of :param order_by_keys: of the last row on previous page
+        :return: buffered Result of query
+        """
+
+        query: TextClause = self.create_page_query(sql, page_no, items_per_page, order_by_keys, last_key)
+
+        return self.run_select_query_to_olap_db(query)
+
+    def stream_query(self, sql: str, rows_per_chunk: int) -> Iterator[tuple[list[str], Sequence[Row]]]:
+        """
+        Streams complete result of query. DuckDB fetches result by chunks itself
+        Only :param rows_per_chunk: rows are kept in memory at once
+        Connection and admission slot are held until iterator is exhausted or closed
+        :param sql: sql query
+        :param rows_per_chunk: number of rows fetched at once
+        :return: iterator of column names and chunk of rows
+        """
+
+        engine: Engine = self.get_engine()
+
+        with self.get_admission_controller().admit():
+            with engine.connect() as connect, self.__interruptible(connect):
+                result = connect.execution_options(yield_per=rows_per_chunk).execute(text(sql))
+                columns: list[str] = list(result.keys())
+                is_empty: bool = True
+
+                for partition in result.partitions(rows_per_chunk):
+                    is_empty = False
+                    yield columns, partition
+
+                # Columns are still needed to create header or schema
+                if is_empty:
+                    yield columns, []
+
+    @traced("count_rows")
+    def count_rows(self, sql: str, max_rows_no: int = 1_000_000) -> tuple[int, bool, bool]:
+        """
+        Count rows in select with row count strategy of optimizer.
+        Estimate is taken from cardinality of DuckDB plan
+        If query returned more rows than :param max_rows_no:, return false. Else true
+        :param max_rows_no: Max number of rows that query should return
+        :param sql: query
+        :return:
+                [0] number of rows
+                [1] true if number of rows is not more than max_rows_no
+                [2] true if number of rows is exact, false if it is estimated
+        """
+
+        row_count_strategy: RowCountStrategy = self.get_row_count_strategy()
+        rows_no: int | None = None
+        is_rows_no_exact: bool = False
+
+        with stage_timer("count_rows"):
+            if row_count_strategy == RowCountStrategy.ESTIMATE:
+                rows_no = self.get_estimated_rows(
+                    self.run_select_query_to_olap_db(self.create_explain_query(sql)).fetchone()[1])
+
+            # Plan of some queries has no estimate. Estimate over the limit is confirmed by bounded count,
+            # planner could overestimate small queries
+            if (rows_no is None) or (rows_no > max_rows_no):
+                strategy: RowCountStrategy = RowCountStrategy.EXACT if row_count_strategy == RowCountStrategy.EXACT \
+                    else RowCountStrategy.BOUNDED
+                rows_no = int(self.run_select_query_to_olap_db(self.create_count_query(sql, strategy, max_rows_no))
+                              .fetchone()[0])
+                is_rows_no_exact = True
+
+        set_span_attributes({"query.rows": rows_no, "query.rows_exact": is_rows_no_exact,
+                             "query.row_count_strategy": row_count_strategy.value})
+
+        return rows_no, rows_no <= max_rows_no, is_rows_no_exact
+
+    def refresh_table_statistics(self, table_names: list[str]) -> None:
+        """
+        Reads estimated number of rows of every table from DuckDB plan and replaces table statistics catalog
+        Rows of Parquet files are read from their metadata, rows of CSV files are estimated by file size
+        :param table_names: names of all tables of the cube
+        :return: None
+        """
+        tables: dict[str, TableStatistics] = {}
+
+        for table_name in table_names:
+            explain_query: str = self.create_explain_query(f"select * from {table_name}")
+            rows_no: int | None = self.get_estimated_rows(self.run_select_query_to_olap_db(explain_query)
+                                                          .fetchone()[1])
+            tables[table_name] = TableStatistics(table_name=table_name, rows_no=rows_no)
+
+        self.get_table_statistics().update(tables)
+
+    def refresh_materialized_view(self, view: MaterializedView, recreate: bool) -> bool:
+        """
+        DuckDB has no materialized views, aggregates of DuckDB cubes should be stored as files
+        :param view: MaterializedView
+        :param recreate: drop view first, its query has changed
+        :raises WrongMaterializedView: always
+        :return: None
+        """
+        raise WrongMaterializedView(view.table_name, "DuckDB has no materialized views")
+
+    def select_dimension(self, select_filter: SelectFilter) -> Result:
+        """
+        Selects data from db with unique values for dimension
+        :param select_filter:
+        :return:
+        """
+
+        query: str = self.select_best_filter_query(select_filter)
+
+        return self.run_select_query_to_olap_db(query)
+
+    def run_select_query_to_olap_db(self, query: str | TextClause) -> Result:
+        """
+        Run select sql-query to DuckDB
+        :param query: sql-query
+        :return: buffered Result, it could be fetched after connection is closed
+        """
+
+        engine: Engine = self.get_engine()
+
+        if isinstance(query, str):
+            query = text(query)
+
+        with self.get_admission_controller().admit():
+            with engine.connect() as connect, self.__interruptible(connect):
+                # DuckDB fetches rows lazily and closes result together with connection, so rows are buffered
+                returned_data: Result = connect.execute(query).freeze()()
+
+        return returned_data
+
+    @contextlib.contextmanager
+    def __interruptible(self, connect: Connection) -> Iterator[None]:
+        """
+        Interrupts query of connection after statement timeout of request and lets request cancel it
+        DuckDB has no statement timeout, so timer thread interrupts connection
+        Interrupted queries are counted and raised as QueryCancelled or QueryTimeout
+        :param connect: opened Connection
+        :raises QueryCancelled: if client has disconnected
+        :raises QueryTimeout: if query has run longer than statement timeout
+        :return: None
+        """
+        statement_timeout: int = self.get_statement_timeout()
+        timer: threading.Timer | None = None
+
+        if statement_timeout > 0:
+            timer = threading.Timer(statement_timeout, connect.connection.driver_connection.interrupt)
+            timer.daemon = True
+            timer.start()
+
+        try:
+            with cancellable_connection(connect, "interrupt"):
+                yield
+        except DBAPIError as error:
+            if not isinstance(error.orig, duckdb.InterruptException):
+                raise
+
+            handle: QueryCancelHandle | None = query_cancel_handle.get()
+
+            if (handle is not None) and handle.is_cancelled():
+                self.get_query_interruptions().add_cancelled()
+                raise QueryCancelled() from error
+
+            self.get_query_interruptions().add_timed_out()
+            raise QueryTimeout() from error
+        finally:
+            if timer is not None:
+                timer.cancel()
@@ -2,9 +2,13 @@ from typing import Hashable, Callable
 
 from comradewolf.universe.olap_language_select_builders import OlapPostgresSelectBuilder
 from sqlalchemy import Engine
+from sqlalchemy.ext.asyncio import AsyncEngine
 
+from core.config import Settings
 from core.utils.exceptions import ClassNotFoundError
+from service.optimizer_duckdb import OptimizerDuckDB, DUCKDB_ENGINE_NAME, get_duckdb_config
 from service.optimizer_postgres import OptimizerPostgres
+from service.optimizer_postgres_async import OptimizerPostgresAsync
 
 
 class OptimizerFactory:
@@ -12,7 +16,7 @@ class OptimizerFactory:
     Factory for different engine optimizers
     """
     @staticmethod
-    def get(engine_name: str, max_connections: int, engine: Engine, **kwargs):
+    def get(engine_name: str, max_connections: int, engine: Engine | AsyncEngine, **kwargs):
         """
 
         :param engine:
@@ -24,6 +28,8 @@ class OptimizerFactory:
 
         classes: dict[Hashable, Callable[..., object]] = {
             "postgresql+psycopg2": OptimizerPostgres,
+            "postgresql+asyncpg": OptimizerPostgresAsync,
+            DUCKDB_ENGINE_NAME: OptimizerDuckDB,
         }
 
         class_ = classes.get(engine_name, None)
@@ -32,6 +38,39 @@ class OptimizerFactory:
 
         raise ClassNotFoundError(engine_name)
 
+    @staticmethod
+    def is_async(engine_name: str) -> bool:
+        """
+        Checks if optimizer for engine needs AsyncEngine
+        :param engine_name: engine name from olap_table
+        :return: True if engine driver is async
+        """
+        async_engines: list[str] = ["postgresql+asyncpg"]
+
+        return engine_name in async_engines
+
+    @staticmethod
+    def get_connect_args(engine_name: str, connect_timeout: int) -> dict:
+        """
+        Creates driver-specific arguments of new connection
+        :param engine_name: engine name from olap_table
+        :param connect_timeout: seconds to wait for new connection
+        :return: connect_args for create_engine
+        """
+        # Embedded database has no connection timeout, but has its own settings of threads and memory
+        if engine_name == DUCKDB_ENGINE_NAME:
+            return {"config": get_duckdb_config(Settings())}
+
+        connect_timeout_args: dict[str, str] = {
+            "postgresql+psycopg2": "connect_timeout",
+            "postgresql+asyncpg": "timeout",
+        }
+
+        if engine_name not in connect_timeout_args:
+            return {}
+
+        return {connect_timeout_args[engine_name]: connect_timeout}
+
 
 class SelectBuilderFactory:
     @staticmethod
@@ -40,6 +79,9 @@ class SelectBuilderFactory:
 
         classes: dict[Hashable, Callable[..., object]] = {
             "postgresql+psycopg2": OlapPostgresSelectBuilder,
+            "postgresql+asyncpg": OlapPostgresSelectBuilder,
+            # Generated ANSI SQL runs in DuckDB as is, string literals of filters are cast to column types
+            DUCKDB_ENGINE_NAME: OlapPostgresSelectBuilder,
         }
 
         class_ = classes.get(engine_name, None)
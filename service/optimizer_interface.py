@@ -1,29 +1,103 @@
+import contextlib
 from abc import ABC, abstractmethod
-from threading import Semaphore
+from typing import Iterator, AsyncIterator
 
 from comradewolf.utils.olap_data_types import SelectCollection, SelectFilter
-from sqlalchemy import Engine, CursorResult, Sequence
+from sqlalchemy import Engine, CursorResult, Sequence, Row, QueuePool
+from sqlalchemy.ext.asyncio import AsyncEngine
 
 from core.config import Settings
-from model.dto import QueryMetaData
+from model.dto import QueryMetaData, RowCountStrategy, RequestPriority, MaterializedView
+from service.admission import AdmissionController, admission_priority
+from service.materialized_views import MaterializedViewCatalog
+from service.query_cancel import QueryInterruptionCounters
+from service.plan_cost_cache import PlanCostCache
+from service.table_statistics import TableStatisticsCatalog
 
 
-class OptimizerAbstract(ABC):
+def get_pool_size(engine: Engine) -> int:
+    """
+    Returns size of engine connection pool
+    :param engine: sqlalchemy.Engine
+    :return: pool size or 0 if pool does not keep connections
+    """
+    if isinstance(engine.pool, QueuePool):
+        return engine.pool.size()
 
-    __connections_semaphore: Semaphore
-    __engine: Engine
+    return 0
+
+
+def create_admission_controller(max_connections: int, settings: Settings) -> AdmissionController:
+    """
+    Creates admission controller of optimizer with limits from settings
+    :param max_connections: parallel connections to database
+    :param settings: Settings
+    :return: AdmissionController
+    """
+    return AdmissionController(max_connections=max_connections,
+                               max_per_user=int(max_connections * settings.ADMISSION_USER_SHARE),
+                               max_bulk=int(max_connections * settings.ADMISSION_BULK_SHARE),
+                               max_queue=settings.ADMISSION_MAX_QUEUE,
+                               queue_timeout=settings.ADMISSION_QUEUE_TIMEOUT)
+
+
+def get_request_statement_timeout(cube_statement_timeout: int, settings: Settings) -> int:
+    """
+    Returns statement timeout of current request: the least of cube timeout and timeout of request priority
+    :param cube_statement_timeout: timeout of the cube in seconds, 0 if cube has no timeout
+    :param settings: Settings
+    :return: timeout in seconds, 0 if query could run as long as it needs
+    """
+    priority_timeouts: dict[RequestPriority, int] = {
+        RequestPriority.INTERACTIVE: settings.INTERACTIVE_STATEMENT_TIMEOUT,
+        RequestPriority.BULK: settings.BULK_STATEMENT_TIMEOUT,
+    }
+
+    timeouts: list[int] = [timeout for timeout in [cube_statement_timeout, priority_timeouts[admission_priority.get()]]
+                           if timeout > 0]
+
+    return min(timeouts) if len(timeouts) > 0 else 0
+
+
+class OptimizerBase(ABC):
+    """
+    State and settings shared by sync and async optimizers
+    """
+
+    __admission_controller: AdmissionController
+    __engine: Engine | AsyncEngine
     __settings: Settings
+    __row_count_strategy: RowCountStrategy
+    __max_connections: int
+    __plan_cost_cache: PlanCostCache
+    __table_statistics: TableStatisticsCatalog
+    __statement_timeout: int
+    __query_interruptions: QueryInterruptionCounters
+    __materialized_views: MaterializedViewCatalog
 
-    def __init__(self, max_connections: int, engine: Engine) -> None:
+    def __init__(self, max_connections: int, engine: Engine | AsyncEngine,
+                 row_count_strategy: RowCountStrategy = RowCountStrategy.EXACT,
+                 statement_timeout: int | None = None) -> None:
         """
         Creates optimizer with maximum parallel connections to database
         :param max_connections:
-        :param engine:
+        :param engine: sqlalchemy.Engine or AsyncEngine
+        :param row_count_strategy: how rows of query are counted
+        :param statement_timeout: seconds query of the cube could run. None for STATEMENT_TIMEOUT, 0 for no limit
         """
 
-        self.__connections_semaphore = Semaphore(value=max_connections)
         self.__engine = engine
         self.__settings = Settings()
+        self.__admission_controller = create_admission_controller(max_connections, self.__settings)
+        self.__row_count_strategy = row_count_strategy
+        self.__max_connections = max_connections
+        self.__plan_cost_cache = PlanCostCache(self.__settings.PLAN_COST_CACHE_SIZE,
+                                               self.__settings.PLAN_COST_CACHE_TTL)
+        self.__table_statistics = TableStatisticsCatalog()
+        self.__statement_timeout = self.__settings.STATEMENT_TIMEOUT if statement_timeout is None \
+            else statement_timeout
+        self.__query_interruptions = QueryInterruptionCounters()
+        self.__materialized_views = MaterializedViewCatalog()
 
     def get_max_rows(self) -> int:
         """
@@ -39,27 +113,107 @@ class OptimizerAbstract(ABC):
         """
         return self.__settings.ROWS_PER_PAGE
 
+    def get_row_count_strategy(self) -> RowCountStrategy:
+        """
+        Returns how rows of query are counted
+        :return:
+        """
+        return self.__row_count_strategy
+
+    def get_max_connections(self) -> int:
+        """
+        Returns maximum parallel connections to database
+        :return:
+        """
+        return self.__max_connections
+
+    def is_cost_based_selection(self) -> bool:
+        """
+        Returns true if best query is chosen by planner cost, false if by number of not selected fields
+        :return:
+        """
+        return self.__settings.COST_BASED_QUERY_SELECTION
+
+    def get_plan_cost_cache(self) -> PlanCostCache:
+        """
+        Returns cache of planner costs of candidate queries
+        :return:
+        """
+        return self.__plan_cost_cache
+
+    def get_table_statistics(self) -> TableStatisticsCatalog:
+        """
+        Returns statistics of cube tables. It is refreshed in background by refresh_table_statistics
+        :return:
+        """
+        return self.__table_statistics
+
+    def get_statement_timeout(self) -> int:
+        """
+        Returns statement timeout of current request in seconds, 0 if there is no limit
+        :return:
+        """
+        return get_request_statement_timeout(self.__statement_timeout, self.__settings)
 
-    def __get_connections_semaphore_value(self):
-        print(self.__connections_semaphore.__repr__())
-        return self.__connections_semaphore.__repr__()
+    def get_query_interruptions(self) -> QueryInterruptionCounters:
+        """
+        Returns counters of cancelled and timed out queries
+        :return:
+        """
+        return self.__query_interruptions
 
-    def get_engine(self) -> Engine:
+    def get_materialized_views(self) -> MaterializedViewCatalog:
         """
-        Returns sqlalchemy.Engine
+        Returns materialized views of the cube and their refresh state
+        :return:
+        """
+        return self.__materialized_views
+
+    def get_admission_controller(self) -> AdmissionController:
+        """
+        Returns controller that limits parallel connections to database
+        :return:
+        """
+        return self.__admission_controller
+
+    def get_engine(self) -> Engine | AsyncEngine:
+        """
+        Returns sqlalchemy.Engine of sync optimizer or AsyncEngine of async optimizer
         :return:
         """
         return self.__engine
 
+
+class OptimizerAbstract(OptimizerBase):
+
+    def dispose(self) -> None:
+        """
+        Closes connections of engine. Optimizer should not be used after it
+        :return: None
+        """
+        self.get_engine().dispose()
+
+    def prewarm_pool(self, connections: int) -> None:
+        """
+        Opens connections in advance and returns them to pool, so first requests do not wait for them
+        :param connections: number of connections. Not more than pool size
+        :return: None
+        """
+        with contextlib.ExitStack() as opened_connections:
+            for _ in range(min(connections, get_pool_size(self.get_engine()))):
+                opened_connections.enter_context(self.get_engine().connect())
+
     @abstractmethod
-    def count_rows(self, sql: str, max_rows_no: int = 1_000_000) -> tuple[int, bool]:
+    def count_rows(self, sql: str, max_rows_no: int = 1_000_000) -> tuple[int, bool, bool]:
         """
-        Count rows in select. If query returned more rows than :param max_rows_no:, return false. Else true
+        Count rows in select with row count strategy of optimizer.
+        If query returned more rows than :param max_rows_no:, return false. Else true
         :param max_rows_no: Max number of rows that query should return
         :param sql: query
         :return:
                 [0] number of rows
-                [1] true if number of rows more than max_rows_no
+                [1] true if number of rows is not more than max_rows_no
+                [2] true if number of rows is exact, false if it is estimated
         """
         pass
 
@@ -84,16 +238,30 @@ class OptimizerAbstract(ABC):
         pass
 
     @abstractmethod
-    def select_page_from_olap(self, sql: str, page_no: int, items_per_page: int) -> CursorResult:
+    def select_page_from_olap(self, sql: str, page_no: int, items_per_page: int,
+                              order_by_keys: list[str] | None = None, last_key: list | None = None) -> CursorResult:
         """
         Select one page from olap
-        Should use pager with offset and limit
+        Should use pager with offset and limit, or keyset pagination if :param last_key: is known
         :param sql: sql query
         :param page_no: page we want to download
         :param items_per_page: how many items per page
+        :param order_by_keys: column aliases that define unique order of rows. None to use offset-limit only
+        :param last_key: values of :param order_by_keys: of the last row on previous page
         :return: Cursor result from query
         """
 
+    @abstractmethod
+    def stream_query(self, sql: str, rows_per_chunk: int) -> Iterator[tuple[list[str], Sequence[Row]]]:
+        """
+        Streams complete result of query using server-side cursor
+        Connection is held until iterator is exhausted or closed
+        :param sql: sql query
+        :param rows_per_chunk: number of rows fetched from cursor at once
+        :return: iterator of column names and chunk of rows
+        """
+        pass
+
     @abstractmethod
     def select_dimension(self, select_filter: SelectFilter) -> CursorResult:
         """
@@ -111,3 +279,144 @@ class OptimizerAbstract(ABC):
         :return: best select as str
         """
         pass
+
+    @abstractmethod
+    def refresh_table_statistics(self, table_names: list[str]) -> None:
+        """
+        Reads statistics of tables from database and replaces table statistics catalog
+        :param table_names: names of all tables of the cube
+        :return: None
+        """
+        pass
+
+    @abstractmethod
+    def refresh_materialized_view(self, view: MaterializedView, recreate: bool) -> bool:
+        """
+        Creates materialized view if it does not exist and refreshes it
+        :param view: MaterializedView
+        :param recreate: drop view first, its query has changed
+        :return: True if view was refreshed, False if other instance of application is refreshing it
+        """
+        pass
+
+
+class OptimizerAsyncAbstract(OptimizerBase):
+    """
+    Optimizer for async database drivers
+    Queries are awaited, so waiting for database does not hold worker thread
+    """
+
+    async def dispose(self) -> None:
+        """
+        Closes connections of engine. Optimizer should not be used after it
+        :return: None
+        """
+        await self.get_engine().dispose()
+
+    async def prewarm_pool(self, connections: int) -> None:
+        """
+        Opens connections in advance and returns them to pool, so first requests do not wait for them
+        :param connections: number of connections. Not more than pool size
+        :return: None
+        """
+        async with contextlib.AsyncExitStack() as opened_connections:
+            for _ in range(min(connections, get_pool_size(self.get_engine().sync_engine))):
+                await opened_connections.enter_async_context(self.get_engine().connect())
+
+    @abstractmethod
+    async def count_rows(self, sql: str, max_rows_no: int = 1_000_000) -> tuple[int, bool, bool]:
+        """
+        Count rows in select with row count strategy of optimizer.
+        If query returned more rows than :param max_rows_no:, return false. Else true
+        :param max_rows_no: Max number of rows that query should return
+        :param sql: query
+        :return:
+                [0] number of rows
+                [1] true if number of rows is not more than max_rows_no
+                [2] true if number of rows is exact, false if it is estimated
+        """
+        pass
+
+    @abstractmethod
+    async def get_query_meta_data(self, cube_name: str, select_collection: SelectCollection) -> QueryMetaData:
+        """
+        Get all metadata for a query
+        :param cube_name: name of the cube
+        :param select_collection: all possible queries
+        :return: QueryMetaData
+        """
+        pass
+
+    @abstractmethod
+    async def select_best_query(self, cube_name: str, select_collection: SelectCollection) -> str:
+        """
+        Select best query from SelectCollection
+        :param cube_name: name of the cube
+        :param select_collection: all possible queries
+        :return: select string
+        """
+        pass
+
+    @abstractmethod
+    async def select_page_from_olap(self, sql: str, page_no: int, items_per_page: int,
+                                    order_by_keys: list[str] | None = None,
+                                    last_key: list | None = None) -> CursorResult:
+        """
+        Select one page from olap
+        Should use pager with offset and limit, or keyset pagination if :param last_key: is known
+        :param sql: sql query
+        :param page_no: page we want to download
+        :param items_per_page: how many items per page
+        :param order_by_keys: column aliases that define unique order of rows. None to use offset-limit only
+        :param last_key: values of :param order_by_keys: of the last row on previous page
+        :return: buffered Cursor result from query
+        """
+        pass
+
+    @abstractmethod
+    def stream_query(self, sql: str, rows_per_chunk: int) -> AsyncIterator[tuple[list[str], Sequence[Row]]]:
+        """
+        Streams complete result of query using server-side cursor
+        Connection is held until iterator is exhausted or closed
+        :param sql: sql query
+        :param rows_per_chunk: number of rows fetched from cursor at once
+        :return: async iterator of column names and chunk of rows
+        """
+        pass
+
+    @abstractmethod
+    async def select_dimension(self, select_filter: SelectFilter) -> CursorResult:
+        """
+        Selects data from db with unique values for dimension
+        :param select_filter: SelectFilter from frontend
+        :return: buffered Cursor result from query
+        """
+        pass
+
+    @abstractmethod
+    async def select_best_filter_query(self, select_filter: SelectFilter) -> str:
+        """
+        Choose best filter query
+        :param select_filter: SelectFilter from frontend
+        :return: best select as str
+        """
+        pass
+
+    @abstractmethod
+    async def refresh_table_statistics(self, table_names: list[str]) -> None:
+        """
+        Reads statistics of tables from database and replaces table statistics catalog
+        :param table_names: names of all tables of the cube
+        :return: None
+        """
+        pass
+
+    @abstractmethod
+    async def refresh_materialized_view(self, view: MaterializedView, recreate: bool) -> bool:
+        """
+        Creates materialized view if it does not exist and refreshes it
+        :param view: MaterializedView
+        :param recreate: drop view first, its query has changed
+        :return: True if view was refreshed, False if other instance of application is refreshing it
+        """
+        pass
@@ -1,41 +1,71 @@
+import contextlib
+import contextvars
+import json
+import logging
 import math
-import time
-from threading import Semaphore
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import Iterator, Any
 
 from comradewolf.utils.olap_data_types import SelectCollection, SelectFilter
-from sqlalchemy import Engine, text, CursorResult
+from sqlalchemy import Engine, text, CursorResult, Sequence, Row, TextClause, BindParameter, bindparam, \
+    String, Connection
+from sqlalchemy.exc import DBAPIError
 
 from core.config import Settings
-from core.utils.exceptions import NoQuery, TooManyRows
-from model.dto import QueryMetaData
+from core.utils.exceptions import NoQuery, TooManyRows, QueryCancelled, QueryTimeout
+from model.dto import QueryMetaData, RowCountStrategy, TableStatistics, ColumnStatistics, MaterializedView
 from service.optimizer_interface import OptimizerAbstract
+from service.materialized_views import MaterializedViewCatalog, create_materialized_view_queries, \
+    create_materialized_view_lock_query, create_materialized_view_populated_query, \
+    create_materialized_view_refresh_queries
+from service.metrics import stage_timer
+from service.tracing import traced, set_span_attributes
+from service.plan_cost_cache import PlanCostCache
+from service.query_cancel import cancellable_connection, query_cancel_handle, QueryCancelHandle
+from service.table_statistics import TableStatisticsCatalog
+from service.sql_utils import get_sql_fingerprint
 
+logger = logging.getLogger(__name__)
 
-class OptimizerPostgres(OptimizerAbstract):
-    __connections_semaphore: Semaphore
-    __engine: Engine
-    __settings: Settings
 
-    def __init__(self, max_connections: int, engine: Engine):
-        super().__init__(max_connections, engine)
-        self.__connections_semaphore = Semaphore(value=max_connections)
-        self.__engine = engine
-        self.__settings = Settings()
+class PostgresQueryMixin:
+    """
+    Query choice and query text shared by sync and async postgres optimizers
+    Should be mixed before optimizer base class
+    """
 
     def get_query_meta_data(self, cube_name: str, select_collection: SelectCollection) -> QueryMetaData:
         """
         Select best query and check we can return it
+        Used by sync optimizers, async one overrides it
         :param cube_name: Name of the qube
         :param select_collection: collection of possible queries
         :return: query_meta_data - query, number of rows and pages
         """
         rows_no: int
         is_ok_to_download_data: bool
+        is_rows_no_exact: bool
 
         sql_query: str = self.select_best_query(cube_name, select_collection)
 
-        rows_no, is_ok_to_download_data = self.count_rows(sql_query, self.get_max_rows())
+        rows_no, is_ok_to_download_data, is_rows_no_exact = self.count_rows(sql_query, self.get_max_rows())
+
+        return self.create_query_meta_data(cube_name, sql_query, rows_no, is_ok_to_download_data, is_rows_no_exact)
 
+    def create_query_meta_data(self, cube_name: str, sql_query: str, rows_no: int,
+                               is_ok_to_download_data: bool, is_rows_no_exact: bool = True) -> QueryMetaData:
+        """
+        Creates QueryMetaData for counted query
+        :param cube_name: Name of the qube
+        :param sql_query: chosen query
+        :param rows_no: number of rows in query
+        :param is_ok_to_download_data: false if query returns too many rows
+        :param is_rows_no_exact: false if rows_no is estimated
+
+        :raises TooManyRows: if query returns too many rows
+
+        :return: query_meta_data - query, number of rows and pages
+        """
         if not is_ok_to_download_data:
             raise TooManyRows()
 
@@ -43,89 +73,528 @@ class OptimizerPostgres(OptimizerAbstract):
         pages: int = math.ceil(rows_no / items_per_page)
 
         query_meta_data = QueryMetaData(sql_query=sql_query, rows_no=rows_no, pages=pages,
-                                        items_per_page=items_per_page, cube_name=cube_name)
+                                        items_per_page=items_per_page, cube_name=cube_name,
+                                        is_rows_no_exact=is_rows_no_exact)
 
         return query_meta_data
 
+    @staticmethod
+    def create_count_query(sql: str, row_count_strategy: RowCountStrategy = RowCountStrategy.EXACT,
+                           max_rows_no: int = 1_000_000) -> str:
+        """
+        Wraps query to count its rows
+        Bounded count stops after :param max_rows_no: + 1 rows, it is enough to know that query is too big
+        Estimate asks planner, query itself is not executed
+        :param sql: sql query
+        :param row_count_strategy: how rows are counted
+        :param max_rows_no: Max number of rows that query should return
+        :return: sql query
+        """
+        if row_count_strategy == RowCountStrategy.ESTIMATE:
+            return PostgresQueryMixin.create_explain_query(sql)
+
+        if row_count_strategy == RowCountStrategy.BOUNDED:
+            return f"select count(*) as count_rows from (select 1 from ({sql}) as q limit {max_rows_no + 1}) as q"
+
+        return f"select count(*) as count_rows from ({sql}) as q"
 
-    def select_page_from_olap(self, sql: str, page_no: int, items_per_page: int) -> CursorResult:
+    @staticmethod
+    def parse_count_result(value: Any, row_count_strategy: RowCountStrategy,
+                           max_rows_no: int) -> tuple[int, bool, bool]:
         """
-        Select one page from olap
-        Should use pager with offset and limit
+        Converts result of count query
+        :param value: first column of the first row of count query
+        :param row_count_strategy: how rows were counted
+        :param max_rows_no: Max number of rows that query should return
+        :return:
+                [0] number of rows
+                [1] true if number of rows is not more than max_rows_no
+                [2] true if number of rows is exact, false if it is estimated
+        """
+        rows_no: int
+        is_rows_no_exact: bool = True
+
+        if row_count_strategy == RowCountStrategy.ESTIMATE:
+            rows_no = int(PostgresQueryMixin.get_plan(value)["Plan Rows"])
+            is_rows_no_exact = False
+        else:
+            rows_no = int(value)
+
+        return rows_no, rows_no <= max_rows_no, is_rows_no_exact
+
+    @staticmethod
+    def create_page_query(sql: str, page_no: int, items_per_page: int, order_by_keys: list[str] | None,
+                          last_key: list | None) -> TextClause:
+        """
+        Creates query to select one page
+        If :param order_by_keys: are provided, query is wrapped and ordered by them, NULLs last
+        Seeks with create_keyset_condition if :param last_key: is known, otherwise falls back to offset
         :param sql: sql query
         :param page_no: page we want to download
         :param items_per_page: how many items per page
-        :return: Cursor result from query
+        :param order_by_keys: column aliases that define unique order of rows
+        :param last_key: values of :param order_by_keys: of the last row on previous page
+        :return: query ready to execute
         """
-
         offset: int = page_no * items_per_page
 
-        sql_query = f"{sql} \noffset {offset} limit {items_per_page}"
+        if (order_by_keys is None) or (len(order_by_keys) == 0):
+            return text(f"{sql} \noffset {offset} limit {items_per_page}")
 
-        engine: Engine = self.get_engine()
+        quoted_keys: list[str] = ['"{}"'.format(key.replace('"', '""')) for key in order_by_keys]
+        order_by_string: str = ", ".join([f"{key} nulls last" for key in quoted_keys])
 
-        self.__connections_semaphore.acquire()
-        # print("SEM_START", self.__connections_semaphore)
-        try:
-            with engine.connect() as connect:
-                result = connect.execute(text(sql_query))
-        finally:
-            # i = 5
-            # while i > 0:
-            #     i = i - 1
-            #     time.sleep(1)
-            #     print(i)
-            # print("SEM_FINISH", self.__connections_semaphore)
-            self.__connections_semaphore.release()
+        if last_key is None:
+            return text(f"select * from ({sql}) as q \norder by {order_by_string} "
+                        f"\noffset {offset} limit {items_per_page}")
+
+        condition, parameters = PostgresQueryMixin.create_keyset_condition(quoted_keys, last_key)
+
+        return text(f"select * from ({sql}) as q \nwhere {condition} "
+                    f"\norder by {order_by_string} \nlimit {items_per_page}").bindparams(*parameters)
+
+    @staticmethod
+    def create_keyset_condition(quoted_keys: list[str], last_key: list) -> tuple[str, list[BindParameter]]:
+        """
+        Creates condition for rows that come after :param last_key: in order by keys with NULLs last
+        Row comparison (k1, k2) > (v1, v2) is NULL for rows with NULL keys and would lose them, so condition is expanded:
+            (k1 > v1 or k1 is null) or (k1 = v1 and (k2 > v2 or k2 is null)) or ...
+        Key that is NULL has nothing after it, it takes part only in equality: k1 is null
+        Keys are rendered as untyped literals, so database casts them to column types by itself
+        (keys are saved as json and some types, like date or numeric, come back as strings)
+        :param quoted_keys: quoted column aliases
+        :param last_key: values of keys of the last row on previous page
+        :return: condition and its parameters
+        """
+        parameters: list[BindParameter] = []
+        equal_conditions: list[str] = []
+        conditions: list[str] = []
+
+        for i, (quoted_key, value) in enumerate(zip(quoted_keys, last_key)):
+            if value is None:
+                equal_conditions.append(f"{quoted_key} is null")
+                continue
+
+            parameters.append(bindparam(f"key_{i}", str(value), type_=String, literal_execute=True))
+            parts: list[str] = equal_conditions + [f"({quoted_key} > :key_{i} or {quoted_key} is null)"]
+            conditions.append(parts[0] if len(parts) == 1 else "(" + " and ".join(parts) + ")")
+            equal_conditions.append(f"{quoted_key} = :key_{i}")
+
+        if len(conditions) == 0:
+            return "false", []
+
+        return " or ".join(conditions), parameters
+
+    def get_query_candidates(self, select_collection: SelectCollection) -> list[tuple[str, str, int]]:
+        """
+        Lists candidate queries of SelectCollection
+        Materialized views that are stale or were not refreshed yet are skipped
+        :param select_collection: all possible queries
+        :return: list of table name, sql and number of not selected fields
+        """
+        materialized_views: MaterializedViewCatalog = self.get_materialized_views()
+
+        return [(table, select_collection.get_sql(table), select_collection.get_not_selected_fields_no(table))
+                for table in select_collection if materialized_views.is_available(table)]
+
+    def get_filter_query_candidates(self, select_filter: SelectFilter) -> list[tuple[str, str, int]]:
+        """
+        Lists candidate queries of SelectFilter
+        Materialized views that are stale or were not refreshed yet are skipped
+        :param select_filter: all possible filter queries
+        :return: list of table name, sql and number of not selected fields
+        """
+        materialized_views: MaterializedViewCatalog = self.get_materialized_views()
+
+        return [(table, select_filter.get_sql(table), select_filter.get_not_selected_fields(table))
+                for table in select_filter if materialized_views.is_available(table)]
+
+    def choose_query_by_fields(self, candidates: list[tuple[str, str, int]]) -> str | None:
+        """
+        Query with the least amount of not selected fields
+        Ties are resolved by number of rows in table from statistics catalog, then by order of candidates
+        :param candidates: list of table name, sql and number of not selected fields
+        :return: sql or None if there are no candidates
+        """
+        if len(candidates) == 0:
+            return None
+
+        table_statistics: TableStatisticsCatalog = self.get_table_statistics()
+
+        ranks: list[tuple[int, float, int]] = []
+
+        for position, (table, sql, not_selected_fields_no) in enumerate(candidates):
+            rows_no: int | None = table_statistics.get_rows_no(table)
+            ranks.append((not_selected_fields_no, math.inf if rows_no is None else rows_no, position))
+
+        return candidates[min(ranks)[2]][1]
+
+    def choose_query_by_cost(self, label: str, candidates: list[tuple[str, str, int]],
+                             costs: list[float | None]) -> str | None:
+        """
+        Query with the least planner cost. Ties are resolved by number of not selected fields
+        Falls back to number of not selected fields if no query could be explained
+        :param label: name of the cube or kind of query, used in logs
+        :param candidates: list of table name, sql and number of not selected fields
+        :param costs: total costs of candidates. None if query could not be explained
+        :return: sql or None if there are no candidates
+        """
+        explained: list[tuple[float, int, int]] = [(cost, not_selected_fields_no, position)
+                                                   for position, ((table, sql, not_selected_fields_no), cost)
+                                                   in enumerate(zip(candidates, costs)) if cost is not None]
+
+        if len(explained) == 0:
+            return self.choose_query_by_fields(candidates)
+
+        cost, not_selected_fields_no, position = min(explained)
+        query: str = candidates[position][1]
+
+        logger.info("%s: chose query %s with total cost %s out of %s candidates, costs: %s",
+                    label, get_sql_fingerprint(query)[:12], cost, len(candidates), costs)
+        logger.debug("%s: chosen query:\n%s", label, query)
+
+        return query
+
+    @staticmethod
+    def create_table_statistics_queries(table_names: list[str]) -> tuple[TextClause, TextClause]:
+        """
+        Creates queries to read statistics of tables from postgres catalog
+        Table names are expected as in cube structure: database.schema.table or schema.table
+        :param table_names: names of tables
+        :return: query for number of rows and sizes of tables, query for column statistics
+        """
+        schema_table_names: list[str] = [".".join(table_name.split(".")[-2:]) for table_name in table_names]
+
+        tables_query: TextClause = text("""
+            select n.nspname || '.' || c.relname as schema_table_name,
+                   c.reltuples::bigint as rows_no,
+                   pg_catalog.pg_total_relation_size(c.oid) as relation_bytes
+            from pg_catalog.pg_class c
+            join pg_catalog.pg_namespace n on n.oid = c.relnamespace
+            where n.nspname || '.' || c.relname in :schema_table_names
+        """).bindparams(bindparam("schema_table_names", schema_table_names, expanding=True))
+
+        columns_query: TextClause = text("""
+            select schemaname || '.' || tablename as schema_table_name, attname, n_distinct, null_frac
+            from pg_catalog.pg_stats
+            where schemaname || '.' || tablename in :schema_table_names
+        """).bindparams(bindparam("schema_table_names", schema_table_names, expanding=True))
+
+        return tables_query, columns_query
+
+    @staticmethod
+    def parse_table_statistics(table_names: list[str], table_rows: Sequence[Row],
+                               column_rows: Sequence[Row]) -> dict[str, TableStatistics]:
+        """
+        Converts results of create_table_statistics_queries
+        :param table_names: names of tables as in cube structure
+        :param table_rows: rows of tables query
+        :param column_rows: rows of columns query
+        :return: statistics by table name. Tables that were not found in database are skipped
+        """
+        names_by_schema_table: dict[str, str] = {".".join(table_name.split(".")[-2:]): table_name
+                                                 for table_name in table_names}
+
+        tables: dict[str, TableStatistics] = {}
+
+        for schema_table_name, rows_no, relation_bytes in table_rows:
+            table_name: str = names_by_schema_table[schema_table_name]
+            # Postgres returns -1 (or 0 before 14th version) for tables that were never analyzed
+            tables[table_name] = TableStatistics(table_name=table_name,
+                                                 rows_no=rows_no if rows_no > 0 else None,
+                                                 relation_bytes=relation_bytes)
+
+        for schema_table_name, column_name, n_distinct, null_frac in column_rows:
+            table_statistics: TableStatistics | None = tables.get(names_by_schema_table[schema_table_name], None)
+
+            if table_statistics is None:
+                continue
+
+            # Negative n_distinct is a fraction of number of rows
+            if (n_distinct is not None) and (n_distinct < 0):
+                n_distinct = None if table_statistics.rows_no is None else -n_distinct * table_statistics.rows_no
+
+            table_statistics.columns[column_name] = ColumnStatistics(n_distinct=n_distinct, null_frac=null_frac)
+
+        return tables
+
+    @staticmethod
+    def create_statement_timeout_query(statement_timeout: int) -> TextClause:
+        """
+        Sets statement timeout until the end of transaction. Connection returns to pool without it
+        :param statement_timeout: timeout in seconds
+        :return: TextClause
+        """
+        return text("SELECT set_config('statement_timeout', :statement_timeout, true)")\
+            .bindparams(statement_timeout=f"{statement_timeout * 1000}")
+
+    @staticmethod
+    def is_query_canceled_error(error: DBAPIError) -> bool:
+        """
+        Checks if query was cancelled by server: by statement timeout or by cancel request
+        :param error: error of the driver wrapped by sqlalchemy
+        :return: True if sqlstate is query_canceled
+        """
+        sqlstate: str | None = getattr(error.orig, "pgcode", None) or getattr(error.orig, "sqlstate", None)
+
+        return sqlstate == "57014"
+
+    @staticmethod
+    def create_explain_query(sql: str) -> str:
+        """
+        Asks planner for plan of the query. Query itself is not executed
+        :param sql: sql query
+        :return: sql query
+        """
+        return f"explain (format json) {sql}"
+
+    @staticmethod
+    def get_plan(value: Any) -> dict:
+        """
+        Returns top plan node of EXPLAIN (FORMAT JSON)
+        :param value: first column of the first row of explain query
+        :return: plan node with "Total Cost", "Plan Rows" and so on
+        """
+        # psycopg2 parses json plan by itself, asyncpg returns text
+        plan: list = json.loads(value) if isinstance(value, str) else value
+
+        return plan[0]["Plan"]
 
-        return result
 
+class OptimizerPostgres(PostgresQueryMixin, OptimizerAbstract):
+    __engine: Engine
+    __settings: Settings
+    # Explains candidates in parallel. Threads are started on demand
+    __explain_executor: ThreadPoolExecutor
+
+    def __init__(self, max_connections: int, engine: Engine,
+                 row_count_strategy: RowCountStrategy = RowCountStrategy.EXACT,
+                 statement_timeout: int | None = None):
+        super().__init__(max_connections, engine, row_count_strategy, statement_timeout)
+        self.__engine = engine
+        self.__settings = Settings()
+        self.__explain_executor = ThreadPoolExecutor(max_workers=max(1, max_connections),
+                                                     thread_name_prefix="explain")
 
+    def dispose(self) -> None:
+        """
+        Stops explain threads and closes connections of engine
+        :return: None
+        """
+        self.__explain_executor.shutdown(wait=False, cancel_futures=True)
+        super().dispose()
 
+    @traced("select_best_query")
     def select_best_query(self, cube_name: str, select_collection: SelectCollection) -> str:
         """
         Select best query from SelectCollection
-        First query with the list amount of not selected fields
+        Candidates are explained in parallel and the cheapest one is chosen
+        If cost-based selection is turned off, first query with the least amount of not selected fields is chosen
 
         :param cube_name: name of the cube
         :param select_collection: all possible queries
         :return: select string
         """
-        # Unused by OptimizerPostgres
-        del cube_name
+        candidates: list[tuple[str, str, int]] = self.get_query_candidates(select_collection)
+        set_span_attributes({"query.candidates": len(candidates), "query.cost_based": self.is_cost_based_selection()})
+
+        if (not self.is_cost_based_selection()) or (len(candidates) < 2):
+            return self.choose_query_by_fields(candidates) or ""
 
-        query: str = ""
-        number_of_fields: int | None = None
+        with stage_timer("choose_query"):
+            costs: list[float | None] = self.__get_costs([sql for _, sql, _ in candidates])
 
-        for table in select_collection:
-            if (number_of_fields is None) or (number_of_fields > select_collection.get_not_selected_fields_no(table)):
-                number_of_fields = select_collection.get_not_selected_fields_no(table)
-                query = select_collection.get_sql(table)
+        return self.choose_query_by_cost(cube_name, candidates, costs) or ""
+
+    @traced("select_best_query")
+    def select_best_filter_query(self, select_filter: SelectFilter) -> str:
+        """
+        Choose best filter query
+        Candidates are chosen the same way as in select_best_query
+        :param select_filter:
+
+        :raises NoQuery: if there are no candidates
+
+        :return: sql-query
+        """
+        candidates: list[tuple[str, str, int]] = self.get_filter_query_candidates(select_filter)
+        set_span_attributes({"query.candidates": len(candidates), "query.cost_based": self.is_cost_based_selection()})
+        query: str | None
+
+        if (not self.is_cost_based_selection()) or (len(candidates) < 2):
+            query = self.choose_query_by_fields(candidates)
+        else:
+            with stage_timer("choose_query"):
+                costs: list[float | None] = self.__get_costs([sql for _, sql, _ in candidates])
+            query = self.choose_query_by_cost("filter", candidates, costs)
+
+        if query is None:
+            raise NoQuery
 
         return query
 
+    def __get_costs(self, queries: list[str]) -> list[float | None]:
+        """
+        Returns planner costs of queries
+        Costs that are not cached are explained in parallel
+        :param queries: sql queries
+        :return: total costs, None if query could not be explained
+        """
+        plan_cost_cache: PlanCostCache = self.get_plan_cost_cache()
+
+        costs: list[float | None] = [plan_cost_cache.get(sql) for sql in queries]
+        not_cached: list[int] = [position for position, cost in enumerate(costs) if cost is None]
+
+        if len(not_cached) == 0:
+            return costs
+
+        # Context is copied, so explains are admitted for the same user and priority as request
+        futures: list[Future] = [self.__explain_executor.submit(contextvars.copy_context().run, self.__explain_cost,
+                                                                queries[position]) for position in not_cached]
+        explained: list[float | None] = [future.result() for future in futures]
+
+        for position, cost in zip(not_cached, explained):
+            costs[position] = cost
 
-    def count_rows(self, sql: str, max_rows_no: int = 1_000_000) -> tuple[int, bool]:
+        return costs
+
+    def __explain_cost(self, sql: str) -> float | None:
+        """
+        Explains query and saves its cost to cache
+        :param sql: sql query
+        :return: total cost or None if query could not be explained
+        """
+        try:
+            plan: dict = self.get_plan(self.run_select_query_to_olap_db(self.create_explain_query(sql)).fetchone()[0])
+        except DBAPIError as error:
+            logger.warning("Could not explain query %s: %s", get_sql_fingerprint(sql)[:12], error)
+            return None
+
+        cost: float = float(plan["Total Cost"])
+        self.get_plan_cost_cache().put(sql, cost)
+
+        return cost
+
+    def select_page_from_olap(self, sql: str, page_no: int, items_per_page: int,
+                              order_by_keys: list[str] | None = None, last_key: list | None = None) -> CursorResult:
         """
-        Count rows in select. If query returned more rows than :param max_rows_no:, return false. Else true
+        Select one page from olap
+        If :param order_by_keys: and :param last_key: are provided, page is selected with keyset pagination:
+            WHERE (k1, k2, ...) > (last_key) ORDER BY k1, k2, ... LIMIT items_per_page
+        Otherwise pager with offset and limit is used
+        :param sql: sql query
+        :param page_no: page we want to download
+        :param items_per_page: how many items per page
+        :param order_by_keys: column aliases that define unique order of rows
+        :param last_key: values of :param order_by_keys: of the last row on previous page
+        :return: Cursor result from query
+        """
+
+        query: TextClause = self.create_page_query(sql, page_no, items_per_page, order_by_keys, last_key)
+
+        return self.run_select_query_to_olap_db(query)
+
+    def stream_query(self, sql: str, rows_per_chunk: int) -> Iterator[tuple[list[str], Sequence[Row]]]:
+        """
+        Streams complete result of query using named server-side cursor
+        Only :param rows_per_chunk: rows are kept in memory at once
+        Connection and admission slot are held until iterator is exhausted or closed
+        :param sql: sql query
+        :param rows_per_chunk: number of rows fetched from cursor at once
+        :return: iterator of column names and chunk of rows
+        """
+
+        engine: Engine = self.get_engine()
+
+        with self.get_admission_controller().admit():
+            with engine.connect() as connect, self.__interruptible(connect):
+                result = connect.execution_options(stream_results=True, yield_per=rows_per_chunk)\
+                    .execute(text(sql))
+                columns: list[str] = list(result.keys())
+                is_empty: bool = True
+
+                for partition in result.partitions(rows_per_chunk):
+                    is_empty = False
+                    yield columns, partition
+
+                # Columns are still needed to create header or schema
+                if is_empty:
+                    yield columns, []
+
+    @traced("count_rows")
+    def count_rows(self, sql: str, max_rows_no: int = 1_000_000) -> tuple[int, bool, bool]:
+        """
+        Count rows in select with row count strategy of optimizer.
+        If query returned more rows than :param max_rows_no:, return false. Else true
         :param max_rows_no: Max number of rows that query should return
         :param sql: query
         :return:
                 [0] number of rows
-                [1] true if number of rows more than max_rows_no
+                [1] true if number of rows is not more than max_rows_no
+                [2] true if number of rows is exact, false if it is estimated
         """
 
-        sql_count = f"select count(*) as count_rows from ({sql}) as q"
-        is_ok_to_download_data: bool = False
+        row_count_strategy: RowCountStrategy = self.get_row_count_strategy()
 
-        rows_no: int
+        sql_count: str = self.create_count_query(sql, row_count_strategy, max_rows_no)
+
+        with stage_timer("count_rows"):
+            count_value = self.run_select_query_to_olap_db(sql_count).fetchone()[0]
+
+            rows_no, is_ok_to_download_data, is_rows_no_exact = self.parse_count_result(count_value,
+                                                                                        row_count_strategy,
+                                                                                        max_rows_no)
+
+            # Planner could overestimate small queries. They are rejected only if bounded count confirms it
+            if (row_count_strategy == RowCountStrategy.ESTIMATE) and (not is_ok_to_download_data):
+                sql_count = self.create_count_query(sql, RowCountStrategy.BOUNDED, max_rows_no)
+                count_value = self.run_select_query_to_olap_db(sql_count).fetchone()[0]
+                rows_no, is_ok_to_download_data, is_rows_no_exact = self.parse_count_result(
+                    count_value, RowCountStrategy.BOUNDED, max_rows_no)
+        set_span_attributes({"query.rows": rows_no, "query.rows_exact": is_rows_no_exact,
+                             "query.row_count_strategy": row_count_strategy.value})
 
-        rows_no = self.run_select_query_to_olap_db(sql_count).fetchone()[0]
+        return rows_no, is_ok_to_download_data, is_rows_no_exact
 
-        if rows_no <= max_rows_no:
-            is_ok_to_download_data = True
+    def refresh_table_statistics(self, table_names: list[str]) -> None:
+        """
+        Reads number of rows and sizes from pg_class, n_distinct and null fraction of columns from pg_stats
+        and replaces table statistics catalog
+        :param table_names: names of all tables of the cube
+        :return: None
+        """
+        tables_query, columns_query = self.create_table_statistics_queries(table_names)
+
+        table_rows: Sequence[Row] = self.run_select_query_to_olap_db(tables_query).all()
+        column_rows: Sequence[Row] = self.run_select_query_to_olap_db(columns_query).all()
+
+        self.get_table_statistics().update(self.parse_table_statistics(table_names, table_rows, column_rows))
+
+    def refresh_materialized_view(self, view: MaterializedView, recreate: bool) -> bool:
+        """
+        Creates materialized view if it does not exist and refreshes it in one transaction
+        Transaction holds advisory lock of view, so only one instance of application refreshes it
+        Refresh is not limited by statement timeout
+        :param view: MaterializedView
+        :param recreate: drop view first, its query has changed
+        :return: True if view was refreshed, False if other instance of application is refreshing it
+        """
+        with self.get_admission_controller().admit():
+            with self.get_engine().begin() as connect:
+                connect.execute(self.create_statement_timeout_query(0))
+
+                if not connect.execute(create_materialized_view_lock_query(view)).scalar():
+                    return False
+
+                for query in create_materialized_view_queries(view, recreate):
+                    connect.execute(query)
+
+                is_populated: bool = bool(connect.execute(create_materialized_view_populated_query(view)).scalar())
+
+                for query in create_materialized_view_refresh_queries(view, is_populated):
+                    connect.execute(query)
 
-        return rows_no, is_ok_to_download_data
+        return True
 
     def select_dimension(self, select_filter: SelectFilter) -> CursorResult:
         """
@@ -140,7 +609,7 @@ class OptimizerPostgres(OptimizerAbstract):
 
         return returned_data
 
-    def run_select_query_to_olap_db(self, query: str) -> CursorResult:
+    def run_select_query_to_olap_db(self, query: str | TextClause) -> CursorResult:
         """
         Run select sql-query to OLAP database
         :param query: sql-query
@@ -149,35 +618,42 @@ class OptimizerPostgres(OptimizerAbstract):
 
         engine = self.get_engine()
 
-        self.__connections_semaphore.acquire()
-        try:
-            with engine.connect() as connect:
-                returned_data = connect.execute(text(query))
-        finally:
-            self.__connections_semaphore.release()
+        if isinstance(query, str):
+            query = text(query)
+
+        with self.get_admission_controller().admit():
+            with engine.connect() as connect, self.__interruptible(connect):
+                returned_data = connect.execute(query)
 
         return returned_data
 
-    def select_best_filter_query(self, select_filter: SelectFilter) -> str:
+    @contextlib.contextmanager
+    def __interruptible(self, connect: Connection) -> Iterator[None]:
         """
-        Choose best filter query
-        :param select_filter:
-        :return: sql-query
+        Sets statement timeout of request on connection and lets request cancel queries on it
+        Queries stopped by server are counted and raised as QueryCancelled or QueryTimeout
+        :param connect: opened Connection
+        :raises QueryCancelled: if client has disconnected
+        :raises QueryTimeout: if query has run longer than statement timeout
+        :return: None
         """
+        statement_timeout: int = self.get_statement_timeout()
 
-        number_of_unselected_fields: int | None = None
-        query: str | None = None
+        if statement_timeout > 0:
+            connect.execute(self.create_statement_timeout_query(statement_timeout))
 
-        for table in select_filter:
-            if number_of_unselected_fields is None:
-                number_of_unselected_fields = select_filter.get_not_selected_fields(table)
-                query = select_filter.get_sql(table)
+        try:
+            with cancellable_connection(connect):
+                yield
+        except DBAPIError as error:
+            if not self.is_query_canceled_error(error):
+                raise
 
-            if number_of_unselected_fields > select_filter.get_not_selected_fields(table):
-                number_of_unselected_fields = select_filter.get_not_selected_fields(table)
-                query = select_filter.get_sql(table)
+            handle: QueryCancelHandle | None = query_cancel_handle.get()
 
-        if query is None:
-            raise NoQuery
+            if (handle is not None) and handle.is_cancelled():
+                self.get_query_interruptions().add_cancelled()
+                raise QueryCancelled() from error
 
-        return query
+            self.get_query_interruptions().add_timed_out()
+            raise QueryTimeout() from error
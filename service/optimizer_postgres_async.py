@@ -0,0 +1,311 @@
+import asyncio
+import contextlib
+import logging
+from typing import AsyncIterator
+
+from comradewolf.utils.olap_data_types import SelectCollection, SelectFilter
+from sqlalchemy import text, CursorResult, Sequence, Row, TextClause
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncConnection
+
+from core.utils.exceptions import NoQuery, QueryTimeout
+from model.dto import QueryMetaData, RowCountStrategy, MaterializedView
+from service.materialized_views import create_materialized_view_queries, create_materialized_view_lock_query, \
+    create_materialized_view_populated_query, create_materialized_view_refresh_queries
+from service.optimizer_interface import OptimizerAsyncAbstract
+from service.metrics import stage_timer
+from service.tracing import traced, set_span_attributes
+from service.optimizer_postgres import PostgresQueryMixin
+from service.plan_cost_cache import PlanCostCache
+from service.sql_utils import get_sql_fingerprint
+
+logger = logging.getLogger(__name__)
+
+
+class OptimizerPostgresAsync(PostgresQueryMixin, OptimizerAsyncAbstract):
+    """
+    Postgres optimizer for asyncpg driver
+    Chooses queries the same way as OptimizerPostgres
+    """
+
+    def __init__(self, max_connections: int, engine: AsyncEngine,
+                 row_count_strategy: RowCountStrategy = RowCountStrategy.EXACT,
+                 statement_timeout: int | None = None):
+        super().__init__(max_connections, engine, row_count_strategy, statement_timeout)
+
+    async def get_query_meta_data(self, cube_name: str, select_collection: SelectCollection) -> QueryMetaData:
+        """
+        Select best query and check we can return it
+        :param cube_name: Name of the qube
+        :param select_collection: collection of possible queries
+        :return: query_meta_data - query, number of rows and pages
+        """
+        rows_no: int
+        is_ok_to_download_data: bool
+        is_rows_no_exact: bool
+
+        sql_query: str = await self.select_best_query(cube_name, select_collection)
+
+        rows_no, is_ok_to_download_data, is_rows_no_exact = await self.count_rows(sql_query, self.get_max_rows())
+
+        return self.create_query_meta_data(cube_name, sql_query, rows_no, is_ok_to_download_data, is_rows_no_exact)
+
+    @traced("select_best_query")
+    async def select_best_query(self, cube_name: str, select_collection: SelectCollection) -> str:
+        """
+        Select best query from SelectCollection
+        Candidates are explained concurrently and the cheapest one is chosen
+        If cost-based selection is turned off, first query with the least amount of not selected fields is chosen
+
+        :param cube_name: name of the cube
+        :param select_collection: all possible queries
+        :return: select string
+        """
+        candidates: list[tuple[str, str, int]] = self.get_query_candidates(select_collection)
+        set_span_attributes({"query.candidates": len(candidates), "query.cost_based": self.is_cost_based_selection()})
+
+        if (not self.is_cost_based_selection()) or (len(candidates) < 2):
+            return self.choose_query_by_fields(candidates) or ""
+
+        with stage_timer("choose_query"):
+            costs: list[float | None] = await self.__get_costs([sql for _, sql, _ in candidates])
+
+        return self.choose_query_by_cost(cube_name, candidates, costs) or ""
+
+    @traced("select_best_query")
+    async def select_best_filter_query(self, select_filter: SelectFilter) -> str:
+        """
+        Choose best filter query
+        Candidates are chosen the same way as in select_best_query
+        :param select_filter:
+
+        :raises NoQuery: if there are no candidates
+
+        :return: sql-query
+        """
+        candidates: list[tuple[str, str, int]] = self.get_filter_query_candidates(select_filter)
+        set_span_attributes({"query.candidates": len(candidates), "query.cost_based": self.is_cost_based_selection()})
+        query: str | None
+
+        if (not self.is_cost_based_selection()) or (len(candidates) < 2):
+            query = self.choose_query_by_fields(candidates)
+        else:
+            with stage_timer("choose_query"):
+                costs: list[float | None] = await self.__get_costs([sql for _, sql, _ in candidates])
+            query = self.choose_query_by_cost("filter", candidates, costs)
+
+        if query is None:
+            raise NoQuery
+
+        return query
+
+    async def __get_costs(self, queries: list[str]) -> list[float | None]:
+        """
+        Returns planner costs of queries
+        Costs that are not cached are explained concurrently, number of connections is limited by admission controller
+        :param queries: sql queries
+        :return: total costs, None if query could not be explained
+        """
+        plan_cost_cache: PlanCostCache = self.get_plan_cost_cache()
+
+        costs: list[float | None] = [plan_cost_cache.get(sql) for sql in queries]
+        not_cached: list[int] = [position for position, cost in enumerate(costs) if cost is None]
+
+        explained: list[float | None] = await asyncio.gather(*[self.__explain_cost(queries[position])
+                                                               for position in not_cached])
+
+        for position, cost in zip(not_cached, explained):
+            costs[position] = cost
+
+        return costs
+
+    async def __explain_cost(self, sql: str) -> float | None:
+        """
+        Explains query and saves its cost to cache
+        :param sql: sql query
+        :return: total cost or None if query could not be explained
+        """
+        try:
+            explain_result: CursorResult = await self.run_select_query_to_olap_db(text(self.create_explain_query(sql)))
+        except DBAPIError as error:
+            logger.warning("Could not explain query %s: %s", get_sql_fingerprint(sql)[:12], error)
+            return None
+
+        cost: float = float(self.get_plan(explain_result.fetchone()[0])["Total Cost"])
+        self.get_plan_cost_cache().put(sql, cost)
+
+        return cost
+
+    async def select_page_from_olap(self, sql: str, page_no: int, items_per_page: int,
+                                    order_by_keys: list[str] | None = None,
+                                    last_key: list | None = None) -> CursorResult:
+        """
+        Select one page from olap
+        If :param order_by_keys: and :param last_key: are provided, page is selected with keyset pagination
+        Otherwise pager with offset and limit is used
+        :param sql: sql query
+        :param page_no: page we want to download
+        :param items_per_page: how many items per page
+        :param order_by_keys: column aliases that define unique order of rows
+        :param last_key: values of :param order_by_keys: of the last row on previous page
+        :return: buffered Cursor result from query
+        """
+
+        query: TextClause = self.create_page_query(sql, page_no, items_per_page, order_by_keys, last_key)
+
+        return await self.run_select_query_to_olap_db(query)
+
+    async def stream_query(self, sql: str, rows_per_chunk: int) -> AsyncIterator[tuple[list[str], Sequence[Row]]]:
+        """
+        Streams complete result of query using server-side cursor
+        Only :param rows_per_chunk: rows are kept in memory at once
+        Connection and admission slot are held until iterator is exhausted or closed
+        :param sql: sql query
+        :param rows_per_chunk: number of rows fetched from cursor at once
+        :return: async iterator of column names and chunk of rows
+        """
+
+        engine: AsyncEngine = self.get_engine()
+
+        async with self.get_admission_controller().admit():
+            async with engine.connect() as connect, self.__interruptible(connect):
+                result = await connect.stream(text(sql), execution_options={"yield_per": rows_per_chunk})
+                columns: list[str] = list(result.keys())
+                is_empty: bool = True
+
+                async for partition in result.partitions(rows_per_chunk):
+                    is_empty = False
+                    yield columns, partition
+
+                # Columns are still needed to create header or schema
+                if is_empty:
+                    yield columns, []
+
+    @traced("count_rows")
+    async def count_rows(self, sql: str, max_rows_no: int = 1_000_000) -> tuple[int, bool, bool]:
+        """
+        Count rows in select with row count strategy of optimizer.
+        If query returned more rows than :param max_rows_no:, return false. Else true
+        :param max_rows_no: Max number of rows that query should return
+        :param sql: query
+        :return:
+                [0] number of rows
+                [1] true if number of rows is not more than max_rows_no
+                [2] true if number of rows is exact, false if it is estimated
+        """
+
+        row_count_strategy: RowCountStrategy = self.get_row_count_strategy()
+
+        sql_count: str = self.create_count_query(sql, row_count_strategy, max_rows_no)
+
+        with stage_timer("count_rows"):
+            count_value = (await self.run_select_query_to_olap_db(text(sql_count))).fetchone()[0]
+
+            rows_no, is_ok_to_download_data, is_rows_no_exact = self.parse_count_result(count_value,
+                                                                                        row_count_strategy,
+                                                                                        max_rows_no)
+
+            # Planner could overestimate small queries. They are rejected only if bounded count confirms it
+            if (row_count_strategy == RowCountStrategy.ESTIMATE) and (not is_ok_to_download_data):
+                sql_count = self.create_count_query(sql, RowCountStrategy.BOUNDED, max_rows_no)
+                count_value = (await self.run_select_query_to_olap_db(text(sql_count))).fetchone()[0]
+                rows_no, is_ok_to_download_data, is_rows_no_exact = self.parse_count_result(
+                    count_value, RowCountStrategy.BOUNDED, max_rows_no)
+        set_span_attributes({"query.rows": rows_no, "query.rows_exact": is_rows_no_exact,
+                             "query.row_count_strategy": row_count_strategy.value})
+
+        return rows_no, is_ok_to_download_data, is_rows_no_exact
+
+    async def refresh_table_statistics(self, table_names: list[str]) -> None:
+        """
+        Reads number of rows and sizes from pg_class, n_distinct and null fraction of columns from pg_stats
+        and replaces table statistics catalog
+        :param table_names: names of all tables of the cube
+        :return: None
+        """
+        tables_query, columns_query = self.create_table_statistics_queries(table_names)
+
+        table_rows: Sequence[Row] = (await self.run_select_query_to_olap_db(tables_query)).all()
+        column_rows: Sequence[Row] = (await self.run_select_query_to_olap_db(columns_query)).all()
+
+        self.get_table_statistics().update(self.parse_table_statistics(table_names, table_rows, column_rows))
+
+    async def refresh_materialized_view(self, view: MaterializedView, recreate: bool) -> bool:
+        """
+        Creates materialized view if it does not exist and refreshes it in one transaction
+        Transaction holds advisory lock of view, so only one instance of application refreshes it
+        Refresh is not limited by statement timeout
+        :param view: MaterializedView
+        :param recreate: drop view first, its query has changed
+        :return: True if view was refreshed, False if other instance of application is refreshing it
+        """
+        async with self.get_admission_controller().admit():
+            async with self.get_engine().begin() as connect:
+                await connect.execute(self.create_statement_timeout_query(0))
+
+                if not (await connect.execute(create_materialized_view_lock_query(view))).scalar():
+                    return False
+
+                for query in create_materialized_view_queries(view, recreate):
+                    await connect.execute(query)
+
+                is_populated: bool = bool((await connect.execute(
+                    create_materialized_view_populated_query(view))).scalar())
+
+                for query in create_materialized_view_refresh_queries(view, is_populated):
+                    await connect.execute(query)
+
+        return True
+
+    async def select_dimension(self, select_filter: SelectFilter) -> CursorResult:
+        """
+        Selects data from db with unique values for dimension
+        :param select_filter:
+        :return: buffered Cursor result from query
+        """
+
+        query: str = await self.select_best_filter_query(select_filter)
+
+        return await self.run_select_query_to_olap_db(text(query))
+
+    async def run_select_query_to_olap_db(self, query: TextClause) -> CursorResult:
+        """
+        Run select sql-query to OLAP database
+        Waits for free connection without blocking event loop
+        :param query: sql-query
+        :return: buffered CursorResult, it could be fetched after connection is closed
+        """
+
+        engine: AsyncEngine = self.get_engine()
+
+        async with self.get_admission_controller().admit():
+            async with engine.connect() as connect, self.__interruptible(connect):
+                returned_data = await connect.execute(query)
+
+        return returned_data
+
+    @contextlib.asynccontextmanager
+    async def __interruptible(self, connect: AsyncConnection) -> AsyncIterator[None]:
+        """
+        Sets statement timeout of request on connection and counts stopped queries
+        Query is cancelled together with its task when client disconnects, asyncpg cancels it on server
+        :param connect: opened AsyncConnection
+        :raises QueryTimeout: if query has run longer than statement timeout
+        :return: None
+        """
+        statement_timeout: int = self.get_statement_timeout()
+
+        if statement_timeout > 0:
+            await connect.execute(self.create_statement_timeout_query(statement_timeout))
+
+        try:
+            yield
+        except asyncio.CancelledError:
+            self.get_query_interruptions().add_cancelled()
+            raise
+        except DBAPIError as error:
+            if not self.is_query_canceled_error(error):
+                raise
+
+            self.get_query_interruptions().add_timed_out()
+            raise QueryTimeout() from error
@@ -0,0 +1,138 @@
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+from sqlalchemy import Sequence, Row
+
+from model.dto import PageCacheStatsDTO
+from service.sql_utils import normalize_sql
+
+
+class PageCache:
+    """
+    In-memory cache of OLAP query pages
+    Pages are kept serialized, cache size is bounded by total number of bytes
+    Least recently used pages are evicted first, expired pages are never returned
+    Thread-safe: pages are selected both in event loop and in thread pool
+    """
+
+    def __init__(self, max_bytes: int) -> None:
+        """
+        :param max_bytes: maximum total size of serialized pages. 0 disables cache
+        """
+        self.__max_bytes: int = max_bytes
+        self.__pages: OrderedDict[tuple, tuple[float, bytes]] = OrderedDict()
+        self.__total_bytes: int = 0
+        self.__lock: threading.Lock = threading.Lock()
+
+        self.__hits: int = 0
+        self.__misses: int = 0
+        self.__evictions: int = 0
+        self.__expirations: int = 0
+
+    def create_key(self, cube_name: str, cube_version: str | None, sql: str, page: int, items_per_page: int) -> tuple:
+        """
+        Creates cache key of the page
+        :param cube_name: name of the cube. Same sql could be sent to different databases
+        :param cube_version: version of cube definition. Request that finishes on previous version of reloaded cube
+            does not put its pages under keys of the new version
+        :param sql: sql query
+        :param page: page no
+        :param items_per_page: rows per page
+        :return: key
+        """
+        return cube_name, cube_version, normalize_sql(sql), page, items_per_page
+
+    def get(self, key: tuple) -> tuple[list[str], Sequence[Row]] | None:
+        """
+        Returns cached page
+        :param key: key from create_key
+        :return: column names and rows or None if page is not cached or expired
+        """
+        with self.__lock:
+            cached: tuple[float, bytes] | None = self.__pages.get(key, None)
+
+            if cached is None:
+                self.__misses += 1
+                return None
+
+            expires_at, page_bytes = cached
+
+            if expires_at <= time.monotonic():
+                self.__remove(key)
+                self.__expirations += 1
+                self.__misses += 1
+                return None
+
+            self.__pages.move_to_end(key)
+            self.__hits += 1
+
+        return pickle.loads(page_bytes)
+
+    def put(self, key: tuple, columns: list[str], rows: Sequence[Row], ttl: int) -> None:
+        """
+        Saves page to cache and evicts least recently used pages, if cache is full
+        Page that is larger than whole cache is not saved
+        :param key: key from create_key
+        :param columns: column names
+        :param rows: rows of the page
+        :param ttl: time to live of the page in seconds. 0 disables caching
+        :return: None
+        """
+        if (ttl <= 0) or (self.__max_bytes <= 0):
+            return
+
+        page_bytes: bytes = pickle.dumps((columns, rows), protocol=pickle.HIGHEST_PROTOCOL)
+
+        if len(page_bytes) > self.__max_bytes:
+            return
+
+        with self.__lock:
+            if key in self.__pages:
+                self.__remove(key)
+
+            while self.__total_bytes + len(page_bytes) > self.__max_bytes:
+                self.__remove(next(iter(self.__pages)))
+                self.__evictions += 1
+
+            self.__pages[key] = (time.monotonic() + ttl, page_bytes)
+            self.__total_bytes += len(page_bytes)
+
+    def clear(self) -> None:
+        """
+        Removes all pages. Counters are kept
+        :return: None
+        """
+        with self.__lock:
+            self.__pages.clear()
+            self.__total_bytes = 0
+
+    def invalidate_cube(self, cube_name: str) -> None:
+        """
+        Removes all pages of the cube. Used when cube is reloaded
+        :param cube_name: name of the cube
+        :return: None
+        """
+        with self.__lock:
+            for key in [key for key in self.__pages if key[0] == cube_name]:
+                self.__remove(key)
+
+    def get_stats(self) -> PageCacheStatsDTO:
+        """
+        Returns counters of the cache
+        :return: PageCacheStatsDTO
+        """
+        with self.__lock:
+            return PageCacheStatsDTO(hits=self.__hits, misses=self.__misses, evictions=self.__evictions,
+                                     expirations=self.__expirations, pages=len(self.__pages),
+                                     total_bytes=self.__total_bytes, max_bytes=self.__max_bytes)
+
+    def __remove(self, key: tuple) -> None:
+        """
+        Removes page. Should be called under lock
+        :param key: key from create_key
+        :return: None
+        """
+        expires_at, page_bytes = self.__pages.pop(key)
+        self.__total_bytes -= len(page_bytes)
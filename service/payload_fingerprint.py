@@ -0,0 +1,55 @@
+import hashlib
+import json
+
+from comradewolf.utils.enums_and_field_dicts import WhereConditionType
+
+from model.dto import FrontendFieldsJson
+
+# Order of values matters only for conditions with several values, that are not sets
+_UNORDERED_CONDITIONS: list[str] = [WhereConditionType.IN.value, WhereConditionType.NOT_IN.value]
+
+
+def normalize_frontend_payload(front_data: FrontendFieldsJson) -> dict:
+    """
+    Makes payloads that request the same data equal: where conditions and values of IN and NOT IN are sorted
+    Order of fields and calculations is kept, it is the order of columns in response
+    :param front_data: JSON payload from frontend
+    :return: normalized dictionary
+    """
+    frontend_dict: dict = front_data.model_dump(mode='json')
+
+    where: list[dict] = []
+
+    for condition in frontend_dict["WHERE"]:
+        if isinstance(condition["condition"], list) and (condition["where"] in _UNORDERED_CONDITIONS):
+            condition = {**condition, "condition": sorted(condition["condition"])}
+
+        where.append(condition)
+
+    return {
+        "SELECT": frontend_dict["SELECT"],
+        "CALCULATION": frontend_dict["CALCULATION"],
+        "WHERE": sorted(where, key=lambda field: json.dumps(field, sort_keys=True)),
+    }
+
+
+def get_payload_fingerprint(front_data: FrontendFieldsJson) -> str:
+    """
+    Hash of normalized payload. Same data requested with different order of conditions gives the same hash
+    :param front_data: JSON payload from frontend
+    :return: sha256 hex
+    """
+    normalized: str = json.dumps(normalize_frontend_payload(front_data), sort_keys=True, ensure_ascii=False)
+
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+
+def get_dict_fingerprint(data: dict) -> str:
+    """
+    Hash of dictionary that does not depend on order of keys. Order of lists is kept
+    :param data: JSON-serializable dictionary
+    :return: sha256 hex
+    """
+    canonical: str = json.dumps(data, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
@@ -0,0 +1,74 @@
+import threading
+import time
+from collections import OrderedDict
+
+from service.sql_utils import get_sql_fingerprint
+
+
+class PlanCostCache:
+    """
+    Planner costs of candidate queries by query fingerprint
+    Costs are refreshed after ttl, so changes of table statistics are taken into account
+    Least recently used costs are evicted after :param max_entries:
+    """
+
+    def __init__(self, max_entries: int, ttl: int) -> None:
+        """
+        :param max_entries: maximum number of saved costs
+        :param ttl: time to live of saved cost in seconds
+        """
+        self.__max_entries: int = max_entries
+        self.__ttl: int = ttl
+        self.__costs: OrderedDict[str, tuple[float, float]] = OrderedDict()
+        self.__lock: threading.Lock = threading.Lock()
+
+    def get(self, sql: str) -> float | None:
+        """
+        Returns saved cost of query
+        :param sql: sql query
+        :return: total cost or None if cost is unknown or expired
+        """
+        fingerprint: str = get_sql_fingerprint(sql)
+
+        with self.__lock:
+            cached: tuple[float, float] | None = self.__costs.get(fingerprint, None)
+
+            if cached is None:
+                return None
+
+            expires_at, cost = cached
+
+            if expires_at <= time.monotonic():
+                del self.__costs[fingerprint]
+                return None
+
+            self.__costs.move_to_end(fingerprint)
+
+        return cost
+
+    def put(self, sql: str, cost: float) -> None:
+        """
+        Saves cost of query
+        :param sql: sql query
+        :param cost: total cost from plan
+        :return: None
+        """
+        if (self.__max_entries <= 0) or (self.__ttl <= 0):
+            return
+
+        fingerprint: str = get_sql_fingerprint(sql)
+
+        with self.__lock:
+            self.__costs[fingerprint] = (time.monotonic() + self.__ttl, cost)
+            self.__costs.move_to_end(fingerprint)
+
+            while len(self.__costs) > self.__max_entries:
+                self.__costs.popitem(last=False)
+
+    def clear(self) -> None:
+        """
+        Removes all saved costs
+        :return: None
+        """
+        with self.__lock:
+            self.__costs.clear()
@@ -0,0 +1,200 @@
+import asyncio
+import contextlib
+import logging
+import threading
+from contextvars import ContextVar
+from typing import Any, Awaitable, Iterator, Callable
+
+from sqlalchemy import Connection
+from starlette.requests import Request
+
+from core.config import settings
+from core.utils.exceptions import QueryCancelled
+from model.dto import QueryInterruptionStatsDTO
+
+logger = logging.getLogger(__name__)
+
+
+class QueryCancelHandle:
+    """
+    Database connections of one request that are running queries right now
+    When client disconnects, queries are cancelled with driver cancel, so thread and connection are freed at once
+    Connections are kept as their cancel methods: cancel() of psycopg2, interrupt() of duckdb
+    """
+
+    def __init__(self) -> None:
+        self.__lock: threading.Lock = threading.Lock()
+        self.__connections: set[Callable[[], Any]] = set()
+        self.__is_cancelled: bool = False
+
+    def is_cancelled(self) -> bool:
+        """
+        Checks if request was cancelled
+        :return: True if client has disconnected
+        """
+        return self.__is_cancelled
+
+    def register(self, cancel: Callable[[], Any]) -> None:
+        """
+        Remembers connection that runs query of request
+        :param cancel: method of driver connection that cancels running query
+        :raises QueryCancelled: if request was cancelled already
+        :return: None
+        """
+        with self.__lock:
+            if self.__is_cancelled:
+                raise QueryCancelled()
+
+            self.__connections.add(cancel)
+
+    def unregister(self, cancel: Callable[[], Any]) -> None:
+        """
+        Forgets connection after query has finished
+        :param cancel: method that was registered
+        :return: None
+        """
+        with self.__lock:
+            self.__connections.discard(cancel)
+
+    def cancel(self) -> None:
+        """
+        Cancels all running queries of request. Could be called from any thread
+        :return: None
+        """
+        self.__cancel_connections(self.__mark_cancelled())
+
+    def cancel_in_background(self) -> None:
+        """
+        Marks request as cancelled at once and cancels running queries in its own thread.
+        Driver cancel is blocking network call, so event loop should not wait for it.
+        Thread pool is not used, it could be busy with the same queries that are cancelled
+        :return: None
+        """
+        connections: list[Callable[[], Any]] = self.__mark_cancelled()
+
+        if len(connections) > 0:
+            threading.Thread(target=self.__cancel_connections, args=(connections,), name="query-cancel",
+                             daemon=True).start()
+
+    def __mark_cancelled(self) -> list[Callable[[], Any]]:
+        """
+        Marks request as cancelled, so new queries are not started
+        :return: cancel methods of running queries
+        """
+        with self.__lock:
+            self.__is_cancelled = True
+
+            return list(self.__connections)
+
+    @staticmethod
+    def __cancel_connections(connections: list[Callable[[], Any]]) -> None:
+        """
+        Calls driver cancel of every connection
+        :param connections: cancel methods of running queries
+        :return: None
+        """
+        for cancel in connections:
+            try:
+                cancel()
+            except Exception as error:
+                logger.warning("Could not cancel query: %s", error)
+
+
+class QueryInterruptionCounters:
+    """
+    Number of queries that were cancelled because client has gone and that hit statement timeout
+    """
+
+    def __init__(self) -> None:
+        self.__lock: threading.Lock = threading.Lock()
+        self.__cancelled: int = 0
+        self.__timed_out: int = 0
+
+    def add_cancelled(self) -> None:
+        with self.__lock:
+            self.__cancelled += 1
+
+    def add_timed_out(self) -> None:
+        with self.__lock:
+            self.__timed_out += 1
+
+    def get_stats(self, cube_name: str) -> QueryInterruptionStatsDTO:
+        """
+        Returns counters
+        :param cube_name: name of the cube
+        :return: QueryInterruptionStatsDTO
+        """
+        with self.__lock:
+            return QueryInterruptionStatsDTO(cube_name=cube_name, cancelled=self.__cancelled,
+                                             timed_out=self.__timed_out)
+
+
+# Set by router before query is run. Copied to thread pool with the rest of context
+query_cancel_handle: ContextVar[QueryCancelHandle | None] = ContextVar("query_cancel_handle", default=None)
+
+
+@contextlib.contextmanager
+def cancellable_connection(connect: Connection, cancel_method: str = "cancel") -> Iterator[None]:
+    """
+    Registers connection in cancel handle of current request while query is executed
+    Used by sync optimizers. Async queries are cancelled together with their task
+    :param connect: sqlalchemy Connection
+    :param cancel_method: name of driver connection method that cancels running query
+    :raises QueryCancelled: if request was cancelled before query started
+    :return: None
+    """
+    handle: QueryCancelHandle | None = query_cancel_handle.get()
+    cancel: Callable[[], Any] | None = getattr(connect.connection.driver_connection, cancel_method, None)
+
+    if (handle is None) or (cancel is None):
+        yield
+        return
+
+    handle.register(cancel)
+
+    try:
+        yield
+    finally:
+        handle.unregister(cancel)
+
+
+async def run_cancellable(request: Request, awaitable: Awaitable) -> Any:
+    """
+    Runs awaitable and cancels its queries if client disconnects
+    Sync queries in thread pool are cancelled by driver, async queries are cancelled with task
+
+    :param request: starlette Request of client
+    :param awaitable: coroutine that runs queries
+
+    :raises QueryCancelled: if client has disconnected
+
+    :return: result of awaitable
+    """
+    handle: QueryCancelHandle = QueryCancelHandle()
+    query_cancel_handle.set(handle)
+
+    # Task copies context with handle
+    task: asyncio.Task = asyncio.ensure_future(awaitable)
+
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=settings.DISCONNECT_CHECK_INTERVAL)
+
+            if task in done:
+                return task.result()
+
+            if await request.is_disconnected():
+                break
+    except asyncio.CancelledError:
+        handle.cancel_in_background()
+        task.cancel()
+        raise
+
+    handle.cancel_in_background()
+    task.cancel()
+
+    # Result is not needed anymore, query errors after cancel are expected
+    with contextlib.suppress(asyncio.CancelledError, Exception):
+        await task
+
+    raise QueryCancelled()
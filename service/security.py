@@ -1,7 +1,12 @@
+import asyncio
+import multiprocessing
 import random
 import string
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime, timedelta
-from typing import Annotated
+from typing import Annotated, Callable, Any
 
 from fastapi import Depends, status, HTTPException
 from fastapi.security import OAuth2PasswordBearer
@@ -10,15 +15,22 @@ from passlib.context import CryptContext
 from sqlalchemy.orm import Session
 
 from core.config import settings
-from core.utils.exceptions import UserNotFound
+from core.utils.exceptions import UserNotFound, PasswordHashPoolIsFull
 from model.base_model import AppUser, ConfirmationCode, OlapTable
+from model.dto import TokenClaims, PasswordHashStatsDTO
+from service.acl_cache import acl_cache
 from service.db import get_confirmation_code, create_confirmation_code, get_user_by_username
+from service.metrics import password_hash_duration, password_hash_queue_depth, password_hash_rejected
+from service.token_cache import VerifiedTokenCache
+from service.tracing import traced
 
 bcrypt_context: CryptContext = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_bearer: OAuth2PasswordBearer = OAuth2PasswordBearer(tokenUrl="/v1/user/authenticate")
+verified_token_cache: VerifiedTokenCache = VerifiedTokenCache(settings.VERIFIED_TOKEN_CACHE_SIZE)
 
 
-def create_jwt(username: str, user_id: int) -> str:
+def create_jwt(username: str, user_id: int, cube_names: list[str] | None = None,
+               acl_version: int | None = None) -> str:
     """
     Creates JWT
 
@@ -26,14 +38,23 @@ def create_jwt(username: str, user_id: int) -> str:
         sub: username
         id: user_id
         exp: expiration date
+        cubes: names of cubes user can access (optional)
+        acl: acl_version when cubes were read (optional)
     }
 
     :param username: Username
     :param user_id: Id
+    :param cube_names: names of cubes user can access. Grants are not added if None
+    :param acl_version: acl_version of grants. Grants without version are never trusted
     :return: JWToken with user data
     """
     expires = datetime.now() + timedelta(seconds=settings.EXPIRE_JWT_IN)
     encode = {"sub": username, "id": user_id, "exp": expires}
+
+    if (cube_names is not None) and (acl_version is not None):
+        encode["cubes"] = sorted(cube_names)
+        encode["acl"] = acl_version
+
     return jwt.encode(encode, settings.SECRET_KEY, algorithm=settings.ALGORITHM)
 
 def generate_confirmation_code(user: AppUser, db: Session) -> str:
@@ -85,14 +106,129 @@ def check_password(hashed_password: str, raw_password: str) -> bool:
     """
     return bcrypt_context.verify(raw_password, hashed_password)
 
-def get_user_from_jwt(token: Annotated[str, Depends(oauth2_bearer)]) -> str:
+
+class PasswordHashPool:
     """
-    Get user name from JWToken
+    Size-limited process pool for bcrypt
+    Hashing does not take request threads and does not hold GIL of the server process
+    If too many tasks wait for worker, new tasks are rejected, so login storm does not queue forever
+    """
+
+    def __init__(self, workers: int, max_queue: int) -> None:
+        """
+        :param workers: number of processes
+        :param max_queue: tasks that could wait for free worker
+        """
+        self.__workers: int = workers
+        self.__max_queue_depth: int = workers + max_queue
+        self.__executor: ProcessPoolExecutor | None = None
+        self.__lock: threading.Lock = threading.Lock()
+
+        self.__queue_depth: int = 0
+        self.__completed: int = 0
+        self.__rejected: int = 0
+        self.__total_latency: float = 0.0
+        self.__max_latency: float = 0.0
+
+    async def hash_password(self, password: str) -> str:
+        """
+        Hashes password in worker process
+
+        :raises PasswordHashPoolIsFull: if too many tasks wait for worker
+
+        :param password: password string
+        :return: hashed password
+        """
+        return await self.__run(hash_password, password)
+
+    async def check_password(self, hashed_password: str, raw_password: str) -> bool:
+        """
+        Compares hashed password and password in worker process
+
+        :raises PasswordHashPoolIsFull: if too many tasks wait for worker
+
+        :param hashed_password: hashed password from database
+        :param raw_password: raw password from user
+        :return: True or False
+        """
+        return await self.__run(check_password, hashed_password, raw_password)
+
+    def get_stats(self) -> PasswordHashStatsDTO:
+        """
+        Returns queue depth and latency of hashing
+        :return: PasswordHashStatsDTO
+        """
+        with self.__lock:
+            average_latency: float = self.__total_latency / self.__completed if self.__completed > 0 else 0.0
+
+            return PasswordHashStatsDTO(workers=self.__workers, queue_depth=self.__queue_depth,
+                                        max_queue_depth=self.__max_queue_depth, completed=self.__completed,
+                                        rejected=self.__rejected, average_latency_ms=average_latency * 1000,
+                                        max_latency_ms=self.__max_latency * 1000)
+
+    def shutdown(self) -> None:
+        """
+        Stops worker processes
+        :return: None
+        """
+        with self.__lock:
+            if self.__executor is not None:
+                self.__executor.shutdown(wait=False, cancel_futures=True)
+                self.__executor = None
+
+    async def __run(self, function: Callable, *args) -> Any:
+        """
+        Runs function in worker process and measures latency
+        :param function: module-level function, it is pickled by name
+        :param args: arguments of function
+        :return: result of function
+        """
+        with self.__lock:
+            if self.__queue_depth >= self.__max_queue_depth:
+                self.__rejected += 1
+                password_hash_rejected.inc()
+                raise PasswordHashPoolIsFull()
+
+            self.__queue_depth += 1
+            password_hash_queue_depth.inc()
+
+            # Processes are started on first use, not on import
+            if self.__executor is None:
+                self.__executor = ProcessPoolExecutor(max_workers=self.__workers,
+                                                      mp_context=multiprocessing.get_context("spawn"))
+
+            executor: ProcessPoolExecutor = self.__executor
+
+        started_at: float = time.perf_counter()
+
+        try:
+            return await asyncio.get_running_loop().run_in_executor(executor, function, *args)
+        finally:
+            latency: float = time.perf_counter() - started_at
+
+            with self.__lock:
+                self.__queue_depth -= 1
+                self.__completed += 1
+                self.__total_latency += latency
+                self.__max_latency = max(self.__max_latency, latency)
+
+            password_hash_queue_depth.dec()
+            password_hash_duration.observe(latency)
+
+def get_token_claims(token: Annotated[str, Depends(oauth2_bearer)]) -> TokenClaims:
+    """
+    Get verified claims from JWToken
+    Signature of the same token is checked once, then claims are taken from VerifiedTokenCache until token expires
     :param token: JWT
 
-    :raises JWTError: if user not found or expired
-    :return: username str
+    :raises HTTPException: if token could not be verified or expired
+    :return: TokenClaims
     """
+    token_claims: TokenClaims | None = verified_token_cache.get(token)
+
+    if token_claims is not None:
+        return token_claims
+
     try:
         payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
         username: str | None = payload.get("sub")
@@ -100,7 +236,7 @@ def get_user_from_jwt(token: Annotated[str, Depends(oauth2_bearer)]) -> str:
         expiration_date: str | None = payload.get("exp")
         if username is None or user_id is None:
             raise UserNotFound
-    except JWTError:
+    except (JWTError, UserNotFound):
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Не смог проверить JWT",
                             headers={"WWW-Authenticate": "Bearer"},)
 
@@ -108,18 +244,66 @@ def get_user_from_jwt(token: Annotated[str, Depends(oauth2_bearer)]) -> str:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="JWT просрочен",
                             headers={"WWW-Authenticate": "Bearer"}, )
 
+    token_claims = TokenClaims(username=username, user_id=int(user_id), expires_at=int(expiration_date),
+                               cube_names=payload.get("cubes"), acl_version=payload.get("acl"))
+
+    verified_token_cache.put(token, token_claims)
+
+    return token_claims
+
+def get_user_from_jwt(token: Annotated[str, Depends(oauth2_bearer)]) -> str:
+    """
+    Get user name from JWToken
+    :param token: JWT
+
+    :raises HTTPException: if token could not be verified or expired
+    :return: username str
+    """
+    return get_token_claims(token).username
+
+def get_admin_from_jwt(token: Annotated[str, Depends(oauth2_bearer)]) -> str:
+    """
+    Get username from JWToken and check that user is admin
+    Admins are listed in ADMIN_USERNAMES
+
+    :param token: JWT
+
+    :raises HTTPException: if token could not be verified or user is not admin
+    :return: username str
+    """
+    username: str = get_user_from_jwt(token)
+
+    if username not in settings.ADMIN_USERNAMES:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Нет прав администратора")
+
     return username
 
-def cube_security_check(username: str, cube_name: str, db: Session) -> None:
+@traced("cube_security_check")
+def cube_security_check(username: str, cube_name: str, db: Session, token_claims: TokenClaims | None = None) -> None:
     """
     Checks if user has access to cube
+    Grants from JWT are trusted if they have the same acl_version as loaded AclCache.
+    Otherwise grants are taken from process-wide AclCache, database is queried only if cache was never loaded
 
     :param username: username
     :param cube_name: cube_name
     :param db: Session
+    :param token_claims: verified claims of JWT. Could contain grants
     :raises HTTPException: if No access to cube
     :return: None
     """
+    if is_token_grants_valid(token_claims):
+        if cube_name not in token_claims.cube_names:
+            raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Нет доступа к кубу")
+
+        return
+
+    if acl_cache.is_loaded():
+        if not acl_cache.has_access(username, cube_name):
+            raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Нет доступа к кубу")
+
+        return
+
     app_user: AppUser = get_user_by_username(username, db)
 
     cubes: list[OlapTable] = app_user.olap_tables
@@ -131,3 +315,18 @@ def cube_security_check(username: str, cube_name: str, db: Session) -> None:
 
     if cube_name not in cubes_user_can_access:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Нет доступа к кубу")
+
+def is_token_grants_valid(token_claims: TokenClaims | None) -> bool:
+    """
+    Grants from token are valid while nothing has changed in access rights since login
+    Comparison is made with acl_version of AclCache, so no database query is needed
+    :param token_claims: verified claims of JWT
+    :return: True if cube names from token could be trusted
+    """
+    if (token_claims is None) or (token_claims.cube_names is None) or (token_claims.acl_version is None):
+        return False
+
+    return (acl_cache.get_version() is not None) and (token_claims.acl_version == acl_cache.get_version())
+
+
+password_hash_pool: PasswordHashPool = PasswordHashPool(settings.PASSWORD_HASH_WORKERS, settings.PASSWORD_HASH_MAX_QUEUE)
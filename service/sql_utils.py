@@ -0,0 +1,23 @@
+import hashlib
+import re
+
+# String literals are kept as they are, everything else is collapsed to one space
+_SQL_NORMALIZE_PATTERN = re.compile(r"('(?:[^']|'')*')|\s+")
+
+
+def normalize_sql(sql: str) -> str:
+    """
+    Makes same queries with different formatting look the same
+    :param sql: sql query
+    :return: normalized sql query
+    """
+    return _SQL_NORMALIZE_PATTERN.sub(lambda match: match.group(1) or " ", sql).strip()
+
+
+def get_sql_fingerprint(sql: str) -> str:
+    """
+    Short stable identifier of query, used as cache key and in logs
+    :param sql: sql query
+    :return: sha1 of normalized query
+    """
+    return hashlib.sha1(normalize_sql(sql).encode("utf-8")).hexdigest()
@@ -0,0 +1,65 @@
+import datetime
+import threading
+
+from model.dto import TableStatistics
+
+
+class TableStatisticsCatalog:
+    """
+    Statistics of cube tables (sizes, number of rows, distinct values of columns)
+    Catalog is refreshed in background, so optimizer could read it without extra queries to database
+    Whole catalog is replaced on refresh, readers never see half-refreshed data
+    """
+
+    def __init__(self) -> None:
+        self.__tables: dict[str, TableStatistics] = {}
+        self.__refreshed_at: datetime.datetime | None = None
+        self.__lock: threading.Lock = threading.Lock()
+
+    def update(self, tables: dict[str, TableStatistics]) -> None:
+        """
+        Replaces statistics of all tables
+        :param tables: statistics by table name
+        :return: None
+        """
+        with self.__lock:
+            self.__tables = tables
+            self.__refreshed_at = datetime.datetime.now()
+
+    def get_table(self, table_name: str) -> TableStatistics | None:
+        """
+        Returns statistics of table
+        :param table_name: table name as in cube structure
+        :return: TableStatistics or None if table is unknown
+        """
+        with self.__lock:
+            return self.__tables.get(table_name, None)
+
+    def get_rows_no(self, table_name: str) -> int | None:
+        """
+        Returns estimated number of rows in table
+        :param table_name: table name as in cube structure
+        :return: number of rows or None if it is unknown
+        """
+        table_statistics: TableStatistics | None = self.get_table(table_name)
+
+        if table_statistics is None:
+            return None
+
+        return table_statistics.rows_no
+
+    def get_tables(self) -> dict[str, TableStatistics]:
+        """
+        Returns statistics of all tables
+        :return: statistics by table name
+        """
+        with self.__lock:
+            return dict(self.__tables)
+
+    def get_refreshed_at(self) -> datetime.datetime | None:
+        """
+        Returns time of the last refresh
+        :return: datetime or None if catalog was never refreshed
+        """
+        with self.__lock:
+            return self.__refreshed_at
@@ -0,0 +1,67 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from model.dto import TokenClaims
+
+
+class VerifiedTokenCache:
+    """
+    Claims of tokens which signature was already verified
+    Tokens are kept until they expire, least recently used tokens are evicted after :param max_entries:
+    Key is hash of the complete token, so changed payload with old signature is never found
+    """
+
+    def __init__(self, max_entries: int) -> None:
+        """
+        :param max_entries: maximum number of tokens. 0 disables cache
+        """
+        self.__max_entries: int = max_entries
+        self.__claims: OrderedDict[str, TokenClaims] = OrderedDict()
+        self.__lock: threading.Lock = threading.Lock()
+
+    @staticmethod
+    def __get_key(token: str) -> str:
+        return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+    def get(self, token: str) -> TokenClaims | None:
+        """
+        Returns claims of verified token
+        :param token: JWT
+        :return: TokenClaims or None if token was not verified or has expired
+        """
+        key: str = self.__get_key(token)
+
+        with self.__lock:
+            token_claims: TokenClaims | None = self.__claims.get(key, None)
+
+            if token_claims is None:
+                return None
+
+            if token_claims.expires_at <= time.time():
+                del self.__claims[key]
+                return None
+
+            self.__claims.move_to_end(key)
+
+            return token_claims
+
+    def put(self, token: str, token_claims: TokenClaims) -> None:
+        """
+        Saves claims of verified token
+        :param token: JWT
+        :param token_claims: claims from verified token
+        :return: None
+        """
+        if self.__max_entries <= 0:
+            return
+
+        key: str = self.__get_key(token)
+
+        with self.__lock:
+            self.__claims[key] = token_claims
+            self.__claims.move_to_end(key)
+
+            while len(self.__claims) > self.__max_entries:
+                self.__claims.popitem(last=False)
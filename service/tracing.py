@@ -0,0 +1,409 @@
+import asyncio
+import contextlib
+import functools
+import inspect
+import json
+import logging
+import random
+import secrets
+import time
+import urllib.error
+import urllib.request
+from collections import deque
+from contextvars import ContextVar
+from typing import Any, Callable, Iterator
+
+from starlette.concurrency import run_in_threadpool
+from starlette.requests import Request
+from starlette.types import ASGIApp, Scope, Receive, Send, Message
+
+from core.config import settings
+from service.metrics import get_route_path
+
+logger = logging.getLogger(__name__)
+
+# Span kinds of OTLP
+SPAN_KIND_INTERNAL: int = 1
+SPAN_KIND_SERVER: int = 2
+
+# Status codes of OTLP
+STATUS_CODE_ERROR: int = 2
+
+TRACEPARENT_HEADER: bytes = b"traceparent"
+
+
+class Span:
+    """
+    One timed operation of traced request
+    Spans are created only inside sampled requests, so not traced requests cost one ContextVar lookup per span
+    """
+
+    def __init__(self, name: str, trace_id: str, parent_span_id: str | None, kind: int,
+                 attributes: dict[str, Any] | None = None) -> None:
+        """
+        :param name: name of the operation
+        :param trace_id: 32 hex chars
+        :param parent_span_id: 16 hex chars or None for root span
+        :param kind: SPAN_KIND_SERVER for request, SPAN_KIND_INTERNAL for stages
+        :param attributes: attributes of the span
+        """
+        self.name: str = name
+        self.trace_id: str = trace_id
+        self.span_id: str = secrets.token_hex(8)
+        self.parent_span_id: str | None = parent_span_id
+        self.kind: int = kind
+        self.attributes: dict[str, Any] = dict(attributes or {})
+        self.start_time_ns: int = time.time_ns()
+        self.end_time_ns: int | None = None
+        self.error: str | None = None
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        self.attributes[key] = value
+
+    def set_attributes(self, attributes: dict[str, Any]) -> None:
+        self.attributes.update(attributes)
+
+    def set_error(self, message: str) -> None:
+        self.error = message
+
+    def end(self) -> None:
+        self.end_time_ns = time.time_ns()
+
+    def to_otlp(self) -> dict:
+        """
+        Converts span to OTLP/JSON
+        :return: dict of Span message
+        """
+        otlp_span: dict = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": self.kind,
+            "startTimeUnixNano": str(self.start_time_ns),
+            "endTimeUnixNano": str(self.end_time_ns or time.time_ns()),
+            "attributes": [{"key": key, "value": get_otlp_value(value)} for key, value in self.attributes.items()
+                           if value is not None],
+            "status": {},
+        }
+
+        if self.parent_span_id is not None:
+            otlp_span["parentSpanId"] = self.parent_span_id
+
+        if self.error is not None:
+            otlp_span["status"] = {"code": STATUS_CODE_ERROR, "message": self.error}
+
+        return otlp_span
+
+
+class _NoSpan:
+    """
+    Span of not traced request. Attributes are thrown away
+    """
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        pass
+
+    def set_attributes(self, attributes: dict[str, Any]) -> None:
+        pass
+
+    def set_error(self, message: str) -> None:
+        pass
+
+
+NO_SPAN: _NoSpan = _NoSpan()
+
+# Span of current request stage. None if request is not traced
+current_span: ContextVar[Span | None] = ContextVar("current_span", default=None)
+
+
+def get_otlp_value(value: Any) -> dict:
+    """
+    Converts attribute value to OTLP AnyValue
+    :param value: str, bool, int or float. Other values are converted to str
+    :return: dict of AnyValue
+    """
+    if isinstance(value, bool):
+        return {"boolValue": value}
+
+    if isinstance(value, int):
+        # int64 is written as string in OTLP/JSON
+        return {"intValue": str(value)}
+
+    if isinstance(value, float):
+        return {"doubleValue": value}
+
+    return {"stringValue": str(value)}
+
+
+class SpanExporter:
+    """
+    Keeps finished spans and exports them in background in OTLP/JSON
+    Spans are written to file, one ExportTraceServiceRequest per line, and/or posted to OTLP/HTTP collector
+    If exporter is behind, the oldest spans are dropped
+    """
+
+    def __init__(self, file_path: str | None, endpoint: str | None, max_queue: int, service_name: str) -> None:
+        """
+        :param file_path: file spans are appended to. None to skip
+        :param endpoint: collector url, e.g. http://localhost:4318/v1/traces. None to skip
+        :param max_queue: finished spans waiting for export
+        :param service_name: service.name of resource
+        """
+        self.__file_path: str | None = file_path
+        self.__endpoint: str | None = endpoint
+        self.__service_name: str = service_name
+        self.__spans: deque[Span] = deque(maxlen=max_queue)
+
+    def is_enabled(self) -> bool:
+        """
+        Checks if spans are exported anywhere. Requests are not traced otherwise
+        :return: True if file or endpoint is set
+        """
+        return bool(self.__file_path) or bool(self.__endpoint)
+
+    def add(self, span: Span) -> None:
+        """
+        Queues finished span. Could be called from any thread
+        :param span: finished span
+        :return: None
+        """
+        self.__spans.append(span)
+
+    def export(self) -> int:
+        """
+        Exports all queued spans. Export errors are logged, spans of failed export are lost
+        :return: number of exported spans
+        """
+        spans: list[Span] = []
+
+        while len(self.__spans) > 0:
+            spans.append(self.__spans.popleft())
+
+        if len(spans) == 0:
+            return 0
+
+        body: bytes = json.dumps(self.create_export_request(spans), separators=(",", ":")).encode("utf-8")
+
+        if self.__file_path:
+            try:
+                with open(self.__file_path, "ab") as trace_file:
+                    trace_file.write(body + b"\n")
+            except OSError as error:
+                logger.warning("Could not write spans to %s: %s", self.__file_path, error)
+
+        if self.__endpoint:
+            request = urllib.request.Request(self.__endpoint, data=body, method="POST",
+                                             headers={"Content-Type": "application/json"})
+
+            try:
+                with urllib.request.urlopen(request, timeout=10):
+                    pass
+            except (urllib.error.URLError, OSError) as error:
+                logger.warning("Could not export spans to %s: %s", self.__endpoint, error)
+
+        return len(spans)
+
+    def create_export_request(self, spans: list[Span]) -> dict:
+        """
+        Creates ExportTraceServiceRequest of OTLP/JSON
+        :param spans: finished spans
+        :return: dict
+        """
+        return {
+            "resourceSpans": [{
+                "resource": {"attributes": [{"key": "service.name",
+                                             "value": get_otlp_value(self.__service_name)}]},
+                "scopeSpans": [{
+                    "scope": {"name": self.__service_name},
+                    "spans": [span.to_otlp() for span in spans],
+                }],
+            }],
+        }
+
+    async def export_forever(self, interval: int) -> None:
+        """
+        Exports spans every :param interval: seconds
+        Should be run as background task and cancelled on shutdown
+        :param interval: seconds between exports
+        :return: None
+        """
+        while True:
+            await asyncio.sleep(interval)
+
+            try:
+                await run_in_threadpool(self.export)
+            except Exception:
+                logger.exception("Could not export spans")
+
+
+span_exporter: SpanExporter = SpanExporter(settings.TRACE_EXPORT_FILE, settings.TRACE_EXPORT_ENDPOINT,
+                                           settings.TRACE_MAX_QUEUE, settings.TRACE_SERVICE_NAME)
+
+
+@contextlib.contextmanager
+def trace_span(name: str, attributes: dict[str, Any] | None = None) -> Iterator[Span | _NoSpan]:
+    """
+    Creates child span of current span. Does nothing if request is not traced
+    Cube name of parent span is copied to child
+
+    :param name: name of the stage
+    :param attributes: attributes known before stage starts
+
+    :return: Span or NO_SPAN, both have set_attribute
+    """
+    parent: Span | None = current_span.get()
+
+    if parent is None:
+        yield NO_SPAN
+        return
+
+    span: Span = Span(name, parent.trace_id, parent.span_id, SPAN_KIND_INTERNAL, attributes)
+
+    if "cube.name" in parent.attributes:
+        span.attributes.setdefault("cube.name", parent.attributes["cube.name"])
+
+    token = current_span.set(span)
+
+    try:
+        yield span
+    except BaseException as error:
+        span.set_error(f"{type(error).__name__}: {error}")
+        raise
+    finally:
+        current_span.reset(token)
+        span.end()
+        span_exporter.add(span)
+
+
+def traced(name: str) -> Callable:
+    """
+    Decorator that runs function inside span. Works with functions and coroutine functions
+    :param name: name of the span
+    :return: decorator
+    """
+    def decorator(function: Callable) -> Callable:
+        if inspect.iscoroutinefunction(function):
+            @functools.wraps(function)
+            async def async_wrapper(*args, **kwargs):
+                with trace_span(name):
+                    return await function(*args, **kwargs)
+
+            return async_wrapper
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with trace_span(name):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def set_span_attributes(attributes: dict[str, Any]) -> None:
+    """
+    Adds attributes to current span. Does nothing if request is not traced
+    :param attributes: attributes
+    :return: None
+    """
+    span: Span | None = current_span.get()
+
+    if span is not None:
+        span.set_attributes(attributes)
+
+
+async def set_span_attributes_from_route(request: Request) -> None:
+    """
+    Router dependency. Adds cube name from path to request span, stages of request inherit it
+    :param request: starlette Request
+    :return: None
+    """
+    if "cube_name" in request.path_params:
+        set_span_attributes({"cube.name": request.path_params["cube_name"]})
+
+
+def parse_traceparent(scope: Scope) -> tuple[str, str | None, bool | None]:
+    """
+    Reads W3C traceparent header, so request continues trace of caller
+    :param scope: ASGI scope
+    :return:
+            [0] trace id, new one if header is missing or invalid
+            [1] parent span id or None
+            [2] sampling decision of caller or None if there is no valid header
+    """
+    for header_name, header_value in scope.get("headers", []):
+        if header_name != TRACEPARENT_HEADER:
+            continue
+
+        parts: list[str] = header_value.decode("latin-1").strip().split("-")
+
+        if (len(parts) == 4) and (len(parts[1]) == 32) and (len(parts[2]) == 16) and (len(parts[3]) == 2):
+            try:
+                flags: int = int(parts[3], 16)
+                int(parts[1], 16)
+                int(parts[2], 16)
+            except ValueError:
+                break
+
+            return parts[1], parts[2], bool(flags & 1)
+
+        break
+
+    return secrets.token_hex(16), None, None
+
+
+class TracingMiddleware:
+    """
+    Creates root span of sampled HTTP request
+    Request is sampled if caller sampled it in traceparent header, otherwise with TRACE_SAMPLE_RATE
+    """
+
+    def __init__(self, app: ASGIApp, sample_rate: float = settings.TRACE_SAMPLE_RATE) -> None:
+        self.app: ASGIApp = app
+        self.sample_rate: float = sample_rate
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if (scope["type"] != "http") or (not span_exporter.is_enabled()):
+            await self.app(scope, receive, send)
+            return
+
+        trace_id, parent_span_id, is_sampled = parse_traceparent(scope)
+
+        if is_sampled is None:
+            is_sampled = random.random() < self.sample_rate
+
+        if not is_sampled:
+            await self.app(scope, receive, send)
+            return
+
+        span: Span = Span(scope["method"], trace_id, parent_span_id, SPAN_KIND_SERVER,
+                          {"http.request.method": scope["method"], "url.path": scope["path"]})
+        status_code: int = 500
+
+        async def send_with_status(message: Message) -> None:
+            nonlocal status_code
+
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+
+            await send(message)
+
+        token = current_span.set(span)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        except BaseException as error:
+            span.set_error(f"{type(error).__name__}: {error}")
+            raise
+        finally:
+            current_span.reset(token)
+
+            route_path: str = get_route_path(scope)
+            span.name = f"{scope['method']} {route_path}"
+            span.set_attributes({"http.route": route_path, "http.response.status_code": status_code})
+
+            if (status_code >= 500) and (span.error is None):
+                span.set_error(f"HTTP {status_code}")
+
+            span.end()
+            span_exporter.add(span)
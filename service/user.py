@@ -2,6 +2,7 @@ from datetime import datetime, timedelta
 from typing import Type
 
 from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
 
 from core.config import settings
 from core.utils.exceptions import UserNotFound, WrongPassword, NoConfirmationCode, UserIsActiveAlready, \
@@ -11,48 +12,67 @@ from model.dto import UserRegisterDTO, ChangeForgottenPassword, AvailableCubes,
 from service.db import create_user, get_confirmation_code, deactivate_code_for_user, set_user_active, \
     get_user_by_username, get_forgot_password_code_by_username, create_forgot_password_code, deactivate_password_code, \
     get_forgot_password_code_by_code, get_user_by_id, change_password_for_user_with_id, \
-    deactivate_forgotten_password_code, get_olap_tables_by_user
+    deactivate_forgotten_password_code, get_olap_tables_by_user, get_acl_version
 from service.mail import send_confirmation_mail, send_forgot_password_mail
-from service.security import create_jwt, hash_password, generate_confirmation_code, check_password, \
-    generate_random_string
+from service.security import create_jwt, generate_confirmation_code, \
+    generate_random_string, password_hash_pool
 
 
-def create_new_user(user_dto: UserRegisterDTO, db: Session, middle_link: str):
+async def create_new_user_async(user_dto: UserRegisterDTO, db: Session, middle_link: str):
     """
     Creates new user in database
+    Password is hashed in password hash pool, database and mail are used in thread pool
+
+    :raises PasswordHashPoolIsFull: if too many passwords are hashed right now
+
     :param user_dto:
     :param middle_link:
     :param db:
     :return:
     """
 
+    hashed_password: str = await password_hash_pool.hash_password(user_dto.password)
+
+    await run_in_threadpool(save_new_user, user_dto, hashed_password, db, middle_link)
+
+
+def save_new_user(user_dto: UserRegisterDTO, hashed_password: str, db: Session, middle_link: str):
+    """
+    Saves new user with already hashed password and sends confirmation code
+    :param user_dto:
+    :param hashed_password: hash of user_dto.password
+    :param db:
+    :param middle_link:
+    :return:
+    """
+
     username: str = user_dto.username
-    password: str = user_dto.password
     email: str = user_dto.email
 
-    hashed_password: str = hash_password(password)
     app_user: AppUser = AppUser(username=username, password=hashed_password, email=email, created_at=datetime.now())
     app_user = create_user(db, app_user)
 
     code: str = generate_confirmation_code(app_user, db)
 
-    send_confirmation_mail(code, app_user.email, middle_link)
+    send_confirmation_mail(code, app_user.email, middle_link, db)
 
 
-def authenticate_user_and_return_jwt(username: str, password: str, db: Session) -> str:
+async def authenticate_user_and_return_jwt_async(username: str, password: str, db: Session) -> str:
     """
     Authenticates user
+    Password is verified in password hash pool, database is used in thread pool
 
     :raises UserNotFound: if user was not found in database
     :raises WrongPassword: if passwords did not match
     :raises UserIsNotActivated: if user was not activated
+    :raises PasswordHashPoolIsFull: if too many passwords are verified right now
 
     :param username:
     :param password:
     :param db: Session
     :return: jwt token
     """
-    app_user: AppUser | None = db.query(AppUser).filter(AppUser.username == username).first()
+    app_user: AppUser | None = await run_in_threadpool(get_user_by_username, username, db)
 
     if app_user is None:
         raise UserNotFound(username)
@@ -60,10 +80,27 @@ def authenticate_user_and_return_jwt(username: str, password: str, db: Session)
     if not app_user.is_active:
         raise UserIsNotActivated
 
-    if not check_password(app_user.password, password):
+    if not await password_hash_pool.check_password(app_user.password, password):
         raise WrongPassword(username)
 
-    return create_jwt(app_user.username, app_user.id)
+    return await run_in_threadpool(create_jwt_for_user, app_user, db)
+
+
+def create_jwt_for_user(app_user: AppUser, db: Session) -> str:
+    """
+    Creates JWT for authenticated user. Adds cube grants if JWT_CUBE_GRANTS is on
+    :param app_user: authenticated user
+    :param db: Session
+    :return: jwt token
+    """
+    if not settings.JWT_CUBE_GRANTS:
+        return create_jwt(app_user.username, app_user.id)
+
+    # Version is read before grants. If grants change in between, token grants are not trusted
+    acl_version: int | None = get_acl_version(db)
+    cube_names: list[str] = [olap_table.name for olap_table in app_user.olap_tables]
+
+    return create_jwt(app_user.username, app_user.id, cube_names, acl_version)
 
 
 
@@ -130,23 +167,44 @@ def send_forgot_password_code(username: str, db: Session) -> None:
 
     create_forgot_password_code(forgot_password_code, db)
 
-    send_forgot_password_mail(code, app_user.email)
+    send_forgot_password_mail(code, app_user.email, db)
 
 
-def change_password_with_code(change_password_dto: ChangeForgottenPassword, db: Session):
+async def change_password_with_code_async(change_password_dto: ChangeForgottenPassword, db: Session):
     """
     Change Forgotten password
+    Password is hashed in password hash pool, database is used in thread pool
+
     :param change_password_dto:
     :param db:
     :raises UserNotFound:
     :raises NoForgotPasswordCode:
+    :raises PasswordHashPoolIsFull: if too many passwords are hashed right now
     :return:
     """
 
-    hashed_password: str
+    forgot_password_code: ForgotPasswordCode
+    app_user: AppUser
+
+    forgot_password_code, app_user = await run_in_threadpool(get_user_by_forgot_password_code,
+                                                             change_password_dto.forgot_code_token, db)
+
+    hashed_password: str = await password_hash_pool.hash_password(change_password_dto.password)
+
+    await run_in_threadpool(save_changed_password, app_user, hashed_password, forgot_password_code, db)
+
+
+def get_user_by_forgot_password_code(forgot_code_token: str, db: Session) -> tuple[ForgotPasswordCode, AppUser]:
+    """
+    Get forgot password code and its user
+    :param forgot_code_token:
+    :param db:
+    :raises UserNotFound:
+    :raises NoForgotPasswordCode:
+    :return: forgot password code, user
+    """
 
-    forgot_password_code: ForgotPasswordCode = get_forgot_password_code_by_code(change_password_dto.forgot_code_token,
-                                                                                db)
+    forgot_password_code: ForgotPasswordCode = get_forgot_password_code_by_code(forgot_code_token, db)
 
     if forgot_password_code is None:
         raise NoForgotPasswordCode
@@ -156,7 +214,19 @@ def change_password_with_code(change_password_dto: ChangeForgottenPassword, db:
     if app_user is None:
         raise UserNotFound
 
-    hashed_password = hash_password(change_password_dto.password)
+    return forgot_password_code, app_user
+
+
+def save_changed_password(app_user: AppUser, hashed_password: str, forgot_password_code: ForgotPasswordCode,
+                          db: Session):
+    """
+    Saves already hashed password and deactivates forgot password code
+    :param app_user:
+    :param hashed_password: hash of new password
+    :param forgot_password_code:
+    :param db:
+    :return:
+    """
 
     change_password_for_user_with_id(app_user.id, hashed_password, db)
     deactivate_forgotten_password_code(forgot_password_code, db)
@@ -0,0 +1,28 @@
+import io
+
+import pytest
+from comradewolf.utils.olap_data_types import OlapFrontend
+
+from model.dto import ExportFormat
+from service.arrow_serializer import chunks_to_bytes
+
+pyarrow = pytest.importorskip("pyarrow")
+pyarrow_parquet = pytest.importorskip("pyarrow.parquet")
+
+
+def test_unknown_column_has_the_same_type_in_every_chunk() -> None:
+    olap_frontend: OlapFrontend = OlapFrontend()
+    olap_frontend.add_field("qty_alias", "value", "Количество", "number")
+    columns: list[str] = ["unknown_alias", "qty_alias__sum"]
+    chunks: list[tuple[list[str], list[tuple]]] = [(columns, [(None, 1), (None, 2)]), (columns, [(10, 3), ("x", 4)])]
+
+    content: bytes = b"".join(chunks_to_bytes(iter(chunks), olap_frontend, ExportFormat.ARROW))
+    table = pyarrow.ipc.open_stream(content).read_all()
+
+    assert table.schema.field("unknown_alias").type == pyarrow.string()
+    assert table.column("unknown_alias").to_pylist() == [None, None, "10", "x"]
+    assert table.column("qty_alias__sum").to_pylist() == [1.0, 2.0, 3.0, 4.0]
+
+    content = b"".join(chunks_to_bytes(iter(chunks), olap_frontend, ExportFormat.PARQUET))
+
+    assert pyarrow_parquet.read_table(io.BytesIO(content)).num_rows == 4
@@ -0,0 +1,104 @@
+import asyncio
+import time
+from functools import partial
+from typing import Callable
+
+from starlette.concurrency import run_in_threadpool
+
+from service.cube import CubeCollection
+
+CUBE_NAME: str = "sales"
+
+
+class FakeOptimizer:
+    """
+    Remembers if it was disposed. Reload only prewarms and disposes optimizers
+    """
+
+    def __init__(self) -> None:
+        self.is_disposed: bool = False
+
+    def prewarm_pool(self, connections: int) -> None:
+        pass
+
+    def dispose(self) -> None:
+        self.is_disposed = True
+
+
+class FakeStructure:
+    def get_front_fields(self) -> dict:
+        return {}
+
+
+def add_fake_cube(optimizer: FakeOptimizer, version: str, cubes: CubeCollection) -> None:
+    cubes.add_cube(CUBE_NAME, optimizer, None, FakeStructure(), None, version=version)
+
+
+async def wait_until(condition: Callable[[], bool], timeout: float = 2.0) -> bool:
+    wait_until_time: float = time.monotonic() + timeout
+
+    while (not condition()) and (time.monotonic() < wait_until_time):
+        await asyncio.sleep(0.01)
+
+    return condition()
+
+
+async def reload_while_request_holds_cube() -> None:
+    cubes: CubeCollection = CubeCollection()
+    old_optimizer: FakeOptimizer = FakeOptimizer()
+    new_optimizer: FakeOptimizer = FakeOptimizer()
+
+    cubes.add_lazy_cube(CUBE_NAME, partial(add_fake_cube, old_optimizer, "1"))
+
+    async with cubes.use_cube_async(CUBE_NAME):
+        assert await cubes.reload_cube_async(CUBE_NAME, partial(add_fake_cube, new_optimizer, "2"))
+
+        # Request keeps the version it started with, also in thread pool
+        assert cubes.get_optimizer(CUBE_NAME) is old_optimizer
+        assert await run_in_threadpool(cubes.get_optimizer, CUBE_NAME) is old_optimizer
+        assert cubes.get_cube_version(CUBE_NAME) == "1"
+
+        assert not await wait_until(lambda: old_optimizer.is_disposed, timeout=0.1)
+
+    assert cubes.get_optimizer(CUBE_NAME) is new_optimizer
+    assert cubes.get_cube_version(CUBE_NAME) == "2"
+
+    assert await wait_until(lambda: old_optimizer.is_disposed)
+    assert not new_optimizer.is_disposed
+
+
+async def reload_without_requests() -> None:
+    cubes: CubeCollection = CubeCollection()
+    old_optimizer: FakeOptimizer = FakeOptimizer()
+
+    cubes.add_lazy_cube(CUBE_NAME, partial(add_fake_cube, old_optimizer, "1"))
+    cubes.get_optimizer(CUBE_NAME)
+
+    await cubes.reload_cube_async(CUBE_NAME, partial(add_fake_cube, FakeOptimizer(), "2"))
+
+    assert await wait_until(lambda: old_optimizer.is_disposed)
+
+
+async def reload_of_not_built_cube() -> None:
+    cubes: CubeCollection = CubeCollection()
+    new_optimizer: FakeOptimizer = FakeOptimizer()
+
+    cubes.add_lazy_cube(CUBE_NAME, partial(add_fake_cube, FakeOptimizer(), "1"))
+
+    assert not await cubes.reload_cube_async(CUBE_NAME, partial(add_fake_cube, new_optimizer, "2"))
+    assert not cubes.is_cube_built(CUBE_NAME)
+
+    async with cubes.use_cube_async(CUBE_NAME) as cube:
+        assert cube.get_optimizer() is new_optimizer
+
+
+def test_previous_version_is_disposed_after_request_has_released_it() -> None:
+    asyncio.run(reload_while_request_holds_cube())
+
+
+def test_previous_version_without_requests_is_disposed_at_once() -> None:
+    asyncio.run(reload_without_requests())
+
+
+def test_not_built_cube_is_built_with_new_definition() -> None:
+    asyncio.run(reload_of_not_built_cube())
@@ -0,0 +1,87 @@
+import json
+
+import pytest
+from sqlalchemy import TextClause
+
+from model.base_model import SavedQuery
+from service.cube import CubeCollection
+from service.optimizer_postgres import PostgresQueryMixin
+
+ROWS_SQL: str = """select * from (values (1, 'a'), (2, null), (null, 'c'), (2, 'b'), (3, 'd'), (null, null))
+    as t(k1, k2)"""
+
+
+def render(query: TextClause) -> str:
+    return str(query.compile(compile_kwargs={"literal_binds": True}))
+
+
+def test_offset_page_without_keys() -> None:
+    query: str = render(PostgresQueryMixin.create_page_query("select 1", 2, 10, None, None))
+
+    assert query == "select 1 \noffset 20 limit 10"
+
+
+def test_first_keyset_page_is_ordered_with_nulls_last() -> None:
+    query: str = render(PostgresQueryMixin.create_page_query("select 1", 0, 10, ["k1", "k2"], None))
+
+    assert 'order by "k1" nulls last, "k2" nulls last' in query
+    assert "offset 0 limit 10" in query
+
+
+def test_seek_keeps_rows_with_null_keys() -> None:
+    query: str = render(PostgresQueryMixin.create_page_query("select 1", 1, 10, ["k1", "k2"], [1, "a"]))
+
+    assert "where (\"k1\" > '1' or \"k1\" is null) or " \
+           "(\"k1\" = '1' and (\"k2\" > 'a' or \"k2\" is null))" in query
+
+
+def test_seek_after_null_key() -> None:
+    query: str = render(PostgresQueryMixin.create_page_query("select 1", 1, 10, ["k1", "k2"], [None, "c"]))
+
+    assert "where (\"k1\" is null and (\"k2\" > 'c' or \"k2\" is null))" in query
+
+
+def test_seek_after_last_possible_key() -> None:
+    query: str = render(PostgresQueryMixin.create_page_query("select 1", 1, 10, ["k1", "k2"], [None, None]))
+
+    assert "where false" in query
+
+
+def test_keyset_pages_return_every_row() -> None:
+    duckdb = pytest.importorskip("duckdb")
+    connection = duckdb.connect()
+
+    expected: list[tuple] = connection.sql(f"select * from ({ROWS_SQL}) order by k1 nulls last, "
+                                           f"k2 nulls last").fetchall()
+    selected: list[tuple] = []
+    last_key: list | None = None
+
+    for page in range(len(expected) + 1):
+        query: str = render(PostgresQueryMixin.create_page_query(ROWS_SQL, page, 2, ["k1", "k2"], last_key))
+        rows: list[tuple] = connection.sql(query).fetchall()
+
+        if len(rows) == 0:
+            break
+
+        selected += rows
+        # Keys are saved as json, so they come back as they would from saved_query.page_keys
+        last_key = json.loads(json.dumps(CubeCollection.get_page_last_key(["k1", "k2"], rows, ["k1", "k2"])))
+
+    assert selected == expected
+
+
+def test_page_last_key() -> None:
+    rows: list[tuple] = [(1, "a", 10), (None, "b", 20)]
+
+    assert CubeCollection.get_page_last_key(["k1", "k2", "value"], rows, ["k2", "k1"]) == ["b", None]
+    assert CubeCollection.get_page_last_key(["k1"], [], ["k1"]) is None
+    assert CubeCollection.get_page_last_key(["k1"], rows, None) is None
+
+
+def test_page_keys_of_saved_query() -> None:
+    saved_query: SavedQuery = SavedQuery(order_by_keys=json.dumps(["k1", "k2"]),
+                                         page_keys=json.dumps({"0": [None, "c"]}))
+
+    assert CubeCollection.get_page_keys(saved_query, 1) == (["k1", "k2"], {"0": [None, "c"]}, [None, "c"])
+    assert CubeCollection.get_page_keys(saved_query, 3)[2] is None
+    assert CubeCollection.get_page_keys(SavedQuery(), 1) == (None, {}, None)
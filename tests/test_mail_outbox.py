@@ -0,0 +1,139 @@
+import datetime
+import os
+import socket
+from typing import Iterator
+
+import pytest
+
+aiosmtpd_controller = pytest.importorskip("aiosmtpd.controller")
+
+# Outbox is kept in metadata database, engine is created on import
+if not os.getenv("POSTGRES_SERVER"):
+    pytest.skip("Metadata database is not configured", allow_module_level=True)
+
+from sqlalchemy import delete, text
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+
+from core.config import settings
+from core.database import SessionLocal
+from model.base_model import MailOutbox
+from service.mail_outbox import MailOutboxSender
+
+EMAIL_TO: str = "outbox-test@example.com"
+RETRY_DELAY: int = 30
+# Mails are claimed in order of next attempt. Test mail is due before any real one,
+# so sender with batch of one mail never claims mails the test did not create
+FIRST_IN_OUTBOX: datetime.datetime = datetime.datetime(2000, 1, 1)
+
+
+class RecordingHandler:
+    """
+    Keeps envelopes received by SMTP server
+    """
+
+    def __init__(self) -> None:
+        self.envelopes: list = []
+
+    async def handle_DATA(self, server, session, envelope) -> str:
+        self.envelopes.append(envelope)
+
+        return "250 OK"
+
+
+def get_free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+
+        return sock.getsockname()[1]
+
+
+@pytest.fixture
+def db() -> Iterator[Session]:
+    with SessionLocal() as session:
+        try:
+            session.execute(text("select 1 from comradewolf.mail_outbox limit 1"))
+        except OperationalError:
+            pytest.skip("Metadata database is not available")
+
+        session.execute(delete(MailOutbox).where(MailOutbox.email_to == EMAIL_TO))
+        session.commit()
+
+        yield session
+
+        session.rollback()
+        session.execute(delete(MailOutbox).where(MailOutbox.email_to == EMAIL_TO))
+        session.commit()
+
+
+@pytest.fixture
+def smtp_port(monkeypatch: pytest.MonkeyPatch) -> int:
+    port: int = get_free_port()
+
+    monkeypatch.setattr(settings, "MAIL_SERVER", "127.0.0.1")
+    monkeypatch.setattr(settings, "MAIL_PORT", port)
+    monkeypatch.setattr(settings, "MAIL_USE_SSL", "false")
+    monkeypatch.setattr(settings, "MAIL_USE_TLS", "false")
+    monkeypatch.setattr(settings, "MAIL_USERNAME", None)
+    monkeypatch.setattr(settings, "MAIL_DEFAULT_SENDER", "noreply@example.com")
+
+    return port
+
+
+def queue_test_mail(sender: MailOutboxSender, db: Session) -> MailOutbox:
+    sender.queue_mail(db, EMAIL_TO, "Код подтверждения", "<b>1234</b>")
+    mail: MailOutbox = db.query(MailOutbox).filter(MailOutbox.email_to == EMAIL_TO).one()
+
+    set_first_in_outbox(db, mail)
+
+    return mail
+
+
+def set_first_in_outbox(db: Session, mail: MailOutbox) -> None:
+    mail.next_attempt_at = FIRST_IN_OUTBOX
+    db.commit()
+
+
+def test_queued_mail_is_sent(db: Session, smtp_port: int) -> None:
+    sender: MailOutboxSender = MailOutboxSender(batch_size=1, max_attempts=3, retry_delay=RETRY_DELAY)
+    handler: RecordingHandler = RecordingHandler()
+    controller = aiosmtpd_controller.Controller(handler, hostname="127.0.0.1", port=smtp_port)
+
+    mail: MailOutbox = queue_test_mail(sender, db)
+
+    controller.start()
+
+    try:
+        assert sender.send_batch(db) == 1
+    finally:
+        controller.stop()
+
+    db.refresh(mail)
+
+    assert (mail.status, mail.attempts, mail.last_error) == ("sent", 1, None)
+    assert [envelope.rcpt_tos for envelope in handler.envelopes] == [[EMAIL_TO]]
+    assert sender.get_stats(db).sent == 1
+
+
+def test_mail_is_retried_with_backoff_while_server_is_down(db: Session, smtp_port: int) -> None:
+    sender: MailOutboxSender = MailOutboxSender(batch_size=1, max_attempts=3, retry_delay=RETRY_DELAY)
+    mail: MailOutbox = queue_test_mail(sender, db)
+
+    for attempt, retry_in in [(1, RETRY_DELAY), (2, 2 * RETRY_DELAY)]:
+        started_at: datetime.datetime = datetime.datetime.now()
+
+        assert sender.send_batch(db) == 1
+
+        db.refresh(mail)
+        assert (mail.status, mail.attempts) == ("pending", attempt)
+        assert mail.last_error is not None
+        assert started_at + datetime.timedelta(seconds=retry_in - 1) <= mail.next_attempt_at <= \
+               datetime.datetime.now() + datetime.timedelta(seconds=retry_in)
+
+        set_first_in_outbox(db, mail)
+
+    assert sender.send_batch(db) == 1
+
+    db.refresh(mail)
+    assert (mail.status, mail.attempts) == ("failed", 3)
+    assert sender.get_stats(db).send_errors == 3